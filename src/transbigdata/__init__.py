@@ -106,9 +106,25 @@ from .grids import (
     GPS_to_grid,
     grid_to_centre,
     grid_to_polygon,
+    grid_to_key,
+    key_to_grid,
     grid_to_area,
     grid_to_params,
     grid_params_optimize,
+    grid_index_gini,
+    grid_index_centerdist,
+    grid_index_gridscount,
+    grid_kring,
+    grid_ring,
+    grid_distance,
+    grid_adjacency,
+    grid_level_params,
+    grid_to_parent,
+    grid_to_children,
+    grid_rollup,
+    GridSystem,
+    GridZoneLookup,
+    GridBoundaryMask,
     # old
     rect_grids,
     grid_params,
@@ -150,7 +166,9 @@ from .preprocess import (
     clean_traj,
     dataagg,
     id_reindex_disgap,
-    id_reindex
+    id_reindex,
+    StreamCleaner,
+    normalize_dtypes
 )
 from .bikedata import (
     bikedata_to_od
@@ -167,6 +185,7 @@ from .mobilephonedata import (
     mobile_stay_dutation,
     mobile_identify_home,
     mobile_identify_work,
+    mobile_stay_point,
     #old    
     plot_activity,
     traj_stay_move,
@@ -198,6 +217,12 @@ from .metro import (
     get_shortest_path,
     get_k_shortest_paths
 )
+from .partition import (
+    partition_by_id,
+    read_partition,
+    chunked_apply,
+    parallel_apply
+)
 from .visualization import (
     visualization_trip,
     visualization_od,
@@ -92,7 +92,8 @@ def busgps_arriveinfo(data, line, stop, col=[
     print('.', end='')
     data = clean_same(data, col=[VehicleId, GPSDateTime, lon, lat])
     print('.', end='')
-    data = clean_outofshape(data, line_buffer, col=[lon, lat], accuracy=500)
+    data = clean_outofshape(data, line_buffer, col=[lon, lat], accuracy=500,
+                            exact=False)
     print('.')
     data = id_reindex(data, VehicleId, timegap=timegap,
                       timecol=GPSDateTime, suffix='')
@@ -35,6 +35,8 @@ x_pi = 3.14159265358979324 * 3000.0 / 180.0
 pi = 3.1415926535897932384626
 a = 6378245.0
 ee = 0.00669342162296594323
+# int32 coordinates are stored in 1e-6 degrees, see normalize_dtypes
+coord_scale = 1000000
 
 
 def gcj02tobd09(lng, lat):
@@ -344,10 +346,10 @@ def getdistance(lon1, lat1, lon2, lat2):
 
     '''
     try:
-        lon1 = lon1.astype(float)
-        lat1 = lat1.astype(float)
-        lon2 = lon2.astype(float)
-        lat2 = lat2.astype(float)
+        lon1 = coord_float(lon1)
+        lat1 = coord_float(lat1)
+        lon2 = coord_float(lon2)
+        lat2 = coord_float(lat2)
     except Exception:
         lon1 = float(lon1)
         lat1 = float(lat1)
@@ -406,3 +408,11 @@ def transform_shape(gdf, method):
     gdf1 = gdf.copy()
     gdf1['geometry'] = gdf1['geometry'].apply(lambda r: transform(method, r))
     return gdf1
+
+
+def coord_float(values):
+    # Coordinates as float64, int32 coordinates are scaled back to degrees.
+    # float64 values are returned without copying
+    if values.dtype == np.int32:
+        return values / coord_scale
+    return values.astype(float, copy=False)
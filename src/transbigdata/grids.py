@@ -33,14 +33,18 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import geopandas as gpd
 import pandas as pd
 from shapely.geometry import Polygon
+import os
+import json
 import math
 import numpy as np
-from .coordinates import getdistance
-from .gisprocess import merge_polygon
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from .coordinates import getdistance, coord_float
 import warnings
 
 
-def area_to_grid(location, accuracy=500, method='rect', params='auto'):
+def area_to_grid(location, accuracy=500, method='rect', params='auto',
+                 prefilter=False):
     '''
     从研究范围生成栅格
 
@@ -54,6 +58,8 @@ def area_to_grid(location, accuracy=500, method='rect', params='auto'):
         `rect`方形, `tri`三角形或`hexa`六边形
     params : list or dict
         栅格参数。如果给定了栅格参数，`accuracy`参数将不起作用
+    prefilter : bool
+        仅在location为面要素时有效。为True时先用面要素的空间索引（STRtree）筛选外接矩形相交的栅格，再对这些栅格做精确的相交判断，面要素复杂或栅格数量多时可显著加速
 
     Returns
     -------
@@ -68,7 +74,7 @@ def area_to_grid(location, accuracy=500, method='rect', params='auto'):
         bounds = location
     elif type(location) == gpd.geodataframe.GeoDataFrame:
         shape = location
-        bounds = shape.unary_union.bounds
+        bounds = shape.total_bounds
     else:
         raise Exception(
             'Location should be either bounds(List) or shape(GeoDataFrame)')
@@ -97,52 +103,26 @@ def area_to_grid(location, accuracy=500, method='rect', params='auto'):
         params = convertparams(params)
         method = params['method']
     if method == 'rect':
-        tmppoints = pd.DataFrame(np.array(
-            np.meshgrid(
-                np.arange(bounds[0] - deltaLon,
-                          bounds[2] + deltaLon,
-                          deltaLon/3),
-                np.arange(bounds[1]-deltaLat,
-                          bounds[3]+deltaLat,
-                          deltaLat/3))
-        ).reshape(2, -1).T,
-            columns=['lon', 'lat'])
-        tmppoints['LONCOL'], tmppoints['LATCOL'] = GPS_to_grid(
-            tmppoints['lon'], tmppoints['lat'], params)
-        tmppoints = tmppoints[['LONCOL', 'LATCOL']].drop_duplicates()
-        tmppoints['geometry'] = grid_to_polygon(
-            [tmppoints['LONCOL'], tmppoints['LATCOL']], params)
-        tmppoints = gpd.GeoDataFrame(tmppoints)
-    if (method == 'tri') | (method == 'hexa'):
-        tmppoints = pd.DataFrame(
-            np.array(
-                np.meshgrid(
-                    np.arange(bounds[0]-deltaLon,
-                              bounds[2] + deltaLon,
-                              deltaLon/3),
-                    np.arange(bounds[1]+deltaLat,
-                              bounds[3]-deltaLat,
-                              deltaLat/3))
-            ).reshape(2, -1).T, columns=['lon', 'lat'])
-        tmppoints['loncol_1'],\
-            tmppoints['loncol_2'],\
-            tmppoints['loncol_3'] = GPS_to_grid(
-            tmppoints['lon'], tmppoints['lat'], params)
-        tmppoints = tmppoints[['loncol_1',
-                               'loncol_2', 'loncol_3']].drop_duplicates()
-        tmppoints['geometry'] = grid_to_polygon(
-            [tmppoints['loncol_1'],
-             tmppoints['loncol_2'],
-             tmppoints['loncol_3']], params)
-        tmppoints = gpd.GeoDataFrame(tmppoints)
-    data = tmppoints
+        columns = ['LONCOL', 'LATCOL']
+    else:
+        columns = ['loncol_1', 'loncol_2', 'loncol_3']
+    gridid = grids_in_bounds(bounds, params)
+    data = pd.DataFrame(np.array(gridid).T, columns=columns)
+    data['geometry'] = grid_to_polygon(gridid, params)
+    data = gpd.GeoDataFrame(data)
     params['gridsize'] = accuracy
     if type(shape) != gpd.geodataframe.GeoDataFrame:
         grid = gpd.GeoDataFrame(data)
         return grid, params
     else:
         data.crs = shape.crs
-        data = data[data.intersects(shape.unary_union)]
+        if prefilter:
+            # The spatial index of the shape tests the bounding boxes first,
+            # the exact intersection is only computed for the candidates
+            hit = grid_sindex_query(shape, data.geometry)
+            data = data.iloc[np.unique(hit)]
+        else:
+            data = data[data.intersects(shape.unary_union)]
         grid = gpd.GeoDataFrame(data)
         return grid, params
 
@@ -192,7 +172,8 @@ def area_to_params(location, accuracy=500, method='rect'):
     return params
 
 
-def GPS_to_grid(lon, lat, params):
+def GPS_to_grid(lon, lat, params, packed=False, chunksize=None, out=None,
+                n_jobs=1):
     '''
     GPS数据对应栅格编号
     
@@ -204,8 +185,16 @@ def GPS_to_grid(lon, lat, params):
         经度列
     lat : Series
         纬度列
-    params : list or dict
+    params : list, dict or GridSystem
         栅格参数
+    packed : bool
+        是否输出单列int64栅格编号（见 :func:`transbigdata.grid_to_key` ）
+    chunksize : int
+        分块计算时每块的数据量。设置后按块计算栅格编号，计算过程的内存占用只与块大小有关，与数据量无关
+    out : list or ndarray
+        预先分配的输出数组，计算结果直接写入其中。packed为False时为与数据等长的整数数组（int32或int64）两列（方形栅格）或三列（三角形、六边形栅格）；packed为True时为与数据等长的int64数组
+    n_jobs : int
+        分块计算使用的线程数，-1为使用全部CPU核心。NumPy计算时释放GIL，多线程可并行计算各块
 
     Returns
     -------
@@ -213,19 +202,18 @@ def GPS_to_grid(lon, lat, params):
         方形栅格输出: 栅格编号两列
     [loncol_1,loncol_2,loncol_3] : list
         三角形、六边形栅格输出: 栅格编号三列
+    gridkey : ndarray
+        packed为True时输出: 单列int64栅格编号
 
     '''
-    params = convertparams(params)
-    method = params['method']
-    if method == 'rect':
-        loncol, latcol = GPS_to_grids_rect(lon, lat, params)
-        return [loncol, latcol]
-    if method == 'tri':
-        loncol_1, loncol_2, loncol_3 = GPS_to_grids_tri(lon, lat, params)
-        return [loncol_1, loncol_2, loncol_3]
-    if method == 'hexa':
-        loncol_1, loncol_2, loncol_3 = GPS_to_grids_hexa(lon, lat, params)
-        return [loncol_1, loncol_2, loncol_3]
+    grid = gridsystem(params)
+    gridid = grid.to_grid(lon, lat, packed=packed, chunksize=chunksize,
+                          out=out, n_jobs=n_jobs)
+    if (not packed) and (out is None) and (grid.method != 'hexa') and \
+            (len(gridid[0]) == 1):
+        # Single point gives the grid ID as numbers
+        gridid = [col[0] for col in gridid]
+    return gridid
 
 
 def grid_to_centre(gridid, params):
@@ -236,14 +224,15 @@ def grid_to_centre(gridid, params):
 
     Parameters
     -------
-    gridid : list
+    gridid : list or ndarray
         方形栅格:
         [LONCOL,LATCOL] : list
             栅格编号两列
         三角形、六边形栅格:
         [loncol_1,loncol_2,loncol_3] : list
             栅格编号三列
-    params : list or dict
+        单列int64栅格编号（见 :func:`transbigdata.grid_to_key` ）
+    params : list, dict or GridSystem
         栅格参数
 
     Returns
@@ -253,67 +242,12 @@ def grid_to_centre(gridid, params):
     HBLAT : Series
         栅格中心点纬度列
     '''
-    params = convertparams(params)
-    method = params['method']
-    if method == 'rect':
-        loncol, latcol = gridid
-        loncol = pd.Series(loncol, name='loncol')
-        latcol = pd.Series(latcol, name='latcol')
-        return grid_to_centre_rect(loncol, latcol, params, from_origin=False)
-    if method == 'tri':
-        loncol_1, loncol_2, loncol_3 = gridid
-        loncol_1 = pd.Series(loncol_1, name='loncol_1')
-        loncol_2 = pd.Series(loncol_2, name='loncol_2')
-        loncol_3 = pd.Series(loncol_3, name='loncol_3')
-        testpoint = gettripoints(loncol_1, loncol_2, loncol_3, params)
-        hblon = ((testpoint['p1_x']+testpoint['p2_x'] +
-                 testpoint['p3_x'])/3).values
-        hblat = ((testpoint['p1_y']+testpoint['p2_y'] +
-                 testpoint['p3_y'])/3).values
-        return hblon, hblat
-    if method == 'hexa':
-        loncol_1, loncol_2, loncol_3 = gridid
-        loncol_1 = pd.Series(loncol_1, name='loncol_1')
-        loncol_2 = pd.Series(loncol_2, name='loncol_2')
-        loncol_3 = pd.Series(loncol_3, name='loncol_3')
-        lonStart = params['slon']
-        latStart = params['slat']
-        deltaLon = params['deltalon']
-        deltaLat = params['deltalat']
-        theta = params['theta']
-        params = [lonStart, latStart, deltaLon, deltaLat, theta]
-        x1, y1 = grid_to_centre_rect(
-            loncol_1, np.zeros(len(loncol_1))-5,
-            params=[params[0], params[1], params[2], params[3], theta+0])
-        x2, y2 = grid_to_centre_rect(
-            loncol_1, np.zeros(len(loncol_1))+5,
-            params=[params[0], params[1], params[2], params[3], theta+0])
-        x3, y3 = grid_to_centre_rect(
-            loncol_2, np.zeros(len(loncol_2))-5,
-            params=[params[0], params[1], params[2], params[3], theta+60])
-        x4, y4 = grid_to_centre_rect(
-            loncol_2, np.zeros(len(loncol_2))+5,
-            params=[params[0], params[1], params[2], params[3], theta+60])
-        x1 = pd.Series(x1)
-        x2 = pd.Series(x2)
-        x3 = pd.Series(x3)
-        x4 = pd.Series(x4)
-        y1 = pd.Series(y1)
-        y2 = pd.Series(y2)
-        y3 = pd.Series(y3)
-        y4 = pd.Series(y4)
-
-        def intersection(x1, y1, x2, y2, x3, y3, x4, y4):
-            if np.allclose((x2[0]-x1[0]), 0):
-                return x1, (x1-x3)*(y3-y4)/(x3-x4)+y3
-            elif np.allclose((x3[0]-x4[0]), 0):
-                return x3, (x3-x1)*(y1-y2)/(x1-x2)+y1
-            x = (x1*(y2-y1)/(x2-x1)-x3/(x4-x3)*(y4-y3)+y3-y1) / \
-                ((y2-y1)/(x2-x1)-(y4-y3)/(x4-x3))
-            y = (x-x1)*(y2-y1)/(x2-x1)+y1
-            return x, y
-        hblon, hblat = intersection(x1, y1, x2, y2, x3, y3, x4, y4)
-        return hblon.values, hblat.values
+    grid = gridsystem(params)
+    hblon, hblat = grid.to_centre(gridid)
+    if (grid.method == 'rect') & (len(hblon) == 1):
+        # Single grid gives the centre as numbers
+        return hblon[0], hblat[0]
+    return hblon, hblat
 
 
 def grid_to_polygon(gridid, params):
@@ -324,35 +258,104 @@ def grid_to_polygon(gridid, params):
 
     Parameters
     -------
-    gridid : list
+    gridid : list or ndarray
         方形栅格:
         [LONCOL,LATCOL] : list
             栅格编号两列
         三角形、六边形栅格:
         [loncol_1,loncol_2,loncol_3] : list
             栅格编号三列
-    params : list or dict
+        单列int64栅格编号（见 :func:`transbigdata.grid_to_key` ）
+    params : list, dict or GridSystem
         栅格参数
     Returns
     -------
     geometry : Series
         栅格的矢量图形列
     '''
+    return gridsystem(params).to_polygon(gridid)
+
+
+def grid_to_key(gridid, params):
+    '''
+    栅格编号转换为单列int64栅格编号
+
+    将方形栅格的两列编号或三角形、六边形栅格的三列编号压缩为一列int64整数，
+    可与原编号无损互相转换。集计与表连接时以单列整数编号代替多列编号，
+    可节省内存并提升 `groupby` 与 `merge` 的速度，也可直接用于
+    `np.unique` 或 `np.bincount` 集计
+
+    方形栅格每列编号占32位，取值范围为[-2^31, 2^31)；三角形、六边形栅格
+    每列编号占21位，取值范围为[-2^20, 2^20)
+
+    Parameters
+    -------
+    gridid : list
+        方形栅格:
+        [LONCOL,LATCOL] : list
+            栅格编号两列
+        三角形、六边形栅格:
+        [loncol_1,loncol_2,loncol_3] : list
+            栅格编号三列
+    params : list or dict
+        栅格参数
+
+    Returns
+    -------
+    gridkey : ndarray
+        单列int64栅格编号
+    '''
     params = convertparams(params)
-    method = params['method']
+    if params['method'] == 'rect':
+        loncol, latcol = [np.asarray(i, dtype=np.int64) for i in gridid]
+        for i in [loncol, latcol]:
+            if ((i < -2**31) | (i >= 2**31)).any():
+                raise ValueError('Grid index out of range for packing')
+        return (loncol << 32) | (latcol + 2**31)
+    else:
+        loncols = [np.asarray(i, dtype=np.int64) for i in gridid]
+        for i in loncols:
+            if ((i < -2**20) | (i >= 2**20)).any():
+                raise ValueError('Grid index out of range for packing')
+        loncol_1, loncol_2, loncol_3 = [i + 2**20 for i in loncols]
+        return (loncol_1 << 42) | (loncol_2 << 21) | loncol_3
 
-    if method == 'rect':
-        loncol, latcol = gridid
-        return gridid_to_polygon_rect(loncol, latcol, params)
-    if method == 'tri':
-        loncol_1, loncol_2, loncol_3 = gridid
-        return gridid_to_polygon_tri(loncol_1, loncol_2, loncol_3, params)
-    if method == 'hexa':
-        loncol_1, loncol_2, loncol_3 = gridid
-        return gridid_to_polygon_hexa(loncol_1, loncol_2, loncol_3, params)
+
+def key_to_grid(gridkey, params):
+    '''
+    单列int64栅格编号还原为栅格编号
+
+    为 :func:`transbigdata.grid_to_key` 的逆运算
+
+    Parameters
+    -------
+    gridkey : ndarray
+        单列int64栅格编号
+    params : list or dict
+        栅格参数
+
+    Returns
+    -------
+    [LONCOL,LATCOL] : list
+        方形栅格输出: 栅格编号两列
+    [loncol_1,loncol_2,loncol_3] : list
+        三角形、六边形栅格输出: 栅格编号三列
+    '''
+    params = convertparams(params)
+    gridkey = np.asarray(gridkey, dtype=np.int64)
+    if params['method'] == 'rect':
+        latcol = (gridkey & (2**32 - 1)) - 2**31
+        loncol = gridkey >> 32
+        return [loncol, latcol]
+    else:
+        mask = 2**21 - 1
+        loncol_1 = ((gridkey >> 42) & mask) - 2**20
+        loncol_2 = ((gridkey >> 21) & mask) - 2**20
+        loncol_3 = (gridkey & mask) - 2**20
+        return [loncol_1, loncol_2, loncol_3]
 
 
-def grid_to_area(data, shape, params, col=['LONCOL', 'LATCOL']):
+def grid_to_area(data, shape, params, col=['LONCOL', 'LATCOL'], lookup=None):
     '''
     栅格与地理数据空间连接
 
@@ -369,6 +372,9 @@ def grid_to_area(data, shape, params, col=['LONCOL', 'LATCOL']):
     col : List
         列名，方型栅格下为[LONCOL,LATCOL]
         三角形、六边形栅格为[loncol_1,loncol_2,loncol_3]
+    lookup : GridZoneLookup
+        由shape与params生成的栅格-小区对应表（见 :class:`transbigdata.GridZoneLookup` ）。
+        传入时直接查表，不再做空间连接，输出的数据保持输入的顺序
 
     Returns
     -------
@@ -376,6 +382,15 @@ def grid_to_area(data, shape, params, col=['LONCOL', 'LATCOL']):
         数据，对应至矢量图形
     '''
     params = convertparams(params)
+    if lookup is not None:
+        gridid = [data[c].values for c in col]
+        zone = lookup.to_zone(gridid)
+        valid = zone >= 0
+        data1 = data[valid].reset_index(drop=True)
+        data1['geometry'] = gpd.points_from_xy(
+            *GridSystem(params).to_centre([i[valid] for i in gridid]))
+        return pd.concat([data1, lookup_attributes(shape, zone[valid])],
+                         axis=1)
     data1 = data[col].drop_duplicates().copy()
     data1 = gpd.GeoDataFrame(data1)
     if params['method'] == 'rect':
@@ -438,7 +453,9 @@ def grid_params_optimize(data,
                          max_iter=50,
                          w=0.1,
                         c1=0.5,
-                        c2=0.5):
+                        c2=0.5,
+                        n_jobs=1,
+                        cache=False):
     '''
     栅格化参数优化方法
 
@@ -458,7 +475,11 @@ def grid_params_optimize(data,
         抽样数据量，设置为0则不抽样
     pop,max_iter,w,c1,c2:
         scikit-opt中PSO的参数设置，详情看：https://scikit-opt.github.io/scikit-opt/#/zh/README
-        
+    n_jobs : int
+        计算每轮迭代中各粒子评价指标的进程数，-1为使用全部CPU核心。多进程时轨迹的经纬度以共享内存的形式只读共享给各进程，不会复制
+    cache : bool
+        是否缓存已计算的评价指标。缓存以保留6位小数的slon、slat与保留4位小数的theta为键，粒子位置重复时不再重复计算
+
     Returns
     -------
     params_optimized : List
@@ -478,131 +499,95 @@ def grid_params_optimize(data,
     [uid, lon, lat] = col
     try:
         from sko.PSO import PSO
+        from sko.tools import set_run_mode
     except ImportError:
         raise ImportError(
             "Please install scikit-opt, run following code "
             "in cmd: pip install scikit-opt")
-
-    def grids_index_gini(gpsdata, params, col=['longitude', 'latitude']):
-        [lon, lat] = col
-        data = gpsdata.copy()
-        if params['method'] == 'rect':
-            data['LONCOL'], data['LATCOL'] = GPS_to_grid(data[lon],
-                                                         data[lat],
-                                                         params=params)
-            data['count'] = 1
-            data = data.groupby(['LONCOL', 'LATCOL'])[
-                'count'].sum().reset_index()
-        elif (params['method'] == 'tri') | (params['method'] == 'hexa'):
-            data['loncol_1'],\
-                data['loncol_2'],\
-                data['loncol_3'] = GPS_to_grid(data[lon],
-                                               data[lat],
-                                               params=params)
-            data['count'] = 1
-            data = data.groupby(['loncol_1', 'loncol_2', 'loncol_3'])[
-                'count'].sum().reset_index()
-
-        def GiniIndex(p):
-            N = len(p)
-            Q = np.mean(p)
-            G = 2 / (N * (N - 1)) * (
-                (N + 1) * np.sum(p) - 2 * np.sum([(N - (i + 1) + 1) * p[i]
-                                                  for i in range(len(p))]))
-            return G / (2 * Q)
-
-        Gini = GiniIndex(list(data['count']))
-        return Gini
-
-    def grids_index_centerdist(gpsdata, params, col=[lon, lat]):
-        [lon, lat] = col
-        data = gpsdata.copy()
-        data['HBLON'], data['HBLAT'] = grid_to_centre(
-            GPS_to_grid(data[lon],
-                        data[lat],
-                        params=params),
-            params=params)
-        data['dist'] = getdistance(data['HBLON'], data['HBLAT'], data[lon],
-                                   data[lat])
-        return data['dist'].quantile(0.5)
-
-    def grids_index_gridscount(gpsdata, params, col=[uid, lon, lat]):
-        [uid, lon, lat] = col
-        data = gpsdata.copy()
-        if params['method'] == 'rect':
-            data['LONCOL'], data['LATCOL'] = GPS_to_grid(data[lon],
-                                                         data[lat],
-                                                         params=params)
-            return data[[
-                uid, 'LONCOL', 'LATCOL'
-            ]].drop_duplicates().groupby(uid)['LONCOL'].count().quantile(0.5)
-        elif (params['method'] == 'tri') | (params['method'] == 'hexa'):
-            data['loncol_1'],\
-                data['loncol_2'],\
-                data['loncol_3'] = GPS_to_grid(data[lon],
-                                               data[lat],
-                                               params=params)
-            return data[[
-                uid, 'loncol_1', 'loncol_2', 'loncol_3'
-            ]].drop_duplicates().groupby(uid)['loncol_1'].count().quantile(0.5)
-
-    if optmethod == "centerdist":
-
-        def f_centerdist(x):
-            return grids_index_centerdist(trajdata, {
-                'slon': params['slon'] + x[0] / times,
-                'slat': params['slat'] + x[1] / times,
-                'deltalon': params['deltalon'],
-                'deltalat': params['deltalat'],
-                'method': params['method'],
-                'theta': x[2] / theta_lambda,
-            },
-                col=[lon, lat])
-
-        f = f_centerdist
-
-    elif optmethod == "gini":
-
-        def f_gini(x):
-            return -grids_index_gini(trajdata, {
-                'slon': params['slon'] + x[0] / times,
-                'slat': params['slat'] + x[1] / times,
-                'deltalon': params['deltalon'],
-                'deltalat': params['deltalat'],
-                'method': params['method'],
-                'theta': x[2] / theta_lambda,
-            },
-                col=[lon, lat])
-
-        f = f_gini
-    elif optmethod == "gridscount":
-
-        def f_gridscount(x):
-            return grids_index_gridscount(trajdata, {
-                'slon': params['slon'] + x[0] / times,
-                'slat': params['slat'] + x[1] / times,
-                'deltalon': params['deltalon'],
-                'deltalat': params['deltalat'],
-                'method': params['method'],
-                'theta': x[2] / theta_lambda,
-            },
-                col=[uid, lon, lat])
-
-        f = f_gridscount
-    else:
+    if optmethod not in ['centerdist', 'gini', 'gridscount']:
         raise Exception('Method should be one of: centerdist,gini,gridscount')
 
-    pso = PSO(func=f,
-            n_dim=3,
-            pop=pop, 
-            max_iter=max_iter,
-            lb=[0, 0, 0],
-            ub=[params['deltalon'] * times, params['deltalat']
-                * times, 90 * theta_lambda],
-            w=w, 
-            c1=c1, 
-            c2=c2)
-    result = pso.run()
+    # Only the coordinate arrays are needed to evaluate the particles
+    arrays = {'lon': trajdata[lon].values.astype(np.float64),
+              'lat': trajdata[lat].values.astype(np.float64)}
+    if optmethod == 'gridscount':
+        arrays['uid'] = pd.factorize(trajdata[uid])[0].astype(np.int64)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    cached = dict()
+
+    def particle_params(x):
+        return {
+            'slon': params['slon'] + x[0] / times,
+            'slat': params['slat'] + x[1] / times,
+            'deltalon': params['deltalon'],
+            'deltalat': params['deltalat'],
+            'method': params['method'],
+            'theta': x[2] / theta_lambda,
+        }
+
+    def f(X):
+        # Evaluate the whole population of one iteration at once
+        X = np.atleast_2d(X)
+        particles = [particle_params(x) for x in X]
+        keys = [(round(p['slon'], 6), round(p['slat'], 6),
+                 round(p['theta'], 4)) for p in particles]
+        if cache:
+            todo = list(dict.fromkeys(
+                key for key in keys if key not in cached))
+            todo_params = [particles[keys.index(key)] for key in todo]
+        else:
+            todo = list(range(len(particles)))
+            todo_params = particles
+        if executor is None:
+            values = [grid_params_fitness(p, optmethod) for p in todo_params]
+        else:
+            values = list(executor.map(grid_params_fitness, todo_params,
+                                       [optmethod] * len(todo_params)))
+        if cache:
+            cached.update(zip(todo, values))
+            values = [cached[key] for key in keys]
+        return np.array(values)
+    set_run_mode(f, 'vectorization')
+
+    def run_pso():
+        # The PSO evaluates the initial population when created
+        pso = PSO(func=f,
+                n_dim=3,
+                pop=pop, 
+                max_iter=max_iter,
+                lb=[0, 0, 0],
+                ub=[params['deltalon'] * times, params['deltalat']
+                    * times, 90 * theta_lambda],
+                w=w, 
+                c1=c1, 
+                c2=c2)
+        result = pso.run()
+        optimized_index = f(result[0])[0] if printlog else None
+        return pso, result, optimized_index
+
+    if n_jobs == 1:
+        executor = None
+        grid_params_attach(arrays)
+        try:
+            pso, result, optimized_index = run_pso()
+        finally:
+            grid_params_attach(dict())
+    else:
+        shms = grid_params_share(arrays)
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    initializer=grid_params_attach,
+                    initargs=({key: (shm.name, arrays[key].shape,
+                                     arrays[key].dtype.str)
+                               for key, shm in shms.items()},)
+            ) as executor:
+                pso, result, optimized_index = run_pso()
+        finally:
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
 
     x = result[0]
     params_optimized = {
@@ -615,7 +600,7 @@ def grid_params_optimize(data,
     }
 
     if printlog:
-        print('Optimized index ' + optmethod + ':', f(result[0]))
+        print('Optimized index ' + optmethod + ':', optimized_index)
         print('Optimized gridding params:', params_optimized)
         import matplotlib.pyplot as plt
         plt.figure(1, (14, 5), dpi=300)
@@ -661,11 +646,1063 @@ def grid_params_optimize(data,
     return params_optimized
 
 
+def grid_index_gini(data, params, col=['lon', 'lat']):
+    '''
+    栅格化结果的基尼系数
+
+    统计每个栅格内的数据量，计算其基尼系数，可用于评价栅格化参数，
+    也是 :func:`transbigdata.grid_params_optimize` 中 `gini` 优化方法的评价指标
+
+    Parameters
+    -------
+    data : DataFrame
+        轨迹数据
+    params : list or dict
+        栅格参数
+    col : List
+        列名 [lon,lat]
+
+    Returns
+    -------
+    gini : float
+        基尼系数
+    '''
+    [lon, lat] = col
+    params = gridsystem(params)
+    # The records without coordinates are not in any grid
+    valid = pd.notnull(data[lon].values) & pd.notnull(data[lat].values)
+    gridkey = params.to_grid(data[lon].values[valid], data[lat].values[valid],
+                             packed=True)
+    counts = np.bincount(pd.factorize(gridkey)[0])
+    return gini_index(counts)
+
+
+def grid_index_centerdist(data, params, col=['lon', 'lat']):
+    '''
+    数据点到所在栅格中心点距离的中位数
+
+    可用于评价栅格化参数，也是 :func:`transbigdata.grid_params_optimize` 中
+    `centerdist` 优化方法的评价指标
+
+    Parameters
+    -------
+    data : DataFrame
+        轨迹数据
+    params : list or dict
+        栅格参数
+    col : List
+        列名 [lon,lat]
+
+    Returns
+    -------
+    centerdist : float
+        距离中位数（米）
+    '''
+    [lon, lat] = col
+    params = gridsystem(params)
+    lon = data[lon].values
+    lat = data[lat].values
+    gridid = params.to_grid(lon, lat)
+    hblon, hblat = params.to_centre(gridid)
+    dist = np.asarray(getdistance(hblon, hblat, lon, lat), dtype=np.float64)
+    # np.nanmedian selects the middle values with np.partition, the
+    # missing distances are skipped as in quantile
+    return np.nanmedian(dist)
+
+
+def grid_index_gridscount(data, params, col=['uid', 'lon', 'lat']):
+    '''
+    每个个体经过栅格数量的中位数
+
+    可用于评价栅格化参数，也是 :func:`transbigdata.grid_params_optimize` 中
+    `gridscount` 优化方法的评价指标
+
+    Parameters
+    -------
+    data : DataFrame
+        轨迹数据
+    params : list or dict
+        栅格参数
+    col : List
+        列名 [uid,lon,lat]
+
+    Returns
+    -------
+    gridscount : float
+        栅格数量中位数
+    '''
+    [uid, lon, lat] = col
+    params = gridsystem(params)
+    uidcode, uids = pd.factorize(data[uid])
+    uidcode = uidcode.astype(np.int64)
+    # The records without coordinates are not in any grid
+    valid = (uidcode >= 0) & pd.notnull(data[lon].values) & \
+        pd.notnull(data[lat].values)
+    gridkey = params.to_grid(data[lon].values[valid], data[lat].values[valid],
+                             packed=True)
+    gridcode, grids = pd.factorize(gridkey)
+    # Each individual-grid pair is packed into one integer
+    pairs = pd.unique(uidcode[valid] * len(grids) + gridcode)
+    return np.nanmedian(np.bincount(pairs // max(len(grids), 1),
+                                    minlength=len(uids)))
+
+
+def grid_kring(gridid, params, k=1):
+    '''
+    栅格的k阶邻域
+
+    输出与每个栅格距离不超过k的所有栅格（包括栅格本身）。栅格距离为栅格之间需要经过的相邻栅格步数，
+    方形栅格的相邻栅格为周围8个栅格，三角形、六边形栅格的相邻栅格为共边的栅格
+
+    Parameters
+    -------
+    gridid : list or ndarray
+        栅格编号，可为多列栅格编号或单列int64栅格编号
+    params : list, dict or GridSystem
+        栅格参数
+    k : int
+        邻域阶数
+
+    Returns
+    -------
+    kring : list
+        邻域栅格编号，每列为n行m列的数组，第i行为第i个栅格邻域内的m个栅格，按距离由近到远排列，
+        第一个为栅格本身。方形栅格m为(2k+1)^2，三角形栅格m为1+3k(k+1)/2，六边形栅格m为1+3k(k+1)
+    '''
+    return gridsystem(params).kring(gridid, k)
+
+
+def grid_ring(gridid, params, k=1):
+    '''
+    与栅格距离恰好为k的栅格环
+
+    Parameters
+    -------
+    gridid : list or ndarray
+        栅格编号，可为多列栅格编号或单列int64栅格编号
+    params : list, dict or GridSystem
+        栅格参数
+    k : int
+        栅格距离
+
+    Returns
+    -------
+    ring : list
+        栅格环的栅格编号，每列为n行m列的数组，第i行为与第i个栅格距离为k的m个栅格。
+        方形栅格m为8k，三角形栅格m为3k，六边形栅格m为6k（k为0时m为1）
+    '''
+    return gridsystem(params).ring(gridid, k)
+
+
+def grid_distance(gridid1, gridid2, params):
+    '''
+    栅格之间的栅格距离
+
+    即从一个栅格到另一个栅格需要经过的相邻栅格步数。方形栅格为切比雪夫距离，
+    三角形栅格为三列编号差的绝对值之和，六边形栅格由轴向坐标计算
+
+    Parameters
+    -------
+    gridid1 : list or ndarray
+        栅格编号，可为多列栅格编号或单列int64栅格编号
+    gridid2 : list or ndarray
+        栅格编号，可为多列栅格编号或单列int64栅格编号
+    params : list, dict or GridSystem
+        栅格参数
+
+    Returns
+    -------
+    distance : ndarray
+        栅格距离
+    '''
+    return gridsystem(params).distance(gridid1, gridid2)
+
+
+def grid_adjacency(gridid, params, k=1, include_self=False):
+    '''
+    栅格的稀疏邻接矩阵
+
+    构建n个栅格之间的邻接矩阵，栅格距离不超过k时为1，否则为0。
+    栅格的集计值与邻接矩阵相乘即可得到邻域内的集计值（如空间平滑、热点识别），
+    无需对栅格做缓冲区与空间连接
+
+    Parameters
+    -------
+    gridid : list or ndarray
+        栅格编号，可为多列栅格编号或单列int64栅格编号，栅格不能重复
+    params : list, dict or GridSystem
+        栅格参数
+    k : int
+        邻域阶数
+    include_self : bool
+        邻接矩阵对角线是否为1
+
+    Returns
+    -------
+    adjacency : scipy.sparse.csr_matrix
+        n行n列的稀疏邻接矩阵，行列顺序与输入栅格一致
+
+    Example
+    -------
+
+    ::
+
+        >>> adjacency = tbd.grid_adjacency([grid['LONCOL'], grid['LATCOL']], params)
+        >>> grid['count_smooth'] = adjacency @ grid['count'].values
+    '''
+    from scipy import sparse
+    grid = gridsystem(params)
+    gridid = [np.atleast_1d(np.asarray(col, dtype=np.int64))
+              for col in gridid_columns(gridid, grid)]
+    gridkey = pd.Index(grid_to_key(gridid, grid))
+    if gridkey.has_duplicates:
+        raise ValueError('The grid ID should be unique')
+    offsets = grid.grid_offsets(k)
+    if not include_self:
+        offsets = offsets[1:]
+    neighbors = grid.offset_grids(gridid, offsets)
+    col = gridkey.get_indexer(
+        grid_to_key([neighbor.ravel() for neighbor in neighbors], grid))
+    row = np.repeat(np.arange(len(gridkey)), len(offsets))
+    valid = col >= 0
+    return sparse.csr_matrix(
+        (np.ones(valid.sum()), (row[valid], col[valid])),
+        shape=(len(gridkey), len(gridkey)))
+
+
+def grid_level_params(params, level=1):
+    '''
+    栅格金字塔中第level层的方形栅格参数
+
+    栅格金字塔由同一原点的多层方形栅格组成，第level层的栅格边长为原栅格的2^level倍，
+    各层栅格左下角对齐，每个栅格恰好包含下一层的4个栅格
+
+    Parameters
+    -------
+    params : list, dict or GridSystem
+        栅格参数（第0层），仅支持方形栅格
+    level : int
+        层级，0为原栅格
+
+    Returns
+    -------
+    params : dict
+        第level层的栅格参数
+    '''
+    params = dict(convertparams(params))
+    if params['method'] != 'rect':
+        raise ValueError('Grid pyramid only supports rect grids')
+    if level < 0:
+        raise ValueError('level should be a non-negative integer')
+    scale = 2 ** level
+    theta = params['theta']
+    costheta = np.cos(theta * np.pi / 180)
+    sintheta = np.sin(theta * np.pi / 180)
+    R = np.array([[costheta * params['deltalon'],
+                   -sintheta * params['deltalat']],
+                  [sintheta * params['deltalon'],
+                   costheta * params['deltalat']]])
+    # Keep the lower left corner of grid (0, 0) at every level
+    slon, slat = np.array([params['slon'], params['slat']]) + \
+        (scale - 1) * (R[0, :] + R[1, :]) / 2
+    params['slon'] = slon
+    params['slat'] = slat
+    params['deltalon'] = params['deltalon'] * scale
+    params['deltalat'] = params['deltalat'] * scale
+    if 'gridsize' in params:
+        params['gridsize'] = params['gridsize'] * scale
+    return params
+
+
+def grid_to_parent(gridid, params, level=1):
+    '''
+    栅格金字塔中栅格对应的上层栅格编号
+
+    第level层栅格编号由原栅格编号右移level位得到，无需重新匹配栅格
+
+    Parameters
+    -------
+    gridid : list or ndarray
+        方形栅格编号[LONCOL,LATCOL]或单列int64栅格编号
+    params : list, dict or GridSystem
+        栅格参数，仅支持方形栅格
+    level : int
+        向上的层数
+
+    Returns
+    -------
+    parent : list or ndarray
+        上层栅格编号，输入为单列int64栅格编号时输出也为单列int64栅格编号
+    '''
+    params = convertparams(params)
+    if params['method'] != 'rect':
+        raise ValueError('Grid pyramid only supports rect grids')
+    packed = not (isinstance(gridid, (list, tuple)) or np.ndim(gridid) == 2)
+    loncol, latcol = [np.asarray(col, dtype=np.int64)
+                      for col in gridid_columns(gridid, params)]
+    parent = [loncol >> level, latcol >> level]
+    if packed:
+        return grid_to_key(parent, params)
+    return parent
+
+
+def grid_to_children(gridid, params, level=1):
+    '''
+    栅格金字塔中栅格包含的下层栅格编号
+
+    Parameters
+    -------
+    gridid : list or ndarray
+        方形栅格编号[LONCOL,LATCOL]或单列int64栅格编号
+    params : list, dict or GridSystem
+        栅格参数，仅支持方形栅格
+    level : int
+        向下的层数
+
+    Returns
+    -------
+    children : list or ndarray
+        下层栅格编号，为n行4^level列的数组，第i行为第i个栅格包含的下层栅格。
+        输入为单列int64栅格编号时输出也为单列int64栅格编号
+    '''
+    params = convertparams(params)
+    if params['method'] != 'rect':
+        raise ValueError('Grid pyramid only supports rect grids')
+    packed = not (isinstance(gridid, (list, tuple)) or np.ndim(gridid) == 2)
+    loncol, latcol = [np.atleast_1d(np.asarray(col, dtype=np.int64))
+                      for col in gridid_columns(gridid, params)]
+    scale = 2 ** level
+    da, db = np.meshgrid(np.arange(scale), np.arange(scale))
+    children = [(loncol << level)[:, None] + da.ravel()[None, :],
+                (latcol << level)[:, None] + db.ravel()[None, :]]
+    if packed:
+        return grid_to_key(children, params)
+    return children
+
+
+def grid_rollup(data, params, level=1, col=['LONCOL', 'LATCOL'],
+                values=None, aggfunc='sum'):
+    '''
+    由栅格集计结果汇总得到栅格金字塔中上层栅格的集计结果
+
+    上层栅格编号由 :func:`transbigdata.grid_to_parent` 直接计算，不需要回到原始数据重新栅格化与集计。
+    多层汇总时可将上一层的结果继续汇总
+
+    Parameters
+    -------
+    data : DataFrame
+        栅格集计结果，每个栅格一行
+    params : list, dict or GridSystem
+        data的栅格参数，仅支持方形栅格
+    level : int
+        向上汇总的层数
+    col : List
+        栅格编号列名[LONCOL,LATCOL]
+    values : List
+        需要汇总的列名，默认为除栅格编号外的所有数值列
+    aggfunc : str or function
+        汇总方法，需为可逐层汇总的方法，如sum、max、min（平均值等需由总和与计数计算）
+
+    Returns
+    -------
+    data_parent : DataFrame
+        上层栅格的集计结果
+    params_parent : dict
+        上层栅格参数
+
+    Example
+    -------
+
+    ::
+
+        >>> data['LONCOL'], data['LATCOL'] = tbd.GPS_to_grid(data['lon'], data['lat'], params)
+        >>> grid_agg = data.groupby(['LONCOL', 'LATCOL'])['id'].count().rename('count').reset_index()
+        >>> grid_agg_1km, params_1km = tbd.grid_rollup(grid_agg, params, level=1)
+        >>> grid_agg_2km, params_2km = tbd.grid_rollup(grid_agg_1km, params_1km, level=1)
+    '''
+    LONCOL, LATCOL = col
+    if values is None:
+        values = [c for c in data.select_dtypes('number').columns
+                  if c not in col]
+    data_parent = pd.DataFrame()
+    data_parent[LONCOL], data_parent[LATCOL] = grid_to_parent(
+        [data[LONCOL].values, data[LATCOL].values], params, level=level)
+    data_parent[values] = data[values].values
+    data_parent = data_parent.groupby(
+        [LONCOL, LATCOL])[values].agg(aggfunc).reset_index()
+    return data_parent, grid_level_params(params, level)
+
+
+class GridSystem:
+    '''
+    栅格系统
+
+    由栅格参数生成的不可变对象。创建时检查栅格参数，并预先计算栅格的旋转矩阵及其逆矩阵，
+    多次进行栅格匹配、求栅格中心点与栅格地理信息时无需重复解析参数与计算三角函数。
+    :func:`transbigdata.GPS_to_grid` 、 :func:`transbigdata.grid_to_centre` 与
+    :func:`transbigdata.grid_to_polygon` 等方法的params参数也可直接传入GridSystem对象
+
+    Parameters
+    -------
+    params : list, dict or GridSystem
+        栅格参数
+
+    Attributes
+    -------
+    slon, slat, deltalon, deltalat, theta, method, gridsize
+        栅格参数
+    params : dict
+        栅格参数字典
+
+    Example
+    -------
+
+    ::
+
+        >>> grid = tbd.GridSystem(params)
+        >>> data['LONCOL'], data['LATCOL'] = grid.to_grid(data['lon'], data['lat'])
+        >>> data['geometry'] = grid.to_polygon([data['LONCOL'], data['LATCOL']])
+    '''
+    __slots__ = ('slon', 'slat', 'deltalon', 'deltalat', 'theta', 'method',
+                 'gridsize', '_R', '_coefficients', '_vertex')
+
+    def __init__(self, params):
+        if isinstance(params, GridSystem):
+            params = params.params
+        params = convertparams(dict(params) if isinstance(params, dict)
+                               else params)
+        for key in ['slon', 'slat', 'deltalon', 'deltalat', 'theta']:
+            if key not in params:
+                raise ValueError('Gridding params should contain ' + key)
+            if not np.isfinite(params[key]):
+                raise ValueError(key + ' should be a finite number')
+        if (params['deltalon'] <= 0) | (params['deltalat'] <= 0):
+            raise ValueError('deltalon and deltalat should be positive')
+        values = {'slon': float(params['slon']),
+                  'slat': float(params['slat']),
+                  'deltalon': float(params['deltalon']),
+                  'deltalat': float(params['deltalat']),
+                  'theta': float(params['theta']),
+                  'method': params['method'],
+                  'gridsize': params.get('gridsize')}
+        costheta = np.cos(values['theta'] * np.pi / 180)
+        sintheta = np.sin(values['theta'] * np.pi / 180)
+        values['_R'] = np.array(
+            [[costheta * values['deltalon'], -sintheta * values['deltalat']],
+             [sintheta * values['deltalon'], costheta * values['deltalat']]])
+        values['_coefficients'] = grid_strip_coefficients(values)
+        if values['method'] == 'rect':
+            values['_vertex'] = None
+        else:
+            # Coordinates of the strip vertex (u1, u2) are
+            # (slon, slat) + [u1, u2] @ _vertex
+            (_, _, a1, b1), (_, _, a2, b2) = values['_coefficients'][:2]
+            values['_vertex'] = np.linalg.inv(np.array([[a1, a2],
+                                                        [b1, b2]]))
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('GridSystem is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('GridSystem is immutable')
+
+    def __reduce__(self):
+        return (GridSystem, (self.params,))
+
+    def __eq__(self, other):
+        if not isinstance(other, GridSystem):
+            return NotImplemented
+        return self.params == other.params
+
+    def __hash__(self):
+        return hash(tuple(self.params.items()))
+
+    def __repr__(self):
+        return 'GridSystem(%r)' % self.params
+
+    @property
+    def params(self):
+        params = {'slon': self.slon,
+                  'slat': self.slat,
+                  'deltalon': self.deltalon,
+                  'deltalat': self.deltalat,
+                  'theta': self.theta,
+                  'method': self.method}
+        if self.gridsize is not None:
+            params['gridsize'] = self.gridsize
+        return params
+
+    @property
+    def ncols(self):
+        return 2 if self.method == 'rect' else 3
+
+    def to_grid(self, lon, lat, packed=False, chunksize=None, out=None,
+                n_jobs=1):
+        '''
+        GPS数据对应栅格编号，参数见 :func:`transbigdata.GPS_to_grid`
+        '''
+        lon = np.atleast_1d(np.asarray(lon))
+        lat = np.atleast_1d(np.asarray(lat))
+        n = len(lon)
+        if len(lat) != n:
+            raise ValueError('lon and lat should have the same length')
+        if out is None:
+            if packed:
+                out = np.empty(n, dtype=np.int64)
+            else:
+                out = [np.empty(n, dtype=np.int64)
+                       for i in range(self.ncols)]
+        if packed:
+            outcols = [out]
+            if (np.ndim(out) != 1) | (out.dtype != np.int64):
+                raise ValueError('out should be an int64 array when packed')
+        else:
+            outcols = list(out)
+            if len(outcols) != self.ncols:
+                raise ValueError('out should have %d columns for %s grids' % (
+                    self.ncols, self.method))
+        for col in outcols:
+            if not isinstance(col, np.ndarray) or (col.shape != (n,)) or \
+                    (col.dtype.kind != 'i'):
+                raise ValueError(
+                    'out should be integer arrays of the same length as lon')
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if chunksize is None:
+            chunksize = max(int(np.ceil(n / n_jobs)), 1)
+
+        def run(start):
+            stop = min(start + chunksize, n)
+            # Converted chunk by chunk to keep the memory bounded
+            gridid = GPS_to_grid_block(coord_float(lon[start:stop]),
+                                       coord_float(lat[start:stop]),
+                                       self._coefficients, self.method)
+            if packed:
+                gridid = [grid_to_key(gridid, self)]
+            for col, value in zip(outcols, gridid):
+                col[start:stop] = value
+        starts = range(0, n, chunksize)
+        if n_jobs == 1:
+            for start in starts:
+                run(start)
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                for future in [executor.submit(run, start)
+                               for start in starts]:
+                    future.result()
+        if packed:
+            return outcols[0]
+        return outcols
+
+    def to_centre(self, gridid):
+        '''
+        栅格编号对应栅格中心点经纬度，参数见 :func:`transbigdata.grid_to_centre`
+        '''
+        gridid = gridid_columns(gridid, self)
+        gridid = [np.atleast_1d(np.asarray(col)) for col in gridid]
+        if self.method == 'rect':
+            hblonhblat = np.dot(np.array(gridid[:2]).T, self._R) + \
+                np.array([self.slon, self.slat])
+        elif self.method == 'tri':
+            hblonhblat = self.tri_vertices(*gridid).mean(axis=1)
+        else:
+            hblonhblat = self.vertex_to_coords(gridid[0], gridid[1])
+        return hblonhblat[:, 0], hblonhblat[:, 1]
+
+    def to_polygon(self, gridid):
+        '''
+        栅格编号生成栅格的地理信息，参数见 :func:`transbigdata.grid_to_polygon`
+        '''
+        gridid = gridid_columns(gridid, self)
+        gridid = [np.atleast_1d(np.asarray(col)) for col in gridid]
+        if self.method == 'rect':
+            loncol, latcol = [col.astype(np.float64) for col in gridid[:2]]
+            corners = [(-0.5, -0.5), (0.5, -0.5), (0.5, 0.5), (-0.5, 0.5),
+                       (-0.5, -0.5)]
+            coords = np.stack([
+                np.dot(np.array([loncol + a, latcol + b]).T, self._R) +
+                np.array([self.slon, self.slat]) for a, b in corners],
+                axis=1)
+            return coords_to_polygons(coords)
+        if self.method == 'tri':
+            coords = self.tri_vertices(*gridid)
+            coords = np.concatenate([coords, coords[:, :1]], axis=1)
+            return coords_to_polygons(coords)
+        # The six hexagon vertices are the strip vertices around its centre
+        i = gridid[0].astype(np.float64)
+        j = gridid[1].astype(np.float64)
+        offsets = [(1, 0), (1, 1), (0, 1), (-1, 0), (-1, -1), (0, -1)]
+        coords = np.stack([self.vertex_to_coords(i + a, j + b)
+                           for a, b in offsets + offsets[:1]], axis=1)
+        return coords_to_polygons(coords.round(6))
+
+    def neighbors(self, gridid):
+        '''
+        与栅格相邻的栅格，即距离为1的栅格（方形栅格为周围8个栅格，三角形与六边形栅格为共边的栅格）
+
+        Parameters
+        -------
+        gridid : list or ndarray
+            栅格编号，可为多列栅格编号或单列int64栅格编号
+
+        Returns
+        -------
+        neighbors : list
+            相邻栅格的编号，每列为n行m列的数组，第i行为第i个栅格的m个相邻栅格。
+            方形栅格m为8，三角形栅格m为3，六边形栅格m为6
+        '''
+        return self.ring(gridid, 1)
+
+    def kring(self, gridid, k=1):
+        '''
+        与栅格距离不超过k的栅格，参数见 :func:`transbigdata.grid_kring`
+        '''
+        return self.offset_grids(gridid, self.grid_offsets(k))
+
+    def ring(self, gridid, k=1):
+        '''
+        与栅格距离恰好为k的栅格，参数见 :func:`transbigdata.grid_ring`
+        '''
+        return self.offset_grids(gridid, self.grid_offsets(k, exact=True))
+
+    def distance(self, gridid1, gridid2):
+        '''
+        栅格之间的栅格距离，参数见 :func:`transbigdata.grid_distance`
+        '''
+        gridid1 = gridid_columns(gridid1, self)
+        gridid2 = gridid_columns(gridid2, self)
+        delta = [np.asarray(a, dtype=np.int64) - np.asarray(b, dtype=np.int64)
+                 for a, b in zip(gridid1, gridid2)]
+        if self.method == 'rect':
+            return np.maximum(np.abs(delta[0]), np.abs(delta[1]))
+        if self.method == 'tri':
+            return np.abs(delta[0]) + np.abs(delta[1]) + np.abs(delta[2])
+        # Axial coordinates of the hexagons
+        dq = (2 * delta[1] - delta[0]) // 3
+        dr = (2 * delta[0] - delta[1]) // 3
+        return (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+
+    def grid_offsets(self, k, exact=False):
+        # Offsets of the grid ID within (or exactly at) distance k, sorted
+        # by distance. For tri grids the offsets are for the upward
+        # triangles (l3 = l2 - l1), downward triangles use the negation
+        if k < 0:
+            raise ValueError('k should be a non-negative integer')
+        d1, d2 = np.meshgrid(np.arange(-2 * k, 2 * k + 1),
+                             np.arange(-2 * k, 2 * k + 1))
+        d1 = d1.ravel()
+        d2 = d2.ravel()
+        if self.method == 'rect':
+            offsets = np.array([d1, d2]).T
+        elif self.method == 'tri':
+            offsets = np.concatenate([np.array([d1, d2, d2 - d1 - 1]).T,
+                                      np.array([d1, d2, d2 - d1]).T])
+        else:
+            offsets = np.array([d1, d2, d2 - d1]).T
+            offsets = offsets[(d1 + d2) % 3 == 0]
+        zeros = [np.zeros(len(offsets), dtype=np.int64)] * self.ncols
+        distance = self.distance(list(offsets.T), zeros)
+        valid = distance == k if exact else distance <= k
+        offsets = offsets[valid]
+        distance = distance[valid]
+        order = np.lexsort(tuple(offsets.T[::-1]) + (distance,))
+        return offsets[order]
+
+    def offset_grids(self, gridid, offsets):
+        # Grid ID of each grid moved by the offsets, as n by m arrays
+        gridid = gridid_columns(gridid, self)
+        gridid = [np.atleast_1d(np.asarray(col, dtype=np.int64))
+                  for col in gridid]
+        if self.method == 'tri':
+            # Downward triangles have the mirrored offsets
+            sign = np.where(
+                gridid[2] == gridid[1] - gridid[0], 1, -1)[:, None]
+        else:
+            sign = 1
+        return [col[:, None] + sign * offsets[None, :, i]
+                for i, col in enumerate(gridid)]
+
+    def vertex_to_coords(self, u1, u2):
+        # Coordinates of the strip vertices of tri and hexa grids
+        return np.dot(np.array([u1, u2], dtype=np.float64).T,
+                      self._vertex) + np.array([self.slon, self.slat])
+
+    def tri_vertices(self, loncol_1, loncol_2, loncol_3):
+        # The three vertices of the triangles, in the order of gettripoints
+        flag = (loncol_1 + loncol_2 + loncol_3) % 2
+        u2 = loncol_2 + 1 - flag
+        vertices = [(loncol_1 + flag, u2),
+                    (u2 - loncol_3 - flag, u2),
+                    (loncol_1 + flag, loncol_1 + loncol_3 + 2 * flag)]
+        coords = np.stack([self.vertex_to_coords(a, b)
+                           for a, b in vertices], axis=1)
+        return coords.round(6)
+
+
+class GridZoneLookup:
+    '''
+    栅格-小区对应表
+
+    由栅格参数与小区面要素一次性生成，记录与小区相交的每个栅格（以单列int64栅格编号表示）中心点所在的小区，
+    以及栅格与各小区相交面积占栅格面积的比例。生成后可保存为文件重复使用，
+    之后的栅格对应小区与集计只需查表，无需再做空间连接。
+    可传入 :func:`transbigdata.grid_to_area` 与 :func:`transbigdata.dataagg` 的lookup参数
+
+    Parameters
+    -------
+    shape : GeoDataFrame
+        小区面要素，小区以其在shape中的行号（从0开始）表示
+    params : list, dict or GridSystem
+        栅格参数，支持方形、三角形与六边形栅格。为None时由shape的范围与accuracy生成方形栅格（与 :func:`transbigdata.dataagg` 相同）
+    accuracy : number
+        栅格大小（米），params为None时有效
+
+    Attributes
+    -------
+    params : dict
+        栅格参数
+    nzones : int
+        小区数量
+    keys : ndarray
+        与小区相交的栅格的int64栅格编号，升序排列
+    zone : ndarray
+        每个栅格中心点所在小区的行号，不在任何小区内为-1
+    pair_ptr, pair_zone, pair_weight : ndarray
+        栅格与小区相交面积的比例，第i个栅格对应pair_zone与pair_weight中pair_ptr[i]至pair_ptr[i+1]的部分
+
+    Example
+    -------
+
+    ::
+
+        >>> lookup = tbd.GridZoneLookup(shape, accuracy=500)
+        >>> lookup.save('lookup.npz')
+        >>> lookup = tbd.GridZoneLookup.load('lookup.npz')
+        >>> aggresult, data1 = tbd.dataagg(data, shape, col=['Lng', 'Lat'], lookup=lookup)
+    '''
+
+    def __init__(self, shape, params=None, accuracy=500):
+        if shape is None:
+            # Used by load
+            return
+        if params is None:
+            params = area_to_params(list(shape.total_bounds), accuracy)
+        params = convertparams(params)
+        self.params = dict(params)
+        self.nzones = len(shape)
+        zones = gpd.GeoSeries(shape.geometry.values, crs=shape.crs)
+        grid, _ = area_to_grid(shape, params=dict(params), prefilter=True)
+        if params['method'] == 'rect':
+            gridcol = ['LONCOL', 'LATCOL']
+        else:
+            gridcol = ['loncol_1', 'loncol_2', 'loncol_3']
+        keys = grid_to_key([grid[c].values for c in gridcol], params)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        cells = gpd.GeoSeries(grid.geometry.values[order], crs=shape.crs)
+
+        # The zone of the grid centre, the first zone if more than one
+        hblon, hblat = GridSystem(params).to_centre(self.keys)
+        centres = gpd.GeoSeries(gpd.points_from_xy(hblon, hblat),
+                                crs=shape.crs)
+        pairs = grid_sindex_query_pairs(shape, centres)
+        self.zone = np.full(len(self.keys), -1, dtype=np.int64)
+        _, first = np.unique(pairs[0], return_index=True)
+        self.zone[pairs[0][first]] = pairs[1][first]
+
+        # The area share of the grid in each zone it intersects
+        cell_index, zone_index = grid_sindex_query_pairs(shape, cells)
+        area = cells.iloc[cell_index].intersection(
+            zones.iloc[zone_index], align=False).area.values
+        weight = area / cells.area.values[cell_index]
+        valid = weight > 0
+        self.pair_zone = zone_index[valid]
+        self.pair_weight = weight[valid]
+        self.pair_ptr = np.concatenate([[0], np.cumsum(np.bincount(
+            cell_index[valid], minlength=len(self.keys)))]).astype(np.int64)
+
+    def locate(self, gridid):
+        # Position of the grids in keys, -1 if not in the lookup
+        gridid = gridid_columns(gridid, self.params)
+        gridkey = np.atleast_1d(grid_to_key(gridid, self.params))
+        index = np.searchsorted(self.keys, gridkey)
+        index[index == len(self.keys)] = 0
+        found = (len(self.keys) > 0) & (self.keys[index] == gridkey)
+        return np.where(found, index, -1)
+
+    def to_zone(self, gridid):
+        '''
+        栅格中心点所在小区
+
+        Parameters
+        -------
+        gridid : list or ndarray
+            栅格编号[LONCOL,LATCOL]、[loncol_1,loncol_2,loncol_3]或单列int64栅格编号
+
+        Returns
+        -------
+        zone : ndarray
+            小区的行号，不在任何小区内为-1
+        '''
+        index = self.locate(gridid)
+        return np.where(index >= 0, self.zone[index], -1)
+
+    def to_zone_weights(self, gridid):
+        '''
+        栅格按相交面积比例拆分至各小区
+
+        Parameters
+        -------
+        gridid : list or ndarray
+            栅格编号[LONCOL,LATCOL]、[loncol_1,loncol_2,loncol_3]或单列int64栅格编号
+
+        Returns
+        -------
+        row : ndarray
+            输入栅格的行号
+        zone : ndarray
+            小区的行号
+        weight : ndarray
+            栅格在该小区内的面积比例
+        '''
+        index = self.locate(gridid)
+        row = np.flatnonzero(index >= 0)
+        start = self.pair_ptr[index[row]]
+        count = self.pair_ptr[index[row] + 1] - start
+        row = np.repeat(row, count)
+        # Position of each pair, counted within its grid
+        within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count,
+                                                    count)
+        pair = np.repeat(start, count) + within
+        return row, self.pair_zone[pair], self.pair_weight[pair]
+
+    def aggregate(self, gridid, values=None, weighted=False):
+        '''
+        集计至小区
+
+        Parameters
+        -------
+        gridid : list or ndarray
+            栅格编号[LONCOL,LATCOL]、[loncol_1,loncol_2,loncol_3]或单列int64栅格编号
+        values : ndarray
+            每行的数值，为None时每行计为1
+        weighted : bool
+            为False时按栅格中心点所在小区集计，为True时按栅格与小区的相交面积比例拆分集计
+
+        Returns
+        -------
+        result : ndarray
+            长度为小区数量的集计结果
+        '''
+        if weighted:
+            row, zone, weight = self.to_zone_weights(gridid)
+            if values is not None:
+                weight = weight * np.asarray(values, dtype=float)[row]
+            return np.bincount(zone, weights=weight, minlength=self.nzones)
+        zone = self.to_zone(gridid)
+        valid = zone >= 0
+        if values is not None:
+            values = np.asarray(values, dtype=float)[valid]
+        return np.bincount(zone[valid], weights=values,
+                           minlength=self.nzones).astype(float)
+
+    def save(self, path):
+        '''
+        保存为npz文件
+        '''
+        np.savez(path, params=json.dumps(self.params), nzones=self.nzones,
+                 keys=self.keys, zone=self.zone, pair_ptr=self.pair_ptr,
+                 pair_zone=self.pair_zone, pair_weight=self.pair_weight)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        从npz文件读取
+        '''
+        lookup = cls(None)
+        with np.load(path) as f:
+            lookup.params = json.loads(str(f['params']))
+            lookup.nzones = int(f['nzones'])
+            for key in ['keys', 'zone', 'pair_ptr', 'pair_zone',
+                        'pair_weight']:
+                setattr(lookup, key, f[key])
+        return lookup
+
+
+class GridBoundaryMask:
+    '''
+    研究范围栅格掩膜
+
+    将研究范围栅格化，每个栅格分为三类：完全在研究范围内、完全在研究范围外、与研究范围边界相交。
+    判断数据点是否在研究范围内时，前两类栅格中的点直接查表得到结果，仅边界栅格中的点做精确的点面判断，
+    结果与逐点判断一致。掩膜生成后可重复使用（见 :func:`transbigdata.clean_outofshape` 的mask参数）
+
+    Parameters
+    -------
+    shape : GeoDataFrame
+        研究范围
+    params : list, dict or GridSystem
+        栅格参数，仅支持方形栅格。为None时由shape的范围与accuracy生成
+    accuracy : number
+        栅格大小（米），params为None时有效
+
+    Attributes
+    -------
+    params : dict
+        栅格参数
+    loncol, latcol : int
+        mask第一列、第一行对应的栅格编号
+    mask : ndarray
+        栅格类别，行为LATCOL，列为LONCOL。0为研究范围外，1为研究范围内，2为边界栅格
+    geometry : Polygon or MultiPolygon
+        研究范围，用于边界栅格中的点的判断
+    '''
+    OUTSIDE = 0
+    INSIDE = 1
+    EDGE = 2
+
+    def __init__(self, shape, params=None, accuracy=500):
+        if params is None:
+            params = area_to_params(list(shape.total_bounds), accuracy)
+        params = convertparams(params)
+        if params['method'] != 'rect':
+            raise ValueError('GridBoundaryMask only supports rect grids')
+        self.params = dict(params)
+        self.geometry = shape.unary_union
+        loncol, latcol = grids_in_bounds(shape.total_bounds, params)
+        self.loncol = int(loncol.min())
+        self.latcol = int(latcol.min())
+        self.mask = np.zeros((latcol.max() - self.latcol + 1,
+                              loncol.max() - self.loncol + 1), dtype=np.int8)
+        # The cells are slightly enlarged so that points assigned to a cell
+        # by rounding near its border are still covered by its class
+        cells = gpd.GeoSeries(GridSystem(params).to_polygon(
+            [loncol, latcol])).buffer(
+            1e-6 * min(params['deltalon'], params['deltalat']),
+            join_style=2)
+        inside = cells.within(self.geometry).values
+        edge = cells.intersects(self.geometry).values & ~inside
+        cellclass = np.where(inside, self.INSIDE,
+                             np.where(edge, self.EDGE, self.OUTSIDE))
+        self.mask[latcol - self.latcol, loncol - self.loncol] = cellclass
+
+    def cell_class(self, gridid):
+        '''
+        栅格的类别
+
+        Parameters
+        -------
+        gridid : list or ndarray
+            栅格编号[LONCOL,LATCOL]、[loncol_1,loncol_2,loncol_3]或单列int64栅格编号
+
+        Returns
+        -------
+        cellclass : ndarray
+            0为研究范围外，1为研究范围内，2为边界栅格
+        '''
+        loncol, latcol = [np.atleast_1d(np.asarray(col, dtype=np.int64))
+                          for col in gridid_columns(gridid, self.params)]
+        i = latcol - self.latcol
+        j = loncol - self.loncol
+        valid = (i >= 0) & (i < self.mask.shape[0]) & \
+            (j >= 0) & (j < self.mask.shape[1])
+        cellclass = np.full(len(loncol), self.OUTSIDE, dtype=np.int8)
+        cellclass[valid] = self.mask[i[valid], j[valid]]
+        return cellclass
+
+    def contains(self, lon, lat, exact=True):
+        '''
+        判断数据点是否在研究范围内（含边界）
+
+        Parameters
+        -------
+        lon : Series or ndarray
+            经度
+        lat : Series or ndarray
+            纬度
+        exact : bool
+            为False时边界栅格中的点全部视为在研究范围内，不做精确判断
+
+        Returns
+        -------
+        inside : ndarray
+            布尔数组
+        '''
+        lon = coord_float(np.atleast_1d(np.asarray(lon)))
+        lat = coord_float(np.atleast_1d(np.asarray(lat)))
+        cellclass = self.cell_class(
+            GridSystem(self.params).to_grid(lon, lat))
+        if not exact:
+            return cellclass != self.OUTSIDE
+        inside = cellclass == self.INSIDE
+        edge = np.flatnonzero(cellclass == self.EDGE)
+        inside[edge] = points_in_geometry(lon[edge], lat[edge],
+                                          self.geometry)
+        return inside
+
+
 '''
 Utils
 '''
 
 
+__optimize_arrays = dict()
+__boundary_masks = dict()
+
+
+def grid_params_share(arrays):
+    # Copy the arrays into shared memory blocks for the worker processes
+    shms = dict()
+    for key, value in arrays.items():
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(value.nbytes, 1))
+        np.ndarray(value.shape, value.dtype, buffer=shm.buf)[:] = value
+        shms[key] = shm
+    return shms
+
+
+def grid_params_attach(arrays):
+    # Attach the trajectory arrays used by grid_params_fitness. The arrays
+    # are given directly or as shared memory blocks (name, shape, dtype),
+    # which are mapped read-only without copying
+    __optimize_arrays.clear()
+    for key, value in arrays.items():
+        if isinstance(value, tuple):
+            name, shape, dtype = value
+            shm = shared_memory.SharedMemory(name=name)
+            __optimize_arrays['shm_' + key] = shm
+            value = np.ndarray(shape, dtype, buffer=shm.buf)
+            value.flags.writeable = False
+        __optimize_arrays[key] = value
+
+
+def grid_params_fitness(params, optmethod):
+    # Fitness of the gridding params on the attached trajectory arrays
+    data = pd.DataFrame({key: __optimize_arrays[key]
+                         for key in ['uid', 'lon', 'lat']
+                         if key in __optimize_arrays}, copy=False)
+    if optmethod == 'centerdist':
+        return grid_index_centerdist(data, params)
+    if optmethod == 'gini':
+        return -grid_index_gini(data, params)
+    if optmethod == 'gridscount':
+        return grid_index_gridscount(data, params)
+
+
+def gini_index(counts):
+    # Gini index of the counts, sorted ascending first
+    p = np.sort(np.asarray(counts, dtype=np.float64))
+    N = len(p)
+    if N < 2:
+        return 0.0
+    Q = np.mean(p)
+    G = 2 / (N * (N - 1)) * (
+        (N + 1) * np.sum(p) - 2 * np.dot(N - np.arange(N), p))
+    return G / (2 * Q)
+
+
 def grid_to_centre_rect(loncol, latcol, params, from_origin=False):
     '''
     The center location of the grid for rect grids. The input is the
@@ -727,6 +1764,111 @@ def grid_to_centre_rect(loncol, latcol, params, from_origin=False):
     return hblon, hblat
 
 
+def gridid_columns(gridid, params):
+    # Grid ID given as packed keys are unpacked into index columns
+    if isinstance(gridid, (list, tuple)) or (np.ndim(gridid) == 2):
+        return list(gridid)
+    return key_to_grid(gridid, params)
+
+
+def grids_in_bounds(bounds, params):
+    '''
+    Enumerate the grids whose centres lie within the bounds extended by
+    1.5 grids on each side. The index ranges are derived from the grid
+    parameters directly, so no sample points are generated.
+
+    Parameters
+    -------
+    bounds : List
+        [lon1, lat1, lon2, lat2]
+    params : List or dict
+        Gridding parameters
+
+    Returns
+    -------
+    gridid : list
+        [LONCOL, LATCOL] for rect grids or
+        [loncol_1, loncol_2, loncol_3] for tri and hexa grids
+    '''
+    params = convertparams(params)
+    method = params['method']
+    deltaLon = params['deltalon']
+    deltaLat = params['deltalat']
+    theta = params['theta']
+    lon1 = bounds[0] - 1.5 * deltaLon
+    lat1 = bounds[1] - 1.5 * deltaLat
+    lon2 = bounds[2] + 1.5 * deltaLon
+    lat2 = bounds[3] + 1.5 * deltaLat
+    # Corners of the extended bounds in grid units
+    x = (np.array([lon1, lon2, lon1, lon2]) - params['slon']) / deltaLon
+    y = (np.array([lat1, lat1, lat2, lat2]) - params['slat']) / deltaLat
+
+    def index_range(angle):
+        # Indexes of the strips at the given angle covering the corners
+        u = np.cos(angle * np.pi / 180) * x - np.sin(angle * np.pi / 180) * y
+        return np.arange(np.floor(u.min()) - 1, np.ceil(u.max()) + 2,
+                         dtype=np.int64)
+    if method == 'rect':
+        # latcol is the strip index at theta - 90
+        loncol, latcol = np.meshgrid(index_range(theta),
+                                     index_range(theta - 90))
+        gridid = [loncol.ravel(), latcol.ravel()]
+    else:
+        loncol_1, loncol_2 = np.meshgrid(index_range(theta),
+                                         index_range(theta + 60))
+        loncol_1 = loncol_1.ravel()
+        loncol_2 = loncol_2.ravel()
+        if method == 'tri':
+            # Each pair of strips is split into two triangles by the third
+            loncol_1 = np.repeat(loncol_1, 2)
+            loncol_2 = np.repeat(loncol_2, 2)
+            loncol_3 = loncol_2 - loncol_1 - np.tile([1, 0], len(loncol_1)//2)
+        else:
+            # Hexagons are centred on the strip vertices with (i+j)%3==2
+            valid = (loncol_1 + loncol_2) % 3 == 2
+            loncol_1 = loncol_1[valid]
+            loncol_2 = loncol_2[valid]
+            loncol_3 = loncol_2 - loncol_1
+        gridid = [loncol_1, loncol_2, loncol_3]
+    hblon, hblat = grid_to_centre(gridid, params)
+    hblon = np.atleast_1d(hblon)
+    hblat = np.atleast_1d(hblat)
+    inbounds = (hblon >= lon1) & (hblon < lon2) & \
+        (hblat >= lat1) & (hblat < lat2)
+    gridid = [col[inbounds] for col in gridid]
+    if method == 'rect':
+        order = np.lexsort((gridid[0], gridid[1]))
+        gridid = [col[order] for col in gridid]
+    return gridid
+
+
+def lookup_attributes(shape, zone):
+    # Attributes of the zones in the same layout as gpd.sjoin, rows with
+    # zone -1 are filled with NaN
+    attributes = pd.DataFrame(shape.drop(columns=shape.geometry.name))
+    attributes.insert(0, 'index_right', shape.index)
+    attributes = attributes.reset_index(drop=True).reindex(zone)
+    return attributes.reset_index(drop=True)
+
+
+def grid_sindex_query_pairs(shape, geometry):
+    # Pairs of positions (geometry, shape) that intersect, the bounding
+    # boxes are checked against the STRtree of the shape before the exact
+    # intersection test
+    sindex = shape.sindex
+    try:
+        hit = sindex.query(geometry.values, predicate='intersects')
+    except (TypeError, ValueError):
+        hit = sindex.query_bulk(geometry, predicate='intersects')
+    order = np.lexsort((hit[1], hit[0]))
+    return hit[0][order].astype(np.int64), hit[1][order].astype(np.int64)
+
+
+def grid_sindex_query(shape, geometry):
+    # Positions of the geometries that intersect the shape
+    return grid_sindex_query_pairs(shape, geometry)[0]
+
+
 def GPS_to_grids_rect(lon, lat, params, from_origin=False):
     '''
     Match the GPS data to the grids. The input is the columns of
@@ -933,6 +2075,72 @@ def GPS_to_grids_hexa(lon, lat, params):
     return loncol_1, loncol_2, loncol_3
 
 
+def grid_strip_coefficients(params):
+    '''
+    The coefficients to get the strip index of the grids from the
+    coordinates: index = floor((lon - x0) * a + (lat - y0) * b).
+    For rect grids the two rows are the LONCOL and LATCOL strips,
+    for tri and hexa grids the three rows are the strips at theta,
+    theta+60 and theta+120.
+    '''
+    lonStart = params['slon']
+    latStart = params['slat']
+    deltaLon = params['deltalon']
+    deltaLat = params['deltalat']
+    theta = params['theta']
+    if params['method'] == 'rect':
+        angles = [theta]
+    else:
+        angles = [theta, theta+60, theta+120]
+    coefficients = []
+    for angle in angles:
+        costheta = np.cos(angle * np.pi / 180)
+        sintheta = np.sin(angle * np.pi / 180)
+        R = np.array([[costheta * deltaLon, -sintheta * deltaLat],
+                      [sintheta * deltaLon, costheta * deltaLat]])
+        invR = np.linalg.inv(R)
+        if params['method'] == 'rect':
+            x0, y0 = np.array([lonStart, latStart]) - R[0, :] / 2 - \
+                R[1, :] / 2
+            coefficients.append([x0, y0, invR[0, 0], invR[1, 0]])
+            coefficients.append([x0, y0, invR[0, 1], invR[1, 1]])
+        else:
+            coefficients.append([lonStart, latStart, invR[0, 0], invR[1, 0]])
+    return coefficients
+
+
+def GPS_to_grid_block(lon, lat, coefficients, method):
+    '''
+    Grid ID of a block of GPS data, computed with the strip coefficients
+    from `grid_strip_coefficients`.
+    '''
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    gridid = []
+    for x0, y0, a, b in coefficients:
+        index = (lon - x0) * a
+        index += (lat - y0) * b
+        gridid.append(np.floor(index, out=index).astype(np.int64))
+    if method == 'hexa':
+        # The hexagon is given by the first of the six neighbouring
+        # strip vertices that satisfies the vertex rule, which only
+        # depends on the strip indexes modulo 3
+        offsets = np.array([[1, 1, 1], [1, 1, 0], [1, 0, 0],
+                            [0, 1, 1], [0, 0, 1], [0, 0, 0]])
+        vertices = [(1, 1, 0), (2, 0, 1), (0, 2, 2)]
+        lookup = np.zeros((27, 3), dtype=np.int64)
+        for r in range(27):
+            for offset in offsets:
+                if (((r // 9 + offset[0]) % 3, (r // 3 + offset[1]) % 3,
+                     (r + offset[2]) % 3) in vertices):
+                    lookup[r] = offset
+                    break
+        r = (gridid[0] % 3) * 9 + (gridid[1] % 3) * 3 + gridid[2] % 3
+        offset = lookup[r]
+        gridid = [gridid[i] + offset[:, i] for i in range(3)]
+    return gridid
+
+
 def gridid_to_polygon_rect(loncol, latcol, params):
     '''
     Generate the geometry column based on the grid ID.
@@ -983,8 +2191,7 @@ def gridid_to_polygon_rect(loncol, latcol, params):
     b = hblonhblat_b
     c = hblonhblat_c
     d = hblonhblat_d
-    from shapely.geometry import Polygon
-    return [Polygon([a[i], b[i], c[i], d[i], a[i]]) for i in range(len(a))]
+    return coords_to_polygons(np.stack([a, b, c, d, a], axis=1))
 
 
 def gettripoints(loncol_1, loncol_2, loncol_3, params):
@@ -1084,12 +2291,9 @@ def gridid_to_polygon_tri(loncol_1, loncol_2, loncol_3, params):
     loncol_3 = pd.Series(loncol_3, name='k')
 
     testpoint = gettripoints(loncol_1, loncol_2, loncol_3, params)
-
-    geometry = testpoint.apply(
-        lambda r: Polygon(np.array([[r['p1_x'], r['p1_y']],
-                                    [r['p2_x'], r['p2_y']],
-                                    [r['p3_x'], r['p3_y']]]).round(6)), axis=1)
-    return list(geometry)
+    coords = testpoint[['p1_x', 'p1_y', 'p2_x', 'p2_y', 'p3_x', 'p3_y',
+                        'p1_x', 'p1_y']].values.reshape(-1, 4, 2)
+    return coords_to_polygons(coords.round(6))
 
 
 def gridid_to_polygon_hexa(loncol_1, loncol_2, loncol_3, params):
@@ -1114,37 +2318,33 @@ def gridid_to_polygon_hexa(loncol_1, loncol_2, loncol_3, params):
     geometry : Series
         The column of grid geographic polygon
     '''
-    i = pd.Series(loncol_1, name='i')
-    j = pd.Series(loncol_2, name='j')
-    k = pd.Series(loncol_3, name='k')
-    gridid = pd.DataFrame(np.array([i, j, k]).T, columns=['i', 'j', 'k'])
-    tmp = pd.concat([pd.DataFrame(np.array([i-1, j-1, k-1, i, j, k]).T),
-                     pd.DataFrame(np.array([i-1, j-1, k, i, j, k]).T),
-                     pd.DataFrame(np.array([i-1, j, k, i, j, k]).T),
-                     pd.DataFrame(np.array([i, j-1, k-1, i, j, k]).T),
-                     pd.DataFrame(np.array([i, j, k-1, i, j, k]).T),
-                     pd.DataFrame(np.array([i, j, k, i, j, k]).T)])
-    tmp.columns = ['loncol_1', 'loncol_2', 'loncol_3', 'i', 'j', 'k']
-    tmp['geometry'] = list(
-        gettripoints(
-            tmp['loncol_1'],
-            tmp['loncol_2'],
-            tmp['loncol_3'], params).apply(
-            lambda r: Polygon(
-                np.array([[r['p1_x'], r['p1_y']],
-                          [r['p2_x'], r['p2_y']],
-                          [r['p3_x'], r['p3_y']]]).round(6)), axis=1))
-    tmp = gpd.GeoDataFrame(tmp)
-    tmp['gridid'] = tmp['i'].astype(
-        'str')+','+tmp['j'].astype('str')+','+tmp['k'].astype('str')
-    tmp1 = merge_polygon(tmp, 'gridid')
-    geometry = pd.merge(gridid, pd.merge(
-        tmp1, tmp[['gridid', 'i', 'j', 'k']].drop_duplicates()))['geometry']
-    return list(geometry)
+    params = dict(convertparams(params), method='hexa')
+    i = np.asarray(pd.Series(loncol_1), dtype=float)
+    j = np.asarray(pd.Series(loncol_2), dtype=float)
+    # The hexagon center is the vertex (i, j) of the triangle grid, the six
+    # hexagon vertices are the neighbouring triangle vertices around it
+    offsets = [(1, 0), (1, 1), (0, 1), (-1, 0), (-1, -1), (0, -1)]
+    vertex_i = np.concatenate([i + a for a, _ in offsets])
+    vertex_j = np.concatenate([j + b for _, b in offsets])
+    x, y = grid_to_centre([vertex_i, vertex_j, np.zeros(len(vertex_i))],
+                          params)
+    coords = np.array([x, y]).reshape(2, len(offsets), len(i)).transpose(
+        2, 1, 0)
+    coords = np.concatenate([coords, coords[:, :1]], axis=1)
+    return coords_to_polygons(coords.round(6))
+
+
+def gridsystem(params):
+    # GridSystem of the params, reused if params is already a GridSystem
+    if isinstance(params, GridSystem):
+        return params
+    return GridSystem(params)
 
 
 def convertparams(params):
     # Convertparams from list to dict
+    if isinstance(params, GridSystem):
+        return params.params
     if (type(params) == list) | (type(params) == tuple):
         if len(params) == 4:
             lonStart, latStart, deltaLon, deltaLat = params
@@ -1173,6 +2373,52 @@ def convertparams(params):
     return dicparams
 
 
+def boundary_mask_cached(shape, accuracy):
+    # GridBoundaryMask of the shape, reused for the same geometries and
+    # accuracy. At most 8 masks are kept
+    key = (tuple(geometry.wkb for geometry in shape.geometry), accuracy)
+    if key not in __boundary_masks:
+        if len(__boundary_masks) >= 8:
+            __boundary_masks.pop(next(iter(__boundary_masks)))
+        __boundary_masks[key] = GridBoundaryMask(shape, accuracy=accuracy)
+    return __boundary_masks[key]
+
+
+def points_in_geometry(lon, lat, geometry):
+    # Whether the points intersect the geometry, tested point by point in
+    # one vectorized call with shapely 2
+    try:
+        from shapely import intersects_xy, prepare
+    except ImportError:
+        return gpd.GeoSeries(gpd.points_from_xy(lon, lat)).intersects(
+            geometry).values
+    prepare(geometry)
+    return intersects_xy(geometry, lon, lat)
+
+
+def coords_to_polygons(coords):
+    '''
+    Build polygons from a coordinate array in bulk.
+
+    Parameters
+    -------
+    coords : ndarray
+        The vertices of the polygons, shape (n, m, 2)
+
+    Returns
+    -------
+    geometry : list
+        The polygons. Built in one call with shapely 2, or polygon by
+        polygon with older shapely.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    try:
+        from shapely import polygons
+    except ImportError:
+        return [Polygon(c) for c in coords]
+    return list(polygons(coords))
+
+
 '''
 Old namespace
 '''
@@ -1243,6 +2489,9 @@ __decodemap = {}
 for i in range(len(__base32)):
     __decodemap[__base32[i]] = i
 del i
+__base32_array = np.frombuffer(__base32.encode('ascii'), dtype=np.uint8)
+__decode_array = np.full(256, 255, dtype=np.uint8)
+__decode_array[__base32_array] = np.arange(32, dtype=np.uint8)
 
 
 def decode_exactly(geohash):
@@ -1313,10 +2562,277 @@ def encode(longitude, latitude, precision=12):
     return ''.join(geohash)
 
 
-def geohash_encode(lon, lat, precision=12):
+def encode_array(lon, lat, precision=12):
+    '''
+    Encode arrays of coordinates into geohash characters at once.
+
+    The bisection of `encode` is applied to the whole arrays bit by bit,
+    so the result is identical to calling `encode` on every point. It works
+    for any precision, `encode_int` is faster for precision up to 12.
+
+    Parameters
+    -------
+    lon : array-like
+        The longitude
+    lat : array-like
+        The latitude
+    precision : int
+        The length of the geohash
+
+    Returns
+    -------
+    chars : ndarray
+        uint8 array of shape (n, precision), the base32 value (0-31) of
+        each geohash character
+    '''
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    n = len(lon)
+    lon_lo, lon_hi = np.full(n, -180.0), np.full(n, 180.0)
+    lat_lo, lat_hi = np.full(n, -90.0), np.full(n, 90.0)
+    chars = np.zeros((n, precision), dtype=np.uint8)
+    even = True
+    for c in range(precision):
+        ch = np.zeros(n, dtype=np.uint8)
+        for b in range(5):
+            if even:
+                value, lo, hi = lon, lon_lo, lon_hi
+            else:
+                value, lo, hi = lat, lat_lo, lat_hi
+            mid = (lo + hi) / 2
+            bit = value > mid
+            np.copyto(lo, mid, where=bit)
+            np.copyto(hi, mid, where=~bit)
+            ch <<= 1
+            ch |= bit
+            even = not even
+        chars[:, c] = ch
+    return chars
+
+
+def decode_array(chars):
+    '''
+    Decode geohash characters into the center and the error of the cells.
+
+    The bisection of `decode_exactly` is applied to the whole arrays bit by
+    bit, so the result is identical to calling `decode_exactly` on every
+    geohash.
+
+    Parameters
+    -------
+    chars : ndarray
+        uint8 array of shape (n, precision), the base32 value (0-31) of
+        each geohash character
+
+    Returns
+    -------
+    lon, lat, lon_err, lat_err : ndarray
+        The center of the geohash cells and the half size of the cells
+    '''
+    n, precision = chars.shape
+    lon_lo, lon_hi = np.full(n, -180.0), np.full(n, 180.0)
+    lat_lo, lat_hi = np.full(n, -90.0), np.full(n, 90.0)
+    lon_err, lat_err = 180.0, 90.0
+    even = True
+    for c in range(precision):
+        ch = np.ascontiguousarray(chars[:, c])
+        for mask in [16, 8, 4, 2, 1]:
+            bit = (ch & mask).astype(bool)
+            if even:
+                lon_err /= 2
+                lo, hi = lon_lo, lon_hi
+            else:
+                lat_err /= 2
+                lo, hi = lat_lo, lat_hi
+            mid = (lo + hi) / 2
+            np.copyto(lo, mid, where=bit)
+            np.copyto(hi, mid, where=~bit)
+            even = not even
+    lon = (lon_lo + lon_hi) / 2
+    lat = (lat_lo + lat_hi) / 2
+    return lon, lat, np.full(n, lon_err), np.full(n, lat_err)
+
+
+def interval_index(value, start, width, nbits):
+    # The index of the bisection interval (lo, lo+width] holding the value.
+    # All interval bounds are dyadic and exact in float64, the estimate from
+    # the division is corrected against them so that the index is the same
+    # as the one given by bisection (`value > mid` goes to the upper half).
+    k = np.ceil((value - start) / width) - 1
+    k = np.nan_to_num(k, nan=0)
+    k = np.clip(k, 0, 2**nbits - 1).astype(np.int64)
+    lo = k * width + start
+    k = k - ((value <= lo) & (k > 0))
+    lo = k * width + start
+    k = k + ((value > lo + width) & (k < 2**nbits - 1))
+    return k.astype(np.uint64)
+
+
+def spread_bits(x):
+    # Spread the lower 32 bits of x to the even bits of an uint64
+    x = x & np.uint64(0x00000000FFFFFFFF)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x3333333333333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return x
+
+
+def compact_bits(x):
+    # Inverse of spread_bits, gather the even bits of an uint64
+    x = x & np.uint64(0x5555555555555555)
+    x = (x | (x >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    x = (x | (x >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x | (x >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x | (x >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return x
+
+
+def encode_int(lon, lat, precision=12):
+    '''
+    Encode arrays of coordinates into integer geohash by bit interleaving.
+
+    Gives the same geohash as `encode`, the longitude bits take the even
+    positions counted from the most significant bit.
+
+    Parameters
+    -------
+    lon : array-like
+        The longitude
+    lat : array-like
+        The latitude
+    precision : int
+        The length of the geohash, up to 12
+
+    Returns
+    -------
+    codes : ndarray
+        uint64 array, 5 bits for each geohash character
+    '''
+    if precision > 12:
+        raise ValueError('Integer geohash only supports precision up to 12')
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    nbits = 5 * precision
+    lonbits = (nbits + 1) // 2
+    latbits = nbits // 2
+    loncode = spread_bits(interval_index(
+        lon, -180.0, 360.0 / 2**lonbits, lonbits))
+    latcode = spread_bits(interval_index(
+        lat, -90.0, 180.0 / 2**latbits, latbits))
+    if nbits % 2 == 0:
+        return (loncode << np.uint64(1)) | latcode
+    else:
+        return loncode | (latcode << np.uint64(1))
+
+
+def decode_int(codes, precision=12):
+    '''
+    Decode integer geohash into the center and the error of the cells.
+
+    Gives the same result as `decode_exactly`.
+
+    Parameters
+    -------
+    codes : ndarray
+        uint64 array, 5 bits for each geohash character
+    precision : int
+        The length of the geohash, up to 12
+
+    Returns
+    -------
+    lon, lat, lon_err, lat_err : ndarray
+        The center of the geohash cells and the half size of the cells
+    '''
+    if precision > 12:
+        raise ValueError('Integer geohash only supports precision up to 12')
+    codes = np.atleast_1d(np.asarray(codes)).astype(np.uint64)
+    nbits = 5 * precision
+    lonbits = (nbits + 1) // 2
+    latbits = nbits // 2
+    if nbits % 2 == 0:
+        loncode = compact_bits(codes >> np.uint64(1))
+        latcode = compact_bits(codes)
+    else:
+        loncode = compact_bits(codes)
+        latcode = compact_bits(codes >> np.uint64(1))
+    lonwidth = 360.0 / 2**lonbits
+    latwidth = 180.0 / 2**latbits
+    lon_lo = loncode.astype(np.int64) * lonwidth - 180.0
+    lat_lo = latcode.astype(np.int64) * latwidth - 90.0
+    lon = (lon_lo + (lon_lo + lonwidth)) / 2
+    lat = (lat_lo + (lat_lo + latwidth)) / 2
+    n = len(codes)
+    return lon, lat, np.full(n, lonwidth / 2), np.full(n, latwidth / 2)
+
+
+def codes_to_chars(codes, precision):
+    # Split integer geohash into the base32 value of each character
+    shifts = np.uint64(5) * np.arange(precision-1, -1, -1, dtype=np.uint64)
+    return ((codes[:, None] >> shifts) & np.uint64(31)).astype(np.uint8)
+
+
+def chars_to_codes(chars):
+    # Join the base32 value of each character into integer geohash
+    codes = np.zeros(len(chars), dtype=np.uint64)
+    for c in range(chars.shape[1]):
+        codes = (codes << np.uint64(5)) | chars[:, c].astype(np.uint64)
+    return codes
+
+
+def geohash_to_chars(geohash, precision=None):
+    '''
+    Convert geohash given as strings, bytes or integers into the uint8
+    character array used by `decode_array`.
+
+    Geohash of different lengths are returned as a list of
+    (position, chars) pairs, one for each length.
+    '''
+    geohash = np.atleast_1d(np.asarray(geohash))
+    if geohash.dtype.kind in 'iu':
+        if precision is None:
+            raise ValueError(
+                'precision should be given for integer geohash')
+        chars = codes_to_chars(geohash.astype(np.uint64), precision)
+        return [(np.arange(len(geohash)), chars)]
+    if geohash.dtype.kind != 'S':
+        geohash = geohash.astype('S')
+    lengths = np.char.str_len(geohash)
+    result = []
+    for length in np.unique(lengths):
+        position = np.flatnonzero(lengths == length)
+        chars = geohash[position].astype('S'+str(length)).view(
+            np.uint8).reshape(-1, length)
+        chars = __decode_array[chars]
+        if (chars == 255).any():
+            raise ValueError('Invalid geohash character')
+        result.append((position, chars))
+    return result
+
+
+def geohash_decode_exactly(geohash, precision=None):
+    # Decode geohash of any form into the center and error arrays
+    n = len(np.atleast_1d(np.asarray(geohash)))
+    lon, lat = np.full(n, np.nan), np.full(n, np.nan)
+    lon_err, lat_err = np.full(n, np.nan), np.full(n, np.nan)
+    for position, chars in geohash_to_chars(geohash, precision):
+        if chars.shape[1] <= 12:
+            result = decode_int(chars_to_codes(chars), chars.shape[1])
+        else:
+            result = decode_array(chars)
+        lon[position], lat[position], lon_err[position], lat_err[position] = \
+            result
+    return lon, lat, lon_err, lat_err
+
+
+def geohash_encode(lon, lat, precision=12, output='str'):
     '''
     输入经纬度与精度，输出geohash编码
 
+    整列数据以NumPy数组一次性完成二分编码，结果与逐行编码完全一致
+
     Parameters
     -------
     lon : Series
@@ -1324,29 +2840,46 @@ def geohash_encode(lon, lat, precision=12):
     lat : Series
         纬度列
     precision : number
-        geohash精度    
+        geohash精度
+    output : str
+        输出形式，`str`为字符串Series，`bytes`为定长字节数组（numpy的`S`类型），
+        `int`为uint64整数数组（每个字符5位，precision不能超过12）
 
     Returns
     -------
-    geohash : Series
-        geohash编码列 
+    geohash : Series or ndarray
+        geohash编码列
     '''
-    tmp = pd.DataFrame()
-    tmp['lon'] = lon
-    tmp['lat'] = lat
-    geohash = tmp.apply(lambda r: encode(
-        r['lon'], r['lat'], precision), axis=1)
-    return geohash
+    if precision <= 12:
+        codes = encode_int(lon, lat, precision)
+        if output == 'int':
+            return codes
+        chars = codes_to_chars(codes, precision)
+    elif output == 'int':
+        raise ValueError('Integer geohash only supports precision up to 12')
+    else:
+        chars = encode_array(lon, lat, precision)
+    geohash = np.ascontiguousarray(__base32_array[chars]).view(
+        'S'+str(precision)).ravel()
+    if output == 'bytes':
+        return geohash
+    elif output == 'str':
+        index = lon.index if isinstance(lon, pd.Series) else None
+        return pd.Series(geohash.astype(str), index=index, dtype=object)
+    else:
+        raise ValueError('output should be `str`, `bytes` or `int`')
 
 
-def geohash_decode(geohash):
+def geohash_decode(geohash, precision=None):
     '''
     输入geohash，输出经纬度
 
     Parameters
     -------
     geohash : Series
-        geohash编码列   
+        geohash编码列，可为字符串、定长字节数组或uint64整数数组
+    precision : number
+        geohash精度，仅在输入为整数时需要
 
     Returns
     -------
@@ -1355,36 +2888,41 @@ def geohash_decode(geohash):
     lat : Series
         纬度列
     '''
-    lonslats = geohash.apply(decode)
-    lon = lonslats.apply(lambda r: r[0])
-    lat = lonslats.apply(lambda r: r[1])
-    return lon, lat
+    lon, lat, _, _ = geohash_decode_exactly(geohash, precision)
+    index = geohash.index if isinstance(geohash, pd.Series) else None
+    return pd.Series(lon, index=index), pd.Series(lat, index=index)
 
 
-def geohash_togrid(geohash):
+def geohash_togrid(geohash, precision=None):
     '''
     输入geohash编码，输出geohash网格的地理信息图形Series列
 
     Parameters
     -------
     geohash : Series
-        geohash编码列  
+        geohash编码列，可为字符串、定长字节数组或uint64整数数组
+    precision : number
+        geohash精度，仅在输入为整数时需要
 
     Returns
     -------
     poly : Series
         geohash的栅格列
     '''
-    lonslats = geohash.apply(decode_exactly)
-
-    def topoly(r):
-        (lon, lat, lon_err, lat_err) = r
-        from shapely.geometry import Polygon
-        return Polygon([[lon-lon_err, lat-lat_err],
-                        [lon-lon_err, lat+lat_err],
-                        [lon+lon_err, lat+lat_err],
-                        [lon+lon_err, lat-lat_err],
-                        [lon-lon_err, lat-lat_err],
-                        ])
-    poly = lonslats.apply(topoly)
+    lon, lat, lon_err, lat_err = geohash_decode_exactly(geohash, precision)
+    index = geohash.index if isinstance(geohash, pd.Series) else None
+    try:
+        from shapely import box
+    except ImportError:
+        coords = np.stack([
+            np.array([lon-lon_err, lat-lat_err]).T,
+            np.array([lon-lon_err, lat+lat_err]).T,
+            np.array([lon+lon_err, lat+lat_err]).T,
+            np.array([lon+lon_err, lat-lat_err]).T,
+            np.array([lon-lon_err, lat-lat_err]).T], axis=1)
+        geometry = coords_to_polygons(coords)
+    else:
+        geometry = box(lon-lon_err, lat-lat_err,
+                       lon+lon_err, lat+lat_err, ccw=False)
+    poly = pd.Series(geometry, index=index, dtype=object)
     return poly
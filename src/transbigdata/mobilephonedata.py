@@ -30,9 +30,12 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
+import math
 import pandas as pd
 import numpy as np
 from .grids import GPS_to_grid, grid_to_centre
+from .preprocess import to_datetime, sort_records
+from .coordinates import coord_float
 
 
 def mobile_stay_move(data, params,
@@ -66,7 +69,7 @@ def mobile_stay_move(data, params,
     data = data.sort_values(by=col[:2])
     stay = data.copy()
     stay = stay.rename(columns={lon: 'lon', lat: 'lat', timecol: 'stime'})
-    stay['stime'] = pd.to_datetime(stay['stime'])
+    stay['stime'] = to_datetime(stay['stime'])
     stay['LONCOL'], stay['LATCOL'] = GPS_to_grid(
         stay['lon'], stay['lat'], params)
     # Number the status
@@ -79,8 +82,8 @@ def mobile_stay_move(data, params,
     stay['etime'] = stay['stime'].shift(-1)
     stay = stay[stay[uid] == stay[uid].shift(-1)].copy()
     # Remove the duration shorter than given activitytime
-    stay['duration'] = (pd.to_datetime(stay['etime']) -
-                        pd.to_datetime(stay['stime'])).dt.total_seconds()
+    stay['duration'] = (to_datetime(stay['etime']) -
+                        to_datetime(stay['stime'])).dt.total_seconds()
     stay = stay[stay['duration'] >= activitytime].copy()
     # Renumber the status
     stay['status_id'] = ((stay['LONCOL'] != stay['LONCOL'].shift()) |
@@ -95,9 +98,14 @@ def mobile_stay_move(data, params,
         'status_id', axis=1)
     stay['lon'], stay['lat'] = grid_to_centre(
         [stay['LONCOL'], stay['LATCOL']], params)
-    stay['duration'] = (pd.to_datetime(stay['etime']) -
-                        pd.to_datetime(stay['stime'])).dt.total_seconds()
-    # Identify move
+    stay['duration'] = (to_datetime(stay['etime']) -
+                        to_datetime(stay['stime'])).dt.total_seconds()
+    move = stay_to_move(stay, uid)
+    return stay, move
+
+
+def stay_to_move(stay, uid):
+    # Identify move between the adjacent stays of each individual
     move = stay.copy()
     move['stime_next'] = move['stime'].shift(-1)
     move['elon'] = move['lon'].shift(-1)
@@ -116,9 +124,140 @@ def mobile_stay_move(data, params,
                                 })
     move['duration'] = (
         move['etime'] - move['stime']).dt.total_seconds()
+    return move
+
+
+def mobile_stay_point(data, col=['ID', 'dataTime', 'longitude', 'latitude'],
+                      distlimit=200, activitytime=1800, params=None):
+    '''
+    基于距离与时间阈值识别活动与出行
+
+    直接在经纬度上识别停留点，不受栅格边界影响。对每个个体按时间顺序扫描一遍轨迹点，
+    与当前停留点的质心距离在distlimit内的轨迹点并入停留点并更新质心，否则以该轨迹点开始新的停留点；
+    首末轨迹点的时间差不小于activitytime的视为停留。输出的停留与出行信息与
+    :func:`transbigdata.mobile_stay_move` 格式相同，可用于识别居住地与工作地
+
+    Parameters
+    ----------------
+    data : DataFrame
+        轨迹数据集
+    col : List
+        数据的列名[个体，时间，经度，纬度]顺序
+    distlimit : Number
+        停留点的距离阈值（米）
+    activitytime : Number
+        多长时间识别为停留
+    params : List
+        可选，栅格化参数。给定时LONCOL、LATCOL为停留点质心所在的栅格编号；
+        不给定时同一个体质心距离在distlimit内的停留点视为同一地点，LONCOL、LATCOL为该地点的质心经纬度
+
+    Returns
+    ----------------
+    stay : DataFrame
+        个体停留信息，lon、lat为停留点的质心，stime、etime为停留点首末轨迹点的时间
+    move : DataFrame
+        个体移动信息
+    '''
+    uid, timecol, lon, lat = col
+    times = to_datetime(data[timecol])
+    index, ids = sort_records(data[uid].values, times.values)
+    times = times.values.take(index)
+    start, end, lons, lats = stay_points(
+        ids, times.astype('datetime64[ns]').view(np.int64) / 1e9,
+        coord_float(data[lon].values.take(index)),
+        coord_float(data[lat].values.take(index)), distlimit, activitytime)
+    stay = pd.DataFrame({uid: data[uid].values.take(index[start]),
+                         'stime': times[start]})
+    if params is not None:
+        stay['LONCOL'], stay['LATCOL'] = GPS_to_grid(lons, lats, params)
+    else:
+        stay['LONCOL'], stay['LATCOL'] = stay_locations(
+            ids[start], lons, lats, distlimit)
+    stay['etime'] = times[end]
+    stay['lon'], stay['lat'] = lons, lats
+    stay['duration'] = (stay['etime'] - stay['stime']).dt.total_seconds()
+    move = stay_to_move(stay, uid)
     return stay, move
 
 
+def stay_points(ids, times, lons, lats, distlimit, activitytime):
+    # Scan the sorted records once. A record within distlimit of the centroid
+    # of the current cluster joins it and updates the centroid, otherwise it
+    # starts a new cluster. Returns the first and last record and the centroid
+    # of the clusters lasting at least activitytime
+    ids, times = ids.tolist(), times.tolist()
+    lons, lats = lons.tolist(), lats.tolist()
+    n = len(ids)
+    result = []
+    first = 0
+    clon, clat, count = (lons[0], lats[0], 1) if n else (0, 0, 0)
+    for i in range(1, n + 1):
+        if i < n and ids[i] == ids[first] and \
+                haversine(lons[i], lats[i], clon, clat) <= distlimit:
+            count += 1
+            clon += (lons[i] - clon) / count
+            clat += (lats[i] - clat) / count
+            continue
+        if times[i - 1] - times[first] >= activitytime:
+            result.append((first, i - 1, clon, clat))
+        if i < n:
+            first, clon, clat, count = i, lons[i], lats[i], 1
+    if not result:
+        return (np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                np.zeros(0), np.zeros(0))
+    start, end, clons, clats = zip(*result)
+    return np.array(start), np.array(end), np.array(clons), np.array(clats)
+
+
+def stay_locations(ids, lons, lats, distlimit):
+    # Merge the stays of each individual within distlimit of the centroid of
+    # a location found before, returns the centroid of the locations. The
+    # locations are bucketed in cells at least distlimit wide, so only the
+    # locations in the 3x3 cells around a stay are compared with it
+    lats_max = pd.Series(np.abs(lats)).groupby(ids).transform('max').values
+    cellwidth = distlimit / (math.pi / 180 * 6371000)
+    lonwidth = (cellwidth / np.cos(np.radians(np.minimum(
+        lats_max + cellwidth, 89.9)))).tolist()
+    lons, lats = lons.tolist(), lats.tolist()
+    places = []
+    cells = dict()
+    label = []
+    for i, j, k, w in zip(ids.tolist(), lons, lats, lonwidth):
+        if not (math.isfinite(j) and math.isfinite(k)):
+            label.append([j, k])
+            continue
+        x, y = math.floor(j / w), math.floor(k / cellwidth)
+        # The first location found before within distlimit
+        near = sorted(n for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                      for n in cells.get((i, x + dx, y + dy), ()))
+        for n in near:
+            place = places[n]
+            if haversine(j, k, place[0], place[1]) <= distlimit:
+                cells[place[3]].remove(n)
+                place[2] += 1
+                place[0] += (j - place[0]) / place[2]
+                place[1] += (k - place[1]) / place[2]
+                break
+        else:
+            n = len(places)
+            place = [j, k, 1, None]
+            places.append(place)
+        # The location moves to the cell of its new centroid
+        place[3] = (i, math.floor(place[0] / w),
+                    math.floor(place[1] / cellwidth))
+        cells.setdefault(place[3], set()).add(n)
+        label.append(place)
+    return [place[0] for place in label], [place[1] for place in label]
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    # Distance in metres between two points, same as getdistance
+    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * \
+        math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+    return 2 * math.asin(min(a, 1)**0.5) * 6371000
+
+
 def mobile_stay_dutation(staydata, col=['stime', 'etime'], start_hour=8, end_hour=20):
     '''
     识别停留点的白天与夜晚持续时间
@@ -150,8 +289,8 @@ def mobile_stay_dutation(staydata, col=['stime', 'etime'], start_hour=8, end_hou
     day_hour = end_hour-start_hour
     stay = staydata.copy()
     stime, etime = col
-    stay[stime] = pd.to_datetime(stay[stime])
-    stay[etime] = pd.to_datetime(stay[etime])
+    stay[stime] = to_datetime(stay[stime])
+    stay[etime] = to_datetime(stay[etime])
 
     stay['preday'] = pd.to_datetime(
         stay[stime].dt.date)-pd.Timedelta(1, unit='days')+pd.Timedelta(end_hour, unit='hours')
@@ -246,8 +385,8 @@ def mobile_identify_work(staydata, col=['uid', 'stime', 'etime', 'LONCOL', 'LATC
     etime = col[2]
     stay = staydata.copy()
 
-    stay[stime] = pd.to_datetime(stay[stime])
-    stay[etime] = pd.to_datetime(stay[etime])
+    stay[stime] = to_datetime(stay[stime])
+    stay[etime] = to_datetime(stay[etime])
 
     # 在工作日出现的日期数
     stay_workdays = stay[(stay[stime].dt.weekday >= workdaystart) &
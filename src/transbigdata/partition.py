@@ -0,0 +1,391 @@
+'''
+BSD 3-Clause License
+
+Copyright (c) 2021, Qing Yu
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os
+import glob
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+def partition_by_id(path, outdir, col, npartitions=64, chunksize=1000000,
+                    fileformat=None, read_kwargs=None):
+    '''
+    按个体ID分区
+
+    分块读取大文件，按个体ID的哈希值将数据分为npartitions个分区写出。同一个体的数据总在同一个分区中，
+    每次只读取chunksize行，内存占用与文件大小无关
+
+    Parameters
+    -------
+    path : str or List
+        输入文件路径，可为单个文件、文件列表或文件夹（读取其中全部csv或parquet文件）
+    outdir : str
+        分区输出的文件夹
+    col : str
+        个体ID列名
+    npartitions : int
+        分区数量，分区越多每个分区的数据量越小
+    chunksize : int
+        每次读取的行数
+    fileformat : str
+        文件格式，'csv'或'parquet'，为None时由文件扩展名判断。parquet格式需要安装pyarrow
+    read_kwargs : dict
+        读取输入的csv文件时传入 `pd.read_csv` 的参数，写出的分区文件总是带有表头
+
+    Returns
+    -------
+    partitions : List
+        各分区的文件路径，没有数据的分区不生成文件
+    '''
+    paths = input_files(path, fileformat)
+    if fileformat is None:
+        fileformat = file_format(paths[0])
+    os.makedirs(outdir, exist_ok=True)
+    partitions = [partition_path(outdir, i, fileformat)
+                  for i in range(npartitions)]
+    for partition in partitions:
+        if os.path.exists(partition):
+            raise Exception(f'Partition {partition} already exists')
+    for n, chunk in enumerate(read_chunks(paths, fileformat, chunksize,
+                                          read_kwargs)):
+        partid = pd.util.hash_pandas_object(
+            id_key(chunk[col]), index=False).values % npartitions
+        for i, part in chunk.groupby(partid):
+            if fileformat == 'parquet':
+                os.makedirs(partitions[i], exist_ok=True)
+                part.to_parquet(os.path.join(
+                    partitions[i], f'{n:06d}.parquet'), index=False)
+            else:
+                part.to_csv(partitions[i], mode='a', index=False,
+                            header=not os.path.exists(partitions[i]))
+    return [i for i in partitions if os.path.exists(i)]
+
+
+def read_partition(partition):
+    '''
+    读取 :func:`transbigdata.partition_by_id` 生成的分区
+
+    分区文件的格式是固定的（csv分区带有表头、以逗号分隔），与输入文件的读取参数无关
+
+    Parameters
+    -------
+    partition : str
+        分区的文件路径
+
+    Returns
+    -------
+    data : DataFrame
+        分区中的数据
+    '''
+    if file_format(partition) == 'parquet':
+        import_pyarrow()
+        return pd.read_parquet(partition)
+    return pd.read_csv(partition)
+
+
+def chunked_apply(path, func, idcol, outdir, npartitions=64,
+                  chunksize=1000000, fileformat=None, read_kwargs=None,
+                  tmpdir=None, **kwargs):
+    '''
+    大文件分区处理
+
+    将超出内存的大文件按个体ID分区（见 :func:`transbigdata.partition_by_id` ），
+    再逐个分区读取并传入func处理，每处理完一个分区即写出结果。同一个体的数据不会被拆分到不同分区，
+    因此按个体计算的方法（如 :func:`transbigdata.clean_traj` 、 :func:`transbigdata.taxigps_to_od` ）
+    分区处理的结果与整体处理一致
+
+    Parameters
+    -------
+    path : str or List
+        输入文件路径，可为单个文件、文件列表或文件夹
+    func : function
+        处理方法，第一个参数为DataFrame，返回DataFrame或多个DataFrame组成的tuple
+    idcol : str
+        个体ID列名
+    outdir : str
+        结果输出的文件夹，每个分区的结果为一个文件，func返回tuple时第i个结果的文件名以_i结尾
+    npartitions : int
+        分区数量，分区越多每个分区的数据量越小
+    chunksize : int
+        分区时每次读取的行数
+    fileformat : str
+        输入与输出的文件格式，'csv'或'parquet'，为None时由文件扩展名判断
+    read_kwargs : dict
+        读取输入的csv文件时传入 `pd.read_csv` 的参数，只用于读取输入文件
+    tmpdir : str
+        存放分区文件的临时文件夹，处理完成后删除。为None时使用系统临时文件夹
+    **kwargs :
+        传入func的其他参数，如col
+
+    Returns
+    -------
+    outputs : List
+        输出的文件路径
+
+    Example
+    -------
+
+    ::
+
+        >>> outputs = tbd.chunked_apply(
+        ...     'TaxiData.csv', tbd.clean_traj, 'VehicleNum', 'cleaned',
+        ...     col=['VehicleNum', 'Time', 'Lng', 'Lat'])
+    '''
+    paths = input_files(path, fileformat)
+    if fileformat is None:
+        fileformat = file_format(paths[0])
+    os.makedirs(outdir, exist_ok=True)
+    partdir = tempfile.mkdtemp(dir=tmpdir)
+    outputs = []
+    try:
+        partitions = partition_by_id(paths, partdir, idcol, npartitions,
+                                     chunksize, fileformat, read_kwargs)
+        for partition in partitions:
+            result = func(read_partition(partition), **kwargs)
+            name = os.path.splitext(os.path.basename(partition))[0]
+            if isinstance(result, tuple):
+                results = {f'{name}_{i}': r for i, r in enumerate(result)}
+            else:
+                results = {name: result}
+            for name, result in results.items():
+                output = os.path.join(outdir, f'{name}.{fileformat}')
+                if fileformat == 'parquet':
+                    result.to_parquet(output, index=False)
+                else:
+                    result.to_csv(output, index=False)
+                outputs.append(output)
+            # Drop the partition once it is processed
+            if os.path.isdir(partition):
+                shutil.rmtree(partition)
+            else:
+                os.remove(partition)
+    finally:
+        shutil.rmtree(partdir, ignore_errors=True)
+    return outputs
+
+
+def parallel_apply(data, func, idcol, n_jobs=-1, nshards=None, **kwargs):
+    '''
+    按个体多进程并行计算
+
+    将数据按个体ID分为数据量均衡的若干份，每个个体的数据只在其中一份中，再用多进程分别传入func计算，
+    最后按顺序合并结果。适用于按个体独立计算的方法，如 :func:`transbigdata.clean_drift` 、
+    :func:`transbigdata.clean_taxi_status` 、 :func:`transbigdata.taxigps_to_od` 、
+    :func:`transbigdata.traj_densify` 、 :func:`transbigdata.mobile_stay_move` 等。
+    数值与时间列通过共享内存传给子进程，不需要序列化复制。
+    注意func生成的编号（如 :func:`transbigdata.clean_traj` 的tripid）在每份数据中单独编号
+
+    Parameters
+    -------
+    data : DataFrame
+        数据
+    func : function
+        计算方法，第一个参数为DataFrame，返回DataFrame或多个DataFrame组成的tuple。
+        需要是可被pickle的函数（如模块中定义的函数，不能是lambda）
+    idcol : str
+        个体ID列名
+    n_jobs : int
+        进程数，为-1时使用全部CPU，为1时不启用多进程
+    nshards : int
+        数据分为多少份，为None时为进程数的4倍
+    **kwargs :
+        传入func的其他参数，如col
+
+    Returns
+    -------
+    result : DataFrame or tuple
+        各份数据计算结果按个体ID的顺序合并。func返回tuple时，每个元素分别合并
+
+    Example
+    -------
+
+    ::
+
+        >>> oddata = tbd.parallel_apply(
+        ...     data, tbd.taxigps_to_od, 'VehicleNum', n_jobs=8,
+        ...     col=['VehicleNum', 'Time', 'Lng', 'Lat', 'OpenStatus'])
+    '''
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if nshards is None:
+        nshards = 4 * n_jobs
+    order, bounds = id_shards(data[idcol], nshards)
+    shards = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    if n_jobs == 1:
+        results = [func(data.take(order[lo:hi]), **kwargs)
+                   for lo, hi in shards]
+        return concat_results(results)
+
+    # Numerical and datetime columns of plain numpy dtypes are passed by
+    # shared memory, the others (including tz-aware datetimes) are pickled
+    # with each shard
+    shared = [col for col in data.columns
+              if isinstance(data[col].dtype, np.dtype) and
+              data[col].dtype.kind in 'biufcmM']
+    shms = dict()
+    try:
+        for col in shared:
+            values = data[col].values
+            shm = shared_memory.SharedMemory(
+                create=True, size=max(values.nbytes, 1))
+            np.take(values, order,
+                    out=np.ndarray(values.shape, values.dtype, buffer=shm.buf))
+            shms[col] = shm
+        arrays = {col: (shms[col].name, data[col].values.shape,
+                        data[col].values.dtype) for col in shared}
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=shared_columns_attach,
+                                 initargs=(arrays,)) as executor:
+            futures = [executor.submit(
+                parallel_apply_shard, func, list(data.columns), lo, hi,
+                {col: data[col].array.take(order[lo:hi])
+                 for col in data.columns if col not in shms},
+                data.index.take(order[lo:hi]), kwargs)
+                for lo, hi in shards]
+            results = [future.result() for future in futures]
+    finally:
+        for shm in shms.values():
+            shm.close()
+            shm.unlink()
+    return concat_results(results)
+
+
+__shared_columns = dict()
+
+
+def id_key(ids):
+    # Canonical string of the ids to hash. A chunk with blank ids reads the
+    # whole id column as float, so whole floats are written as ints to hash
+    # the same as in the chunks read as int
+    key = ids.astype(str)
+    if ids.dtype.kind == 'f':
+        whole = ids.notnull() & (ids % 1 == 0)
+        key[whole] = ids[whole].astype('int64').astype(str)
+    return key
+
+
+def shared_columns_attach(arrays):
+    # Map the shared memory blocks (name, shape, dtype) of the columns
+    # read-only in the worker process
+    __shared_columns.clear()
+    for col, (name, shape, dtype) in arrays.items():
+        shm = shared_memory.SharedMemory(name=name)
+        values = np.ndarray(shape, dtype, buffer=shm.buf)
+        values.flags.writeable = False
+        __shared_columns[col] = (shm, values)
+
+
+def parallel_apply_shard(func, columns, lo, hi, objects, index, kwargs):
+    # Rebuild the rows lo to hi of the shard and apply func
+    data = pd.DataFrame({
+        col: objects[col] if col in objects
+        else __shared_columns[col][1][lo:hi] for col in columns},
+        index=index, copy=True)
+    return func(data, **kwargs)
+
+
+def id_shards(ids, nshards):
+    # Order of the rows grouped into shards of similar sizes, each id in
+    # one shard. The shards follow the order of the ids and the rows keep
+    # their order within a shard. The rows of shard i are
+    # order[bounds[i]:bounds[i+1]]
+    codes, uniques = pd.factorize(ids, sort=True)
+    codes = np.where(codes < 0, len(uniques), codes)
+    counts = np.bincount(codes)
+    start = np.cumsum(counts) - counts
+    shard = np.minimum(start * nshards // max(len(codes), 1),
+                       nshards - 1)[codes]
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(nshards + 1))
+    return order, bounds
+
+
+def concat_results(results):
+    # Concatenate the results of the shards in order
+    if len(results) == 0:
+        return pd.DataFrame()
+    if isinstance(results[0], tuple):
+        return tuple(pd.concat(parts) for parts in zip(*results))
+    return pd.concat(results)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "Please install pyarrow, run "
+            "the following code in cmd: pip install pyarrow")
+    return pq
+
+
+def file_format(path):
+    # File format from the extension, csv unless parquet
+    if path.rstrip('/\\').endswith(('.parquet', '.pq')):
+        return 'parquet'
+    return 'csv'
+
+
+def partition_path(outdir, i, fileformat):
+    # A partition is a csv file or a folder of parquet files
+    return os.path.join(outdir, f'part-{i:05d}.{fileformat}')
+
+
+def input_files(path, fileformat=None):
+    # The files given as a path, a list of paths or a folder
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    if os.path.isdir(path):
+        exts = [fileformat] if fileformat else ['csv', 'parquet', 'pq']
+        paths = sorted(sum([glob.glob(os.path.join(path, f'*.{ext}'))
+                            for ext in exts], []))
+        if not paths:
+            raise Exception(f'No csv or parquet files in {path}')
+        return paths
+    return [path]
+
+
+def read_chunks(paths, fileformat, chunksize, read_kwargs=None):
+    # Read the files chunk by chunk
+    for path in paths:
+        if fileformat == 'parquet':
+            pq = import_pyarrow()
+            for batch in pq.ParquetFile(path).iter_batches(
+                    batch_size=chunksize):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, chunksize=chunksize,
+                                   **(read_kwargs or {}))
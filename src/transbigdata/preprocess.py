@@ -31,21 +31,27 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
 import geopandas as gpd
+import math
 import pandas as pd
+import numpy as np
 from .grids import (
+    GridSystem,
     GPS_to_grid,
     area_to_params,
     grid_to_centre,
-    grid_to_polygon
+    boundary_mask_cached,
+    lookup_attributes
 )
-from .coordinates import getdistance
+from .coordinates import getdistance, coord_float, coord_scale
 
 
-def clean_same(data, col=['VehicleNum', 'Time', 'Lng', 'Lat']):
+def clean_same(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'], tolerance=0):
     '''
     删除信息与前后数据相同的数据以减少数据量  
 
-    如：某个体连续n条数据除了时间以外其他信息都相同，则可以只保留首末两条数据
+    如：某个体连续n条数据除了时间以外其他信息都相同，则可以只保留首末两条数据。
+    可设置坐标的容差，连续数据与其中第一条数据的距离都不超过tolerance米时视为位置相同，
+    以便删除停车时GPS漂移产生的数据
 
     Parameters
     -------
@@ -53,6 +59,8 @@ def clean_same(data, col=['VehicleNum', 'Time', 'Lng', 'Lat']):
         数据
     col : List
         列名，按[个体ID,时间,经度,纬度]的顺序，可以传入更多列。会以时间排序，再判断除了时间以外其他列的信息
+    tolerance : number
+        坐标的容差（米），为0时坐标需完全相同
 
     Returns
     -------
@@ -61,25 +69,25 @@ def clean_same(data, col=['VehicleNum', 'Time', 'Lng', 'Lat']):
     '''
     [VehicleNum, Time, Lng, Lat] = col[:4]
     extra = col[4:]
-    data1 = data.copy()
-    data1 = data1.drop_duplicates(subset=[VehicleNum, Time])
-    data1 = data1.sort_values(by=[VehicleNum, Time])
-    data1['issame'] = 0
-    for i in [VehicleNum, Lng, Lat]+extra:
-        data1['issame'] += (data1[i].shift() == data1[i]
-                            ) & (data1[i].shift(-1) == data1[i])
-    data1 = data1[-(data1['issame'] == len([VehicleNum, Lng, Lat]+extra))]
-    data1 = data1.drop('issame', axis=1)
+    index, ids = sort_records(data[VehicleNum].values, data[Time].values)
+    keep = same_runs_keep(
+        ids, data[Lng].values.take(index), data[Lat].values.take(index),
+        (data[i].values.take(index) for i in extra), tolerance)
+    data1 = data.take(index[keep])
     return data1
 
 def clean_drift(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
-                speedlimit=80, dislimit=1000):
+                speedlimit=80, dislimit=1000, window=1):
     '''
     删除漂移数据
     
     条件是，此数据与前后的速度都大于speedlimit，但前后数据之间的速度却小于speedlimit。
     传入的数据中时间列如果为datetime格式则计算效率更快
 
+    window大于1时，还可删除连续多条的漂移数据：连续不超过window条数据，其首条与前一条数据、
+    末条与后一条数据之间的速度都大于speedlimit，但前后两条数据之间的速度却小于speedlimit，
+    则这几条数据均视为漂移数据（距离限制同理）。计算在排序后的数组上进行，不生成中间列
+
     Parameters
     -------
     data : DataFrame
@@ -90,6 +98,8 @@ def clean_drift(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
         速度限制(km/h)
     dislimit : number
         距离限制(m)
+    window : int
+        最多连续多少条数据视为漂移数据，默认为1，即只删除单条的漂移数据
 
     Returns
     -------
@@ -97,52 +107,14 @@ def clean_drift(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
         清洗后的数据
     '''
     [VehicleNum, Time, Lng, Lat] = col
-    data1 = data.copy()
-    data1 = data1.drop_duplicates(subset=[VehicleNum, Time])
-    data1[Time+'_dt'] = pd.to_datetime(data1[Time])
-    data1 = data1.sort_values(by=[VehicleNum, Time])
-    for i in [VehicleNum, Lng, Lat, Time+'_dt']:
-        data1[i+'_pre'] = data1[i].shift()
-        data1[i+'_next'] = data1[i].shift(-1)
-    data1['dis_pre'] = getdistance(
-        data1[Lng],
-        data1[Lat],
-        data1[Lng+'_pre'],
-        data1[Lat+'_pre'])
-    data1['dis_next'] = getdistance(
-        data1[Lng],
-        data1[Lat],
-        data1[Lng+'_next'],
-        data1[Lat+'_next'])
-    data1['dis_prenext'] = getdistance(
-        data1[Lng+'_pre'],
-        data1[Lat+'_pre'],
-        data1[Lng+'_next'],
-        data1[Lat+'_next'])
-    data1['timegap_pre'] = data1[Time+'_dt'] - data1[Time+'_dt_pre']
-    data1['timegap_next'] = data1[Time+'_dt_next'] - data1[Time+'_dt']
-    data1['timegap_prenext'] = data1[Time+'_dt_next'] - data1[Time+'_dt_pre']
-    data1['speed_pre'] = data1['dis_pre'] / \
-        data1['timegap_pre'].dt.total_seconds()*3.6
-    data1['speed_next'] = data1['dis_next'] / \
-        data1['timegap_next'].dt.total_seconds()*3.6
-    data1['speed_prenext'] = data1['dis_prenext'] / \
-        data1['timegap_prenext'].dt.total_seconds()*3.6
-    if speedlimit:
-        data1 = data1[
-            -((data1[VehicleNum+'_pre'] == data1[VehicleNum]) &
-              (data1[VehicleNum+'_next'] == data1[VehicleNum]) &
-                (data1['speed_pre'] > speedlimit) &
-              (data1['speed_next'] > speedlimit) &
-              (data1['speed_prenext'] < speedlimit))]
-    if dislimit:
-        data1 = data1[
-            -((data1[VehicleNum+'_pre'] == data1[VehicleNum]) &
-              (data1[VehicleNum+'_next'] == data1[VehicleNum]) &
-              (data1['dis_pre'] > dislimit) &
-              (data1['dis_next'] > dislimit) &
-              (data1['dis_prenext'] < dislimit))]
-    data1 = data1[data.columns]
+    index, ids = sort_records(data[VehicleNum].values, data[Time].values)
+    drift = drift_mask(
+        ids,
+        to_datetime(data[Time].values.take(index)).values,
+        coord_float(data[Lng].values.take(index)),
+        coord_float(data[Lat].values.take(index)),
+        speedlimit, dislimit, window)
+    data1 = data.take(index[~drift])
     return data1
 
 
@@ -173,16 +145,21 @@ of [lon1,lat1,lon2,lat2]. (lon1,lat1) is the lower left corner and \
 (lon2,lat2) is the upper right corner.')
     Lng, Lat = col
     data1 = data.copy()
-    data1 = data1[(data1[Lng] > bounds[0]) & (data1[Lng] < bounds[2]) & (
-        data1[Lat] > bounds[1]) & (data1[Lat] < bounds[3])]
+    lon = coord_float(data1[Lng])
+    lat = coord_float(data1[Lat])
+    data1 = data1[(lon > bounds[0]) & (lon < bounds[2]) & (
+        lat > bounds[1]) & (lat < bounds[3])]
     return data1
 
 
-def clean_outofshape(data, shape, col=['Lng', 'Lat'], accuracy=500):
+def clean_outofshape(data, shape, col=['Lng', 'Lat'], accuracy=500,
+                     mask=None, exact=True):
     '''
     剔除超出研究区域的数据
 
-    输入研究范围的GeoDataFrame，剔除超出研究区域的数据，计算原理是先栅格化后剔除
+    输入研究范围的GeoDataFrame，剔除超出研究区域的数据。计算原理是先栅格化，
+    完全在研究范围内或范围外的栅格中的数据直接查表保留或剔除，与研究范围边界相交的栅格中的数据再逐点精确判断。
+    同一研究范围与accuracy生成的栅格掩膜会被缓存，重复调用时无需重新栅格化
 
     Parameters
     -------
@@ -193,7 +170,12 @@ def clean_outofshape(data, shape, col=['Lng', 'Lat'], accuracy=500):
     col : List
         经纬度列名
     accuracy : number
-        定义栅格大小，越小精度越高
+        定义栅格大小，exact为True时只影响计算速度，不影响结果
+    mask : GridBoundaryMask
+        由研究范围生成的栅格掩膜（见 :class:`transbigdata.GridBoundaryMask` ），
+        传入时shape与accuracy不再使用
+    exact : bool
+        为False时不做逐点判断，与研究范围边界相交的栅格中的数据全部保留（即旧版的结果），此时accuracy影响结果
 
     Returns
     -------
@@ -201,20 +183,10 @@ def clean_outofshape(data, shape, col=['Lng', 'Lat'], accuracy=500):
         研究范围内的数据
     '''
     Lng, Lat = col
-    shape_unary = shape.unary_union
-    bounds = shape_unary.bounds
-    params = area_to_params(bounds, accuracy)
-    data1 = data.copy()
-    data1['LONCOL'], data1['LATCOL'] = GPS_to_grid(
-        data1[Lng], data1[Lat], params)
-    data1_gdf = data1[['LONCOL', 'LATCOL']].drop_duplicates()
-    data1_gdf['geometry'] = grid_to_polygon(
-        [data1_gdf['LONCOL'], data1_gdf['LATCOL']], params)
-    data1_gdf = gpd.GeoDataFrame(data1_gdf)
-    data1_gdf = data1_gdf[data1_gdf.intersects(shape_unary)]
-    data1 = pd.merge(data1, data1_gdf[['LONCOL', 'LATCOL']]).drop(
-        ['LONCOL', 'LATCOL'], axis=1)
-    return data1
+    if mask is None:
+        mask = boundary_mask_cached(shape, accuracy)
+    data1 = data[mask.contains(data[Lng], data[Lat], exact=exact)]
+    return data1.reset_index(drop=True)
 
 
 def clean_traj(data, col=['uid', 'str_time', 'lon', 'lat'], tripgap=1800,
@@ -224,6 +196,11 @@ def clean_traj(data, col=['uid', 'str_time', 'lon', 'lat'], tripgap=1800,
     
     包括定义时间长度阈值以及距离阈值，超出阈值视为新的轨迹
 
+    依次进行以下清洗：删除与前后数据相同的数据（同 :func:`transbigdata.clean_same` ）、
+    删除漂移数据（同 :func:`transbigdata.clean_drift` ）、按时间与距离阈值划分出行、
+    删除移动距离小于50米的出行后再重新划分出行。数据只排序一次，各步骤在排序后的数组上依次计算，
+    最后一次性取出保留的数据，不修改传入的数据
+
     Parameters
     -------
     data : DataFrame
@@ -240,40 +217,333 @@ def clean_traj(data, col=['uid', 'str_time', 'lon', 'lat'], tripgap=1800,
     Returns
     -------
     data1 : DataFrame
-        清洗后的数据
+        清洗后的数据，tripid列为出行编号
     '''
     uid, timecol, lon, lat = col
-    data[timecol] = pd.to_datetime(data[timecol])
-    data = data.sort_values(by=[uid, timecol])
-    cols = []
-    for i in data.columns:
-        if i not in [uid, timecol, lon, lat]:
-            cols.append(i)
-    data = clean_same(data, col=[uid, timecol, lon, lat]+cols)
-    data = clean_drift(data, col=[uid, timecol, lon, lat],
-                       speedlimit=speedlimit)
-    data = id_reindex(data, uid, timecol=timecol, timegap=tripgap)
-    data = data.rename(columns={uid+'_new': 'tripid'})
-    data = id_reindex_disgap(
-        data, col=['tripid', lon, lat], disgap=disgap, suffix='')
-    data1 = data.copy()
-    data1['lon1'] = data1[lon].shift(-1)
-    data1['lat1'] = data1[lat].shift(-1)
-    data1['tripid1'] = data1['tripid'].shift(-1)
-    data1 = data1[data1['tripid'] == data1['tripid1']]
-    data1['dis'] = getdistance(
-        data1[lon], data1[lat], data1['lon1'], data1['lat1'])
-    a = data1.groupby(['tripid'])['dis'].sum()
-    a = a[-(a < 50)].reset_index()['tripid']
-    data = pd.merge(data, a)
-    data = data.drop('tripid', axis=1)
-    data = id_reindex(data, uid, timecol=timecol, timegap=tripgap)
-    data = data.rename(columns={uid+'_new': 'tripid'})
-    data = id_reindex_disgap(
-        data, col=['tripid', lon, lat], disgap=disgap, suffix='')
-    return data
-
-def dataagg(data, shape, col=['Lng', 'Lat', 'count'], accuracy=500):
+    timeseries = to_datetime(data[timecol])
+    # Sort once by id and time, duplicated records are dropped
+    index, ids = sort_records(data[uid].values, timeseries.values)
+    times = timeseries.values.take(index)
+    lons = coord_float(data[lon].values.take(index))
+    lats = coord_float(data[lat].values.take(index))
+
+    # Records same as both the previous and the next one except the time
+    keep = same_runs_keep(ids, lons, lats, (
+        data[i].values.take(index) for i in data.columns
+        if i not in [uid, timecol, lon, lat]))
+    index, ids, times, lons, lats = [
+        i[keep] for i in [index, ids, times, lons, lats]]
+
+    # Drift records, with the dislimit of clean_drift
+    keep = ~drift_mask(ids, times, lons, lats, speedlimit, 1000)
+    index, ids, times, lons, lats = [
+        i[keep] for i in [index, ids, times, lons, lats]]
+
+    # Split the trips and drop those moving less than 50m
+    tripid, keep = trip_split(ids, times, lons, lats, tripgap, disgap)
+    index, ids, times, lons, lats, tripid = [
+        i[keep] for i in [index, ids, times, lons, lats, tripid]]
+    pair = np.flatnonzero(tripid[1:] == tripid[:-1])
+    dis = getdistance(lons[pair], lats[pair], lons[pair+1], lats[pair+1])
+    tripdis = np.bincount(tripid[pair], weights=np.nan_to_num(dis),
+                          minlength=len(tripid))
+    keep = ~(tripdis[tripid] < 50)
+    index, ids, times, lons, lats = [
+        i[keep] for i in [index, ids, times, lons, lats]]
+
+    # Split the trips again on the remaining records
+    tripid, keep = trip_split(ids, times, lons, lats, tripgap, disgap)
+    index = index[keep]
+    data1 = data.take(index).reset_index(drop=True)
+    if not is_epoch_seconds(data[timecol]):
+        data1[timecol] = timeseries.take(index).reset_index(drop=True)
+    data1['tripid'] = tripid[keep]
+    return data1
+
+
+class StreamCleaner:
+    '''
+    GPS数据流实时清洗
+
+    以小批量的形式逐次传入实时GPS数据，依次删除与前后数据相同的数据（同 :func:`transbigdata.clean_same` ）
+    与漂移数据（同 :func:`transbigdata.clean_drift` ）。每个个体只缓存最近的几条数据，
+    一条数据在其后收到两条不同的数据后即可输出。全部数据传入并调用flush后，
+    输出的数据与对全部数据依次使用clean_same与clean_drift的结果相同。
+
+    同一个体的数据应按时间顺序传入，时间早于或等于该个体已收到数据的数据会被丢弃
+
+    Parameters
+    -------
+    col : List
+        列名，按[个体ID,时间,经度,纬度]的顺序，可以传入更多列，与clean_same相同
+    speedlimit : number
+        速度限制(km/h)
+    dislimit : number
+        距离限制(m)
+
+    Example
+    -------
+
+    ::
+
+        >>> cleaner = tbd.StreamCleaner(col=['VehicleNum', 'Time', 'Lng', 'Lat'])
+        >>> for batch in stream:
+        ...     cleaned = cleaner.push(batch)
+        >>> cleaned = cleaner.flush()
+    '''
+
+    def __init__(self, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
+                 speedlimit=80, dislimit=1000):
+        self.col = list(col)
+        self.speedlimit = speedlimit
+        self.dislimit = dislimit
+        # The last two records of each vehicle before and after clean_same,
+        # the last one is not decided yet
+        self.tail_same = None
+        self.tail_drift = None
+
+    def push(self, data):
+        '''
+        传入一批数据
+
+        Parameters
+        -------
+        data : DataFrame
+            新收到的数据
+
+        Returns
+        -------
+        data1 : DataFrame
+            可以确定的清洗后的数据，按个体ID与时间排序
+        '''
+        VehicleNum, Time = self.col[:2]
+        if self.tail_same is not None:
+            # Drop the records not later than the received ones
+            lasttime = self.tail_same[0].drop_duplicates(
+                subset=VehicleNum, keep='last').set_index(VehicleNum)[Time]
+            lasttime = data[VehicleNum].map(lasttime)
+            data = data[lasttime.isna() | (data[Time] > lasttime)]
+        data1, self.tail_same = self.stage(
+            self.tail_same, data, self.same_keep)
+        data1, self.tail_drift = self.stage(
+            self.tail_drift, data1, self.drift_keep)
+        return data1
+
+    def flush(self):
+        '''
+        输出缓存中剩余的数据，并清空缓存
+
+        Returns
+        -------
+        data1 : DataFrame
+            清洗后的数据
+        '''
+        data1 = pd.DataFrame(columns=self.col)
+        if self.tail_same is not None:
+            # The last records are kept by clean_same and are not drift
+            tail, decided = self.tail_same
+            data1, (tail, decided) = self.stage(
+                self.tail_drift, tail[~decided], self.drift_keep)
+            data1 = pd.concat([data1, tail[~decided]])
+            index, _ = sort_records(data1[self.col[0]].values,
+                                    data1[self.col[1]].values)
+            data1 = data1.take(index)
+        self.tail_same = None
+        self.tail_drift = None
+        return data1
+
+    def stage(self, tail, data, keep_func):
+        # Append the data to the tail and decide the records followed by
+        # a record of the same vehicle. Returns the kept records newly
+        # decided and the new tail
+        VehicleNum, Time = self.col[:2]
+        if tail is None:
+            frame = data
+            decided = np.zeros(len(data), dtype=bool)
+        else:
+            frame = pd.concat([tail[0], data])
+            decided = np.append(tail[1], np.zeros(len(data), dtype=bool))
+        if len(frame) == 0:
+            return frame, tail
+        index, ids = sort_records(frame[VehicleNum].values,
+                                  frame[Time].values)
+        frame = frame.take(index)
+        decided = decided[index]
+        last = np.append(ids[1:] != ids[:-1], True)
+        final = ~decided & ~last & keep_func(frame, ids)
+        # The last two records of each vehicle
+        second = np.append(last[1:], False) & ~last
+        tailrows = last | second
+        return frame[final], (frame[tailrows], second[tailrows])
+
+    def same_keep(self, frame, ids):
+        return same_runs_keep(ids, frame[self.col[2]].values,
+                              frame[self.col[3]].values,
+                              (frame[i].values for i in self.col[4:]))
+
+    def drift_keep(self, frame, ids):
+        return ~drift_mask(
+            ids, to_datetime(frame[self.col[1]].values).values,
+            coord_float(frame[self.col[2]].values),
+            coord_float(frame[self.col[3]].values),
+            self.speedlimit, self.dislimit)
+
+
+def shift_equal(values):
+    # Whether each element equals the previous one, False for the first.
+    # Missing values are never equal, as in comparing shifted Series
+    equal = np.zeros(len(values), dtype=bool)
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biufcmM':
+        equal[1:] = values[1:] == values[:-1]
+    elif len(values) > 1:
+        equal[1:] = (pd.Series(values[1:]) == pd.Series(values[:-1])
+                     ).to_numpy(dtype=bool, na_value=False)
+    return equal
+
+
+def is_epoch_seconds(values):
+    # Integer times are epoch seconds as given by normalize_dtypes
+    return pd.api.types.is_integer_dtype(getattr(values, 'dtype', None))
+
+
+def to_datetime(values):
+    # Times as datetime, datetime Series are returned without parsing again
+    if isinstance(values, pd.Series) and \
+            pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+    if is_epoch_seconds(values):
+        return pd.to_datetime(values, unit='s')
+    return pd.to_datetime(values)
+
+
+def sort_records(ids, times):
+    # Positions of the records sorted by id and time with the duplicated
+    # (id, time) records dropped, and the factorized ids in this order
+    keys = pd.DataFrame({'uid': ids, 'time': times})
+    keys = keys.sort_values(by=['uid', 'time'])
+    keys = keys[~keys.duplicated()]
+    return keys.index.values, pd.factorize(keys['uid'])[0]
+
+
+def same_runs_keep(ids, lons, lats, extras=(), tolerance=0):
+    # The first and the last record of each run of same records in sorted
+    # trajectories. Within tolerance metres of the first record of the run
+    # the coordinates are the same
+    start = ~shift_equal(ids) | (ids < 0)
+    for values in extras:
+        start |= ~shift_equal(values)
+    if not tolerance:
+        start |= ~shift_equal(lons) | ~shift_equal(lats)
+        return start | np.append(start[1:], True)
+    lons = coord_float(np.asarray(lons))
+    lats = coord_float(np.asarray(lats))
+    # A record more than twice the tolerance from the previous one is also
+    # beyond the tolerance from the first record of the run
+    if len(ids) > 1:
+        start[1:] |= ~(getdistance(lons[1:], lats[1:], lons[:-1],
+                                   lats[:-1]) <= 2 * tolerance)
+    # Split the runs where the distance to the first record of the run
+    # exceeds the tolerance, one split per run in each round
+    anchor = np.maximum.accumulate(
+        np.where(start, np.arange(len(start)), 0))
+    rows = np.flatnonzero(~start)
+    for _ in range(20):
+        if len(rows) == 0:
+            break
+        far = ~(getdistance(lons[rows], lats[rows], lons[anchor[rows]],
+                            lats[anchor[rows]]) <= tolerance)
+        split = rows[far]
+        split = split[np.append(True, anchor[split][1:] !=
+                                anchor[split][:-1])[:len(split)]]
+        start[split] = True
+        # Rows after a split of their run are checked again
+        pos = np.minimum(np.searchsorted(anchor[split], anchor[rows]),
+                         max(len(split) - 1, 0))
+        again = np.zeros(len(rows), dtype=bool)
+        if len(split):
+            again = (anchor[split][pos] == anchor[rows]) & \
+                (rows > split[pos])
+        anchor[rows[again]] = split[pos[again]]
+        rows = rows[again]
+    # Runs still being split, such as slow moves, are finished one by one
+    # with the haversine distance of getdistance
+    lonrad = np.radians(lons[rows]).tolist()
+    latrad = np.radians(lats[rows]).tolist()
+    anchors = anchor[rows].tolist()
+    last = -1
+    for i, row in enumerate(rows.tolist()):
+        if anchors[i] != last:
+            last = anchors[i]
+            lon0, lat0 = math.radians(lons[last]), math.radians(lats[last])
+        a = math.sin((latrad[i] - lat0) / 2)**2 + math.cos(lat0) * \
+            math.cos(latrad[i]) * math.sin((lonrad[i] - lon0) / 2)**2
+        if not 2 * math.asin(a**0.5) * 6371000 <= tolerance:
+            start[row] = True
+            lon0, lat0 = lonrad[i], latrad[i]
+    return start | np.append(start[1:], True)
+
+
+def timegap_seconds(times, step=1):
+    # Seconds from the record step positions before, NaN if unknown
+    times = times.astype('datetime64[ns]')
+    gap = np.full(len(times), np.nan)
+    if len(times) > step:
+        delta = times[step:] - times[:-step]
+        gap[step:] = np.where(np.isnat(delta), np.nan,
+                              delta.view(np.int64) / 1e9)
+    return gap
+
+
+def drift_mask(ids, times, lons, lats, speedlimit, dislimit, window=1):
+    # Drift records of sorted trajectories: bursts of up to window records
+    # far from or fast to the records of the same id on both sides, which
+    # are close to each other. With window 1 this is the rule of clean_drift
+    n = len(ids)
+    drift = np.zeros(n, dtype=bool)
+    # Distance, time gap and speed from the previous record
+    step = np.full(n, np.nan)
+    if n > 1:
+        step[1:] = getdistance(lons[1:], lats[1:], lons[:-1], lats[:-1])
+    if speedlimit:
+        stepspeed = step / timegap_seconds(times)*3.6
+    for m in range(1, min(window, n - 2) + 1):
+        # Records i to i+m-1 between the records i-1 and i+m
+        a = slice(0, n-m-1)
+        b = slice(m+1, n)
+        first = slice(1, n-m)
+        dis_ab = getdistance(lons[a], lats[a], lons[b], lats[b])
+        burst = np.zeros(n-m-1, dtype=bool)
+        if speedlimit:
+            speed_ab = dis_ab / timegap_seconds(times, m+1)[m+1:]*3.6
+            burst |= (stepspeed[first] > speedlimit) & \
+                (stepspeed[b] > speedlimit) & (speed_ab < speedlimit)
+        if dislimit:
+            burst |= (step[first] > dislimit) & (step[b] > dislimit) & \
+                (dis_ab < dislimit)
+        # The records are sorted by id, so the ids between are the same
+        burst &= (ids[a] == ids[b]) & (ids[a] >= 0)
+        start = np.flatnonzero(burst) + 1
+        for j in range(m):
+            drift[start + j] = True
+    return drift
+
+
+def trip_split(ids, times, lons, lats, tripgap, disgap):
+    # Trip ids of sorted trajectories as id_reindex with timegap followed
+    # by id_reindex_disgap, the second output marks the records not in
+    # single record trips
+    new = ~shift_equal(ids) | (ids < 0)
+    new |= timegap_seconds(times) > tripgap
+    dis = np.full(len(ids), np.nan)
+    if len(ids) > 1:
+        dis[1:] = getdistance(lons[1:], lats[1:], lons[:-1], lats[:-1])
+    new |= dis > disgap
+    tripid = np.cumsum(new) - 1
+    return tripid, np.bincount(tripid)[tripid] > 1
+
+
+def dataagg(data, shape, col=['Lng', 'Lat', 'count'], accuracy=500,
+            lookup=None):
     '''
     数据集计至小区
 
@@ -287,6 +557,9 @@ def dataagg(data, shape, col=['Lng', 'Lat', 'count'], accuracy=500):
         可传入经纬度两列，如['Lng','Lat']，此时每一列权重为1。也可以传入经纬度和计数列三列，如['Lng','Lat','count']
     accuracy : number
         计算原理是先栅格化后集计，这里定义栅格大小，越小精度越高
+    lookup : GridZoneLookup
+        由shape生成的栅格-小区对应表（见 :class:`transbigdata.GridZoneLookup` ），
+        传入时栅格参数取自lookup（accuracy无效），直接查表对应小区，不再做空间连接
 
     Returns
     -------
@@ -301,6 +574,29 @@ def dataagg(data, shape, col=['Lng', 'Lat', 'count'], accuracy=500):
     else:
         Lng, Lat, aggcol = col
     shape['index'] = range(len(shape))
+    if lookup is not None:
+        data1 = data.reset_index(drop=True)
+        grid = GridSystem(lookup.params)
+        gridid = grid.to_grid(data1[Lng], data1[Lat])
+        zone = lookup.to_zone(gridid)
+        data1['geometry'] = gpd.points_from_xy(*grid.to_centre(gridid))
+        data1 = pd.concat([data1, lookup_attributes(shape, zone)], axis=1)
+    else:
+        data1 = dataagg_sjoin(data, shape, Lng, Lat, accuracy)
+    if aggcol:
+        aggresult = pd.merge(shape, data1.groupby('index')[
+                             aggcol].sum().reset_index()).drop('index', axis=1)
+    else:
+        data1['_'] = 1
+        aggresult = pd.merge(shape, data1.groupby('index')['_'].sum().rename(
+            'count').reset_index()).drop('index', axis=1)
+        data1 = data1.drop('_', axis=1)
+    data1 = data1.drop('index', axis=1)
+    return aggresult, data1
+
+
+def dataagg_sjoin(data, shape, Lng, Lat, accuracy):
+    # Match the points to the zones by a spatial join of the grid centres
     shape_unary = shape.unary_union
     bounds = shape_unary.bounds
     params = area_to_params(bounds, accuracy)
@@ -312,17 +608,7 @@ def dataagg(data, shape, col=['Lng', 'Lat', 'count'], accuracy=500):
         *grid_to_centre([data1_gdf['LONCOL'], data1_gdf['LATCOL']], params))
     data1_gdf = gpd.GeoDataFrame(data1_gdf)
     data1_gdf = gpd.sjoin(data1_gdf, shape, how='left')
-    data1 = pd.merge(data1, data1_gdf).drop(['LONCOL', 'LATCOL'], axis=1)
-    if aggcol:
-        aggresult = pd.merge(shape, data1.groupby('index')[
-                             aggcol].sum().reset_index()).drop('index', axis=1)
-    else:
-        data1['_'] = 1
-        aggresult = pd.merge(shape, data1.groupby('index')['_'].sum().rename(
-            'count').reset_index()).drop('index', axis=1)
-        data1 = data1.drop('_', axis=1)
-    data1 = data1.drop('index', axis=1)
-    return aggresult, data1
+    return pd.merge(data1, data1_gdf).drop(['LONCOL', 'LATCOL'], axis=1)
 
 
 def id_reindex_disgap(data, col=['uid', 'lon', 'lat'], disgap=1000,
@@ -350,22 +636,27 @@ def id_reindex_disgap(data, col=['uid', 'lon', 'lat'], disgap=1000,
     '''
     uid, lon, lat = col
     data1 = data.copy()
-    data1[uid+suffix] = (
-        (data1[uid].shift() != data1[uid]) |
-        (getdistance(data1[lon],
-                     data1[lat],
-                     data1[lon].shift(),
-                     data1[lat].shift()) > disgap)).astype(int).cumsum()-1
-    a = data1.groupby([uid+suffix])[lon].count()
-    data1 = pd.merge(data1, a[a > 1].reset_index()[[uid+suffix]])
+    lons = coord_float(data1[lon].values)
+    lats = coord_float(data1[lat].values)
+    new = ~shift_equal(data1[uid].values)
+    if len(data1) > 1:
+        new[1:] |= getdistance(lons[1:], lats[1:],
+                               lons[:-1], lats[:-1]) > disgap
+    newid = np.cumsum(new) - 1
+    data1[uid+suffix] = newid
+    # Drop the ids with only one record
+    count = np.bincount(newid, weights=~np.isnan(lons))
+    data1 = data1[count[newid] > 1].reset_index(drop=True)
     return data1
 
 
 def id_reindex(data, col, new=False, timegap=None, timecol=None,
-               suffix='_new', sample=None):
+               suffix='_new', sample=None, categorical=False):
     '''
     对数据的ID列重新编号
 
+    编号由 `pd.factorize` 生成，不需要表连接，数据保持原有的顺序（设定timegap时按新编号与时间排序）
+
     Parameters
     -------
     data : DataFrame
@@ -382,6 +673,8 @@ def id_reindex(data, col, new=False, timegap=None, timecol=None,
         新编号列名的后缀，设置为False时替代原有列名
     sample : int
         传入数值，对重新编号的个体进行抽样
+    categorical : bool
+        为True时新编号列为category类型，以节省内存
 
     Returns
     -------
@@ -390,26 +683,117 @@ def id_reindex(data, col, new=False, timegap=None, timecol=None,
     '''
     if not suffix:
         suffix = ''
-    data1 = data.copy()
     if new:
-        data1[col+suffix] = data1[col] != data1[col].shift()
-        data1[col+suffix] = data1[col+suffix].cumsum()-1
+        data1 = data.copy()
+        newid = np.cumsum(~shift_equal(data1[col].values)) - 1
     else:
-        tmp = data1[[col]].drop_duplicates()
-        tmp[col+'_'] = range(len(tmp))
-        data1 = pd.merge(data1, tmp, on=col)
-        data1[col+suffix] = data1[col+'_']
-        if suffix != '_':
-            data1 = data1.drop(col+'_', axis=1)
+        # Numbered in the order of the first appearance
+        data1 = data.reset_index(drop=True)
+        newid = pd.factorize(data1[col], use_na_sentinel=False)[0]
     if (timegap is not None) & (timecol is not None):
-        data1[timecol] = pd.to_datetime(data1[timecol])
-        data1 = data1.sort_values(by=[col+suffix, timecol])
-        data1[col+suffix] = (
-            (data1[col+suffix].shift() != data1[col+suffix]) |
-            ((data1[timecol]-data1[timecol].shift()).dt.total_seconds()
-             > timegap)).astype(int).cumsum()-1
+        times = to_datetime(data1[timecol])
+        if not is_epoch_seconds(data1[timecol]):
+            data1[timecol] = times
+        order = pd.DataFrame({'id': newid, 'time': times.values}
+                             ).sort_values(by=['id', 'time']).index.values
+        data1 = data1.take(order)
+        newid = newid[order]
+        newid = np.cumsum(~shift_equal(newid) | (
+            timegap_seconds(times.values.take(order)) > timegap)) - 1
 
     if sample:
-        tmp = data1[col+suffix].drop_duplicates().sample(sample)
-        data1 = pd.merge(data1, tmp)
+        tmp = pd.Series(newid).drop_duplicates().sample(sample)
+        keep = np.isin(newid, tmp.values)
+        data1 = data1[keep].reset_index(drop=True)
+        newid = newid[keep]
+    if categorical:
+        newid = pd.Categorical.from_codes(
+            newid, categories=pd.RangeIndex(newid.max() + 1 if len(newid)
+                                            else 0))
+    data1[col+suffix] = newid
+    return data1
+
+
+def normalize_dtypes(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
+                     idtype='category', coordtype='float32'):
+    '''
+    压缩数据类型
+
+    数据读入后将各列转换为占用内存较少的类型：个体ID转换为分类类型或int32编号，
+    时间转换为int64的Unix时间戳（秒），经纬度转换为float32或以10^-6度为单位的int32。
+    已经转换过的列不会重复转换。TransBigData的数据清洗、轨迹处理等方法能够识别转换后的列，
+    整数的时间列视为Unix时间戳（秒），不再重复解析；int32的经纬度列会换算回度后再计算
+
+    注意这一规则对所有整数的时间列生效，而 `pd.to_datetime` 将整数视为纳秒。
+    以毫秒、纳秒等其他单位存储的整数时间需要先用 `pd.to_datetime(..., unit=...)` 转换。
+    涉及的方法包括 :func:`transbigdata.clean_drift` 、 :func:`transbigdata.clean_traj` 、
+    :class:`transbigdata.StreamCleaner` 、 :func:`transbigdata.id_reindex` 、
+    :func:`transbigdata.traj_densify` 、 :func:`transbigdata.traj_sparsify` 、
+    :func:`transbigdata.points_to_traj` 、 :func:`transbigdata.clean_taxi_status` 、
+    :func:`transbigdata.sample_duration` 、 :func:`transbigdata.mobile_stay_move` 、
+    :func:`transbigdata.mobile_stay_point` 、 :func:`transbigdata.mobile_stay_dutation` 、
+    :func:`transbigdata.mobile_identify_home` 、 :func:`transbigdata.mobile_identify_work`
+    与 :func:`transbigdata.visualization_trip`
+
+    Parameters
+    -------
+    data : DataFrame
+        数据
+    col : List
+        列名，按[个体ID,时间,经度,纬度]的顺序
+    idtype : str
+        个体ID的类型，'category'为分类类型，保留原有的ID；'int32'为int32编号，
+        原ID为int32范围内的整数时保留原值，否则按首次出现的顺序编号；None则不转换
+    coordtype : str
+        经纬度的类型，'float32'精度约为1米，'int32'精度约为0.1米，None则不转换
+
+    Returns
+    -------
+    data1 : DataFrame
+        转换后的数据，未转换的列与传入的数据共用内存
+
+    Example
+    -------
+
+    ::
+
+        >>> data = tbd.normalize_dtypes(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'])
+        >>> data = tbd.clean_drift(data, col=['VehicleNum', 'Time', 'Lng', 'Lat'])
+    '''
+    VehicleNum, Time, Lng, Lat = col
+    data1 = data.copy(deep=False)
+    ids = data1[VehicleNum]
+    if idtype == 'category':
+        if not isinstance(ids.dtype, pd.CategoricalDtype):
+            data1[VehicleNum] = ids.astype('category')
+    elif idtype == 'int32':
+        if ids.dtype != np.int32:
+            if pd.api.types.is_integer_dtype(ids.dtype) and (len(ids) == 0 or (
+                    ids.min() >= np.iinfo(np.int32).min) & (
+                    ids.max() <= np.iinfo(np.int32).max)):
+                data1[VehicleNum] = ids.values.astype(np.int32)
+            else:
+                data1[VehicleNum] = pd.factorize(
+                    ids, use_na_sentinel=False)[0].astype(np.int32)
+    elif idtype is not None:
+        raise ValueError("idtype should be 'category', 'int32' or None")
+    if not is_epoch_seconds(data1[Time]):
+        times = to_datetime(data1[Time])
+        if times.dt.tz is not None:
+            times = times.dt.tz_convert(None)
+        data1[Time] = times.values.view(np.int64) // 1000000000
+    for i in [Lng, Lat]:
+        values = data1[i].values
+        if coordtype == 'float32':
+            if values.dtype != np.float32:
+                data1[i] = coord_float(values).astype(np.float32)
+        elif coordtype == 'int32':
+            if values.dtype != np.int32:
+                values = np.round(coord_float(values) * coord_scale)
+                if np.isnan(values).any():
+                    raise ValueError(
+                        'Missing coordinates cannot be stored as int32')
+                data1[i] = values.astype(np.int32)
+        elif coordtype is not None:
+            raise ValueError("coordtype should be 'float32', 'int32' or None")
     return data1
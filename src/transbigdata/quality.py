@@ -30,7 +30,7 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import pandas as pd
+from .preprocess import to_datetime
 
 
 def sample_duration(data, col=['Vehicleid', 'Time']):
@@ -51,7 +51,7 @@ def sample_duration(data, col=['Vehicleid', 'Time']):
     '''
     [Vehicleid, Time] = col
     data1 = data.copy()
-    data1[Time] = pd.to_datetime(data1[Time])
+    data1[Time] = to_datetime(data1[Time])
     data1 = data1.sort_values(by=[Vehicleid, Time])
     data1[Vehicleid+'1'] = data1[Vehicleid].shift(-1)
     data1[Time+'1'] = data1[Time].shift(-1)
@@ -31,6 +31,8 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
 import pandas as pd
+from .preprocess import to_datetime
+from .coordinates import coord_float
 
 
 def clean_taxi_status(data, col=['VehicleNum', 'Time', 'OpenStatus'],
@@ -57,7 +59,7 @@ def clean_taxi_status(data, col=['VehicleNum', 'Time', 'OpenStatus'],
     data1 = data.copy()
     [VehicleNum, Time, OpenStatus] = col
     if timelimit:
-        data1[Time] = pd.to_datetime(data1[Time])
+        data1[Time] = to_datetime(data1[Time])
         data1 = data1[
             -((data1[OpenStatus].shift(-1) == data1[OpenStatus].shift()) &
               (data1[OpenStatus] != data1[OpenStatus].shift()) &
@@ -93,7 +95,7 @@ def taxigps_to_od(data,
     Returns
     -------
     oddata : DataFrame
-        OD数据
+        OD数据，int32格式的经纬度（见 :func:`transbigdata.normalize_dtypes` ）转换回以度为单位
     '''
     [VehicleNum, Stime, Lng, Lat, OpenStatus] = col
     data1 = data[col]
@@ -104,6 +106,8 @@ def taxigps_to_od(data,
                    (data1[VehicleNum].shift() == data1[VehicleNum])]
     oddata = oddata.drop([OpenStatus], axis=1)
     oddata.columns = [VehicleNum, 'stime', 'slon', 'slat', 'StatusChange']
+    oddata['slon'] = coord_float(oddata['slon'].values)
+    oddata['slat'] = coord_float(oddata['slat'].values)
     oddata['etime'] = oddata['stime'].shift(-1)
     oddata['elon'] = oddata['slon'].shift(-1)
     oddata['elat'] = oddata['slat'].shift(-1)
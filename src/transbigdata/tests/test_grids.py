@@ -1,3 +1,4 @@
+import pytest
 import transbigdata as tbd
 import numpy as np
 import pandas as pd
@@ -87,6 +88,21 @@ class TestGrids:
                             113.602246, 113.604492,
                             113.602246, 113.597754, 113.595509])
 
+    def test_geohash_output(self):
+        lon = pd.Series([113.59550842, 113.60224579, -0.5, 179.9])
+        lat = pd.Series([22.4, 22.39640364, -45.2, 89.9])
+        c = tbd.geohash_encode(lon, lat, precision=8)
+        codes = tbd.geohash_encode(lon, lat, precision=8, output='int')
+        assert codes.dtype == np.uint64
+        b = tbd.geohash_encode(lon, lat, precision=8, output='bytes')
+        assert list(b.astype(str)) == list(c)
+        for geohash, precision in [(c, None), (b, None), (codes, 8)]:
+            result = tbd.geohash_decode(geohash, precision)
+            assert np.allclose(result[0], tbd.geohash_decode(c)[0])
+            assert np.allclose(result[1], tbd.geohash_decode(c)[1])
+        grid = tbd.geohash_togrid(codes, precision=8)
+        assert grid.iloc[0].equals(tbd.geohash_togrid(c).iloc[0])
+
     def test_regenerate_params(self):
         grid, params = tbd.rect_grids(self.bounds, 500)
         result = tbd.regenerate_params(grid)
@@ -155,6 +171,272 @@ class TestGrids:
         truth = [[119.96516214],[31.29752543]]
         assert np.allclose(result,truth)
 
+    def test_area_to_grid_cover(self):
+        bounds = [113.6, 22.4, 113.75, 22.5]
+        shape = gpd.GeoDataFrame(geometry=[
+            Polygon([(113.62, 22.41), (113.7, 22.42), (113.66, 22.49)])],
+            crs='epsg:4326')
+        for method in ['rect', 'tri', 'hexa']:
+            params = tbd.area_to_params(bounds, accuracy=1000, method=method)
+            params['theta'] = 25
+            grid, _ = tbd.area_to_grid(bounds, params=params)
+            cols = list(grid.columns[:-1])
+            #栅格不重复，且覆盖整个范围
+            assert not grid[cols].duplicated().any()
+            assert np.isclose(
+                grid.unary_union.intersection(
+                    Polygon.from_bounds(*bounds)).area,
+                Polygon.from_bounds(*bounds).area)
+            #栅格编号与GPS_to_grid一致
+            centre = grid.representative_point()
+            gridid = tbd.GPS_to_grid(centre.x, centre.y, params)
+            assert np.array_equal(np.array(gridid).T, grid[cols].values)
+            #空间索引预筛选结果不变
+            grid1, _ = tbd.area_to_grid(shape, params=params)
+            grid2, _ = tbd.area_to_grid(shape, params=params, prefilter=True)
+            assert np.array_equal(grid1[cols].values, grid2[cols].values)
+
+    def test_GPS_to_grid_chunked(self):
+        rng = np.random.default_rng(0)
+        lon = rng.uniform(113.5, 114.5, 10000)
+        lat = rng.uniform(22.3, 22.9, 10000)
+        for method in ['rect', 'tri', 'hexa']:
+            params = {'slon': 113.75,
+                      'slat': 22.4,
+                      'deltalon': 0.0048,
+                      'deltalat': 0.0045,
+                      'theta': 25,
+                      'method': method}
+            gridid = tbd.GPS_to_grid(lon, lat, params)
+            result = tbd.GPS_to_grid(lon, lat, params, chunksize=3000)
+            for i, j in zip(gridid, result):
+                assert np.array_equal(i, j)
+            #写入预先分配的int32数组，多线程计算
+            out = [np.empty(len(lon), dtype=np.int32) for i in gridid]
+            result = tbd.GPS_to_grid(lon, lat, params, chunksize=3000,
+                                     out=out, n_jobs=2)
+            for i, j in zip(gridid, out):
+                assert np.array_equal(i, j)
+            gridkey = tbd.GPS_to_grid(lon, lat, params, packed=True,
+                                      chunksize=3000, n_jobs=2)
+            assert np.array_equal(gridkey, tbd.grid_to_key(gridid, params))
+
+    def test_grid_index(self):
+        data = pd.DataFrame({'uid': [1, 1, 1, 2, 2, 3],
+                             'lon': [113.601, 113.602, 113.611, 113.601,
+                                     113.621, 113.631],
+                             'lat': [22.401, 22.402, 22.401, 22.401,
+                                     22.401, 22.401]})
+        #栅格计数为[3, 1, 1, 1]
+        assert np.isclose(tbd.grid_index_gini(data, self.params), 1 / 3)
+        assert tbd.grid_index_gridscount(data, self.params) == 2
+        hblon, hblat = tbd.grid_to_centre(
+            tbd.GPS_to_grid(data['lon'], data['lat'], self.params),
+            self.params)
+        dist = tbd.getdistance(hblon, hblat, data['lon'], data['lat'])
+        assert np.isclose(tbd.grid_index_centerdist(data, self.params),
+                          np.median(dist))
+        #缺失的经纬度不参与计算
+        data1 = pd.concat([data, pd.DataFrame(
+            {'uid': [3], 'lon': [np.nan], 'lat': [np.nan]})])
+        assert np.isclose(tbd.grid_index_centerdist(data1, self.params),
+                          np.median(dist))
+        assert tbd.grid_index_gridscount(data1, self.params) == 2
+        assert np.isclose(tbd.grid_index_gini(data1, self.params), 1 / 3)
+
+    def test_gridsystem(self):
+        lon = np.array([113.7, 113.5, 120, 100.1])
+        lat = np.array([22.7, 22.1, 31.3, 40.2])
+        for method in ['rect', 'tri', 'hexa']:
+            params = {'slon': 113.75,
+                      'slat': 22.4,
+                      'deltalon': 0.04871681446449111,
+                      'deltalat': 0.044966052064229066,
+                      'theta': 25,
+                      'method': method}
+            grid = tbd.GridSystem(params)
+            gridid = grid.to_grid(lon, lat)
+            for i, j in zip(gridid, tbd.GPS_to_grid(lon, lat, params)):
+                assert np.array_equal(i, j)
+            assert np.allclose(grid.to_centre(gridid),
+                               tbd.grid_to_centre(gridid, params))
+            assert grid.to_polygon(gridid)[2].equals(
+                tbd.grid_to_polygon(gridid, params)[2])
+            #相邻栅格与栅格共边（方形栅格包括对角栅格）
+            neighbors = grid.neighbors(gridid)
+            polygon = grid.to_polygon(gridid)[0]
+            for k in range(neighbors[0].shape[1]):
+                neighbor = grid.to_polygon([col[:1, k] for col in neighbors])
+                assert polygon.touches(neighbor[0])
+        with pytest.raises(AttributeError):
+            grid.theta = 0
+        with pytest.raises(ValueError):
+            tbd.GridSystem(dict(params, deltalon=-1))
+
+    def test_grid_neighbors(self):
+        for method, size in [('rect', [1, 9, 25, 49]),
+                             ('tri', [1, 4, 10, 19]),
+                             ('hexa', [1, 7, 19, 37])]:
+            params = {'slon': 113.75,
+                      'slat': 22.4,
+                      'deltalon': 0.0048,
+                      'deltalat': 0.0045,
+                      'theta': 25,
+                      'method': method}
+            gridid = tbd.GPS_to_grid(np.array([113.76, 113.8]),
+                                     np.array([22.41, 22.43]), params)
+            #逐层扩展相邻栅格得到的栅格距离与grid_distance一致
+            visited = {tuple(col[0] for col in gridid): 0}
+            frontier = [col[:1] for col in gridid]
+            for k in range(1, 4):
+                neighbors = tbd.grid_ring(frontier, params, k=1)
+                cells = set(zip(*[col.ravel() for col in neighbors]))
+                cells = [cell for cell in cells if cell not in visited]
+                visited.update({cell: k for cell in cells})
+                frontier = [np.array(col) for col in zip(*cells)]
+            cells = [np.array(col) for col in zip(*visited)]
+            origin = [np.repeat(col[:1], len(visited)) for col in gridid]
+            assert np.array_equal(tbd.grid_distance(cells, origin, params),
+                                  list(visited.values()))
+            for k in range(4):
+                kring = tbd.grid_kring(gridid, params, k=k)
+                assert kring[0].shape == (2, size[k])
+            #邻接矩阵
+            grid, _ = tbd.area_to_grid([113.7, 22.35, 113.8, 22.45],
+                                       params=params)
+            gridid = [grid[col].values for col in grid.columns[:-1]]
+            adjacency = tbd.grid_adjacency(gridid, params, k=2).toarray()
+            distance = np.array([tbd.grid_distance(
+                [col[i:i+1] for col in gridid], gridid, params)
+                for i in range(len(grid))])
+            assert np.array_equal(adjacency, (distance <= 2) & (distance > 0))
+
+    def test_grid_pyramid(self):
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({'lon': rng.uniform(113.5, 113.7, 5000),
+                             'lat': rng.uniform(22.3, 22.5, 5000)})
+        params = dict(tbd.area_to_params([113.5, 22.3, 113.7, 22.5],
+                                         accuracy=250), theta=25)
+        data['LONCOL'], data['LATCOL'] = tbd.GPS_to_grid(
+            data['lon'], data['lat'], params)
+        grid_agg = data.groupby(['LONCOL', 'LATCOL']).size().rename(
+            'count').reset_index()
+        #逐层汇总与直接按上层栅格集计结果一致
+        grid_agg_1, params_1 = tbd.grid_rollup(grid_agg, params)
+        grid_agg_2, params_2 = tbd.grid_rollup(grid_agg_1, params_1)
+        params_level = tbd.grid_level_params(params, 2)
+        assert np.isclose(params_level['gridsize'], 1000)
+        for key in ['slon', 'slat', 'deltalon', 'deltalat']:
+            assert np.isclose(params_2[key], params_level[key])
+        data['LONCOL'], data['LATCOL'] = tbd.GPS_to_grid(
+            data['lon'], data['lat'], params_level)
+        truth = data.groupby(['LONCOL', 'LATCOL']).size().rename(
+            'count').reset_index()
+        assert grid_agg_2.equals(truth)
+        #上下层栅格编号互相转换
+        gridkey = tbd.grid_to_key(
+            [grid_agg['LONCOL'], grid_agg['LATCOL']], params)
+        children = tbd.grid_to_children(gridkey, params, level=2)
+        assert children.shape == (len(gridkey), 16)
+        assert np.array_equal(
+            tbd.grid_to_parent(children.ravel(), params, level=2),
+            np.repeat(gridkey, 16))
+
+    def test_grid_zone_lookup(self, tmp_path):
+        shape = gpd.GeoDataFrame({'name': ['a', 'b', 'c']}, geometry=[
+            Polygon([(113.9, 22.5), (114.0, 22.5), (114.0, 22.6),
+                     (113.9, 22.6)]),
+            Polygon([(114.0, 22.5), (114.1, 22.5), (114.1, 22.6),
+                     (114.0, 22.6)]),
+            Polygon([(113.95, 22.6), (114.05, 22.6), (114.05, 22.65),
+                     (113.95, 22.65)])])
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({'Lng': rng.uniform(113.85, 114.15, 2000),
+                             'Lat': rng.uniform(22.45, 22.7, 2000),
+                             'count': rng.integers(1, 5, 2000)})
+        lookup = tbd.GridZoneLookup(shape, accuracy=500)
+        #查表与空间连接结果一致
+        aggresult1, data1 = tbd.dataagg(data, shape.copy(),
+                                        col=['Lng', 'Lat', 'count'])
+        aggresult2, data2 = tbd.dataagg(data, shape.copy(),
+                                        col=['Lng', 'Lat', 'count'],
+                                        lookup=lookup)
+        assert aggresult1['count'].tolist() == aggresult2['count'].tolist()
+        assert list(data1.columns) == list(data2.columns)
+        data['LONCOL'], data['LATCOL'] = tbd.GPS_to_grid(
+            data['Lng'], data['Lat'], lookup.params)
+        area1 = tbd.grid_to_area(data, shape, lookup.params)
+        area2 = tbd.grid_to_area(data, shape, lookup.params, lookup=lookup)
+        assert sorted(zip(area1['Lng'], area1['name'])) == \
+            sorted(zip(area2['Lng'], area2['name']))
+        #按面积比例拆分，每个小区的栅格面积之和与小区面积一致
+        weighted = lookup.aggregate(lookup.keys, weighted=True)
+        assert np.allclose(weighted / weighted[2], [2, 2, 1], rtol=1e-2)
+        #保存与读取
+        lookup.save(tmp_path / 'lookup.npz')
+        lookup2 = tbd.GridZoneLookup.load(tmp_path / 'lookup.npz')
+        assert lookup2.params == lookup.params
+        assert np.array_equal(lookup2.to_zone(lookup.keys),
+                              lookup.to_zone(lookup.keys))
+        #三角形、六边形栅格
+        for method in ['tri', 'hexa']:
+            params = dict(lookup.params, method=method)
+            lookup = tbd.GridZoneLookup(shape, params=params)
+            gridid = tbd.GPS_to_grid(data['Lng'], data['Lat'], params)
+            gridcol = ['loncol_1', 'loncol_2', 'loncol_3']
+            data1 = pd.DataFrame(dict(zip(gridcol, gridid)))
+            data1['Lng'] = data['Lng']
+            area1 = tbd.grid_to_area(data1, shape, params, col=gridcol)
+            area2 = tbd.grid_to_area(data1, shape, params, col=gridcol,
+                                     lookup=lookup)
+            assert sorted(zip(area1['Lng'], area1['name'])) == \
+                sorted(zip(area2['Lng'], area2['name']))
+            weighted = lookup.aggregate(lookup.keys, weighted=True)
+            assert np.allclose(weighted / weighted[2], [2, 2, 1], rtol=1e-2)
+
+    def test_grid_boundary_mask(self):
+        shape = gpd.GeoDataFrame(geometry=[
+            Polygon([(113.9, 22.5), (114.0, 22.45), (114.1, 22.55),
+                     (113.95, 22.62)])])
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({'Lng': rng.uniform(113.85, 114.15, 5000),
+                             'Lat': rng.uniform(22.4, 22.7, 5000)})
+        #结果与逐点判断一致
+        truth = gpd.GeoSeries(gpd.points_from_xy(
+            data['Lng'], data['Lat'])).intersects(shape.unary_union).values
+        for params in [None, dict(tbd.area_to_params(
+                [113.9, 22.45, 114.1, 22.62], accuracy=1000), theta=20)]:
+            mask = tbd.GridBoundaryMask(shape, params=params)
+            assert set(np.unique(mask.mask)) == {0, 1, 2}
+            assert np.array_equal(mask.contains(data['Lng'], data['Lat']),
+                                  truth)
+        data1 = tbd.clean_outofshape(data, shape, accuracy=1000)
+        assert data1.equals(data[truth].reset_index(drop=True))
+        #不做逐点判断时保留边界栅格中的全部数据
+        data2 = tbd.clean_outofshape(data, shape, accuracy=1000, exact=False)
+        assert len(data2) > len(data1)
+        assert len(data2.merge(data1)) == len(data1)
+
+    def test_grid_key(self):
+        lon = np.array([113.7, 113.5, 120, 100.1])
+        lat = np.array([22.7, 22.1, 31.3, 40.2])
+        for method in ['rect', 'tri', 'hexa']:
+            params = {'slon': 113.75,
+                      'slat': 22.4,
+                      'deltalon': 0.04871681446449111,
+                      'deltalat': 0.044966052064229066,
+                      'theta': 25,
+                      'method': method}
+            gridid = tbd.GPS_to_grid(lon, lat, params)
+            gridkey = tbd.GPS_to_grid(lon, lat, params, packed=True)
+            assert gridkey.dtype == np.int64
+            assert np.array_equal(tbd.grid_to_key(gridid, params), gridkey)
+            assert np.array_equal(tbd.key_to_grid(gridkey, params), gridid)
+            assert np.allclose(tbd.grid_to_centre(gridkey, params),
+                               tbd.grid_to_centre(gridid, params))
+            assert tbd.grid_to_polygon(gridkey, params)[1].equals(
+                tbd.grid_to_polygon(gridid, params)[1])
+
     def test_params_optimize(self):
         data = pd.DataFrame([
             [34745, '20:27:43', 113.80684699999999, 22.623248999999998, 1, 27],
@@ -206,3 +488,20 @@ class TestGrids:
                                                     printlog=True,
                                                     max_iter=1)
 
+        #多进程计算与缓存不改变优化结果
+        for optmethod in ['gini', 'gridscount']:
+            np.random.seed(0)
+            result1 = tbd.grid_params_optimize(data,
+                                               initialparams,
+                                               col=['Vehicleid','slon','slat'],
+                                               optmethod=optmethod,
+                                               max_iter=2)
+            np.random.seed(0)
+            result2 = tbd.grid_params_optimize(data,
+                                               initialparams,
+                                               col=['Vehicleid','slon','slat'],
+                                               optmethod=optmethod,
+                                               max_iter=2,
+                                               n_jobs=2,
+                                               cache=True)
+            assert result1 == result2
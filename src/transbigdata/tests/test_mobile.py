@@ -33,4 +33,30 @@ class TestMobile:
         assert home['LONCOL'].iloc[0] == -83
         #Identify work location
         work = tbd.mobile_identify_work(stay, col=['user_id', 'stime', 'etime', 'LONCOL', 'LATCOL','lon','lat'], minhour=3, start_hour=8, end_hour=20,workdaystart=0, workdayend=4)
-        assert work['LONCOL'].iloc[0] == -86
\ No newline at end of file
+        assert work['LONCOL'].iloc[0] == -86
+
+    def test_mobile_stay_point(self):
+        data = pd.DataFrame([
+            ['a', '2018-06-01 00:00', 121.43, 30.175],
+            ['a', '2018-06-01 06:20', 121.4301, 30.175],
+            ['a', '2018-06-01 07:21', 121.417, 30.24],
+            ['a', '2018-06-01 10:22', 121.417, 30.24],
+            ['a', '2018-06-01 20:26', 121.43, 30.175],
+            ['a', '2018-06-01 23:28', 121.43, 30.175],
+            ['a', '2018-06-01 23:29', 121.42, 30.175]],
+            columns=['user_id', 'stime', 'longitude', 'latitude'])
+        col = ['user_id', 'stime', 'longitude', 'latitude']
+        stay, move = tbd.mobile_stay_point(data, col=col, distlimit=200)
+        assert len(stay) == 3
+        assert len(move) == 2
+        assert stay['lon'].round(5).tolist() == [121.43005, 121.417, 121.43]
+        assert stay['duration'].tolist() == [22800, 10860, 10920]
+        #同一地点的停留点地点相同，可用于识别居住地
+        assert stay['LONCOL'].iloc[2] == stay['LONCOL'].iloc[0]
+        home = tbd.mobile_identify_home(
+            stay, col=['user_id', 'stime', 'etime', 'LONCOL', 'LATCOL'])
+        assert home['LATCOL'].iloc[0] == 30.175
+        params = tbd.area_to_params([121.860, 29.295, 121.862, 29.301],
+                                    accuracy=500)
+        stay, move = tbd.mobile_stay_point(data, col=col, params=params)
+        assert stay['LONCOL'].tolist() == [-83, -86, -83]
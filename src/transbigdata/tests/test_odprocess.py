@@ -1,3 +1,5 @@
+import gzip
+import json
 import transbigdata as tbd
 import numpy as np
 import pandas as pd
@@ -119,3 +121,230 @@ class TestODprocess:
         data['count'] = 1
         assert tbd.dataagg(data, self.sz, col=['slon', 'slat', 'count'],
                            accuracy=500)[0]['count'].iloc[0] == 19
+
+    def test_clean_drift_window(self):
+        data = pd.DataFrame({
+            'VehicleNum': 1,
+            'time': pd.date_range('2023-01-01', periods=100, freq='10s'),
+            'slon': 113.9 + np.arange(100) * 1e-4,
+            'slat': 22.5})
+        #连续1、2、3条的漂移数据
+        data.loc[[10, 30, 31, 60, 61, 62], 'slat'] += 0.05
+        col = ['VehicleNum', 'time', 'slon', 'slat']
+        for window, removed in [(1, [10]),
+                                (2, [10, 30, 31]),
+                                (3, [10, 30, 31, 60, 61, 62])]:
+            data1 = tbd.clean_drift(data, col=col, window=window)
+            assert sorted(set(data.index) - set(data1.index)) == removed
+
+    def test_clean_same_tolerance(self):
+        rng = np.random.default_rng(0)
+        #停车时的GPS漂移，之后开始移动
+        data = pd.DataFrame({
+            'VehicleNum': 1,
+            'time': pd.date_range('2023-01-01', periods=60, freq='30s'),
+            'slon': 113.9 + np.append(rng.normal(0, 1e-5, 30),
+                                      np.arange(1, 31) * 1e-3),
+            'slat': 22.5 + np.append(rng.normal(0, 1e-5, 30),
+                                     np.zeros(30))})
+        col = ['VehicleNum', 'time', 'slon', 'slat']
+        assert len(tbd.clean_same(data, col=col)) == 60
+        data1 = tbd.clean_same(data, col=col, tolerance=20)
+        assert data1.index.tolist() == [0, 29] + list(range(30, 60))
+
+    def test_id_reindex(self):
+        data = pd.DataFrame({'id': ['b', 'a', 'b', 'c', 'a'],
+                             'lon': [113.9, 113.9, 113.901, 113.9, 113.9],
+                             'lat': [22.5, 22.5, 22.5, 22.5, 22.5]})
+        #按首次出现的顺序编号，数据顺序不变
+        data1 = tbd.id_reindex(data, 'id')
+        assert data1['id'].tolist() == data['id'].tolist()
+        assert data1['id_new'].tolist() == [0, 1, 0, 2, 1]
+        data1 = tbd.id_reindex(data, 'id', categorical=True)
+        assert data1['id_new'].dtype == 'category'
+        assert data1['id_new'].astype(int).tolist() == [0, 1, 0, 2, 1]
+        #删除只有一条记录的个体
+        data1 = tbd.id_reindex_disgap(
+            data.sort_values('id'), col=['id', 'lon', 'lat'], disgap=500)
+        assert data1['id'].tolist() == ['a', 'a', 'b', 'b']
+        assert data1['id_new'].tolist() == [0, 0, 1, 1]
+
+    def test_stream_cleaner(self):
+        data = pd.DataFrame({
+            'VehicleNum': [1, 1, 1, 1, 1, 2, 2, 2],
+            'Time': pd.to_datetime(['2022-01-01 00:00:00',
+                                    '2022-01-01 00:00:10',
+                                    '2022-01-01 00:00:20',
+                                    '2022-01-01 00:00:30',
+                                    '2022-01-01 00:00:40',
+                                    '2022-01-01 00:00:00',
+                                    '2022-01-01 00:00:10',
+                                    '2022-01-01 00:00:20']),
+            'Lng': [113.9, 113.9, 114.5, 113.9001, 113.9002,
+                    113.8, 113.8, 113.8],
+            'Lat': [22.5, 22.5, 22.5, 22.5, 22.5, 22.6, 22.6, 22.6]})
+        truth = tbd.clean_drift(tbd.clean_same(data), data.columns.tolist())
+        #分批输入，结果与整批清洗一致
+        cleaner = tbd.StreamCleaner()
+        result = pd.concat([cleaner.push(data.iloc[:3]),
+                            cleaner.push(data.iloc[3:6]),
+                            cleaner.push(data.iloc[6:]),
+                            cleaner.flush()])
+        assert result.sort_index().index.tolist() == \
+            truth.sort_index().index.tolist()
+
+    def test_normalize_dtypes(self):
+        data = pd.DataFrame({
+            'VehicleNum': ['a', 'a', 'a', 'b', 'b'],
+            'Time': ['2022-01-01 00:00:00', '2022-01-01 00:00:10',
+                     '2022-01-01 00:00:20', '2022-01-01 00:00:00',
+                     '2022-01-01 00:00:10'],
+            'Lng': [113.9, 114.5, 113.9001, 113.8, 113.8],
+            'Lat': [22.5, 22.5, 22.5, 22.6, 22.6]})
+        data1 = tbd.normalize_dtypes(data, coordtype='int32')
+        assert data1['VehicleNum'].dtype == 'category'
+        assert data1['Time'].tolist()[:2] == [1640995200, 1640995210]
+        assert data1['Lng'].tolist()[:2] == [113900000, 114500000]
+        #转换后的数据清洗结果不变
+        assert tbd.clean_drift(data1).index.tolist() == \
+            tbd.clean_drift(data).index.tolist()
+        #int32的经纬度在生成轨迹与OD时转换回度
+        traj = tbd.points_to_traj(data1, col=['Lng', 'Lat', 'VehicleNum'])
+        assert list(traj.geometry.iloc[1].coords) == [(113.8, 22.6)] * 2
+        traj = tbd.points_to_traj(data1, col=['Lng', 'Lat', 'VehicleNum'],
+                                  timecol='Time')
+        assert traj['features'][0]['geometry']['coordinates'][0] == [
+            113.9, 22.5, 0, 1640995200]
+        data1['OpenStatus'] = [0, 1, 0, 0, 1]
+        oddata = tbd.taxigps_to_od(
+            data1, col=['VehicleNum', 'Time', 'Lng', 'Lat', 'OpenStatus'])
+        assert oddata[['slon', 'elon']].values.tolist() == [
+            [114.5, 113.9001]]
+        densify = tbd.traj_densify(data1, col=[
+            'VehicleNum', 'Time', 'Lng', 'Lat'], timegap=5)
+        assert densify['Lng'].dtype == np.int32
+        assert densify['Lng'].tolist()[:2] == [113900000, 114200000]
+        for method in ['subsample', 'douglas-peucker', 'heading']:
+            assert tbd.traj_sparsify(
+                data1, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
+                method=method).index.tolist() == tbd.traj_sparsify(
+                data, col=['VehicleNum', 'Time', 'Lng', 'Lat'],
+                method=method).index.tolist()
+        data2 = tbd.normalize_dtypes(data1.drop(columns='OpenStatus'),
+                                     idtype='int32')
+        assert data2['VehicleNum'].tolist() == [0, 0, 0, 1, 1]
+        assert data2['Time'].dtype == 'int64'
+        assert data2['Lng'].dtype == 'float32'
+
+    def test_traj_densify(self):
+        data = pd.DataFrame({
+            'Vehicleid': [2, 1, 1, 2],
+            'Time': pd.to_datetime(['2022-01-01 00:00:00',
+                                    '2022-01-01 01:00:00',
+                                    '2022-01-01 01:00:40',
+                                    '2022-01-01 00:00:20']),
+            'Lng': [113.0, 114.0, 114.4, 113.2],
+            'Lat': [22.0, 22.5, 22.5, 22.0]})
+        data1 = tbd.traj_densify(data, timegap=10)
+        #每辆车只在自身的时间范围内插值
+        assert data1['Vehicleid'].tolist() == [2, 2, 2, 1, 1, 1, 1, 1]
+        assert data1['Lng'].round(6).tolist() == [
+            113.0, 113.1, 113.2, 114.0, 114.1, 114.2, 114.3, 114.4]
+        data1 = tbd.traj_densify(tbd.normalize_dtypes(
+            data, col=['Vehicleid', 'Time', 'Lng', 'Lat']), timegap=10)
+        assert data1['Time'].tolist()[:3] == [
+            1640995200, 1640995210, 1640995220]
+
+    def test_traj_sparsify(self):
+        data = pd.DataFrame({
+            'Vehicleid': [1] * 6,
+            'Time': pd.date_range('2022-01-01', periods=6, freq='10s'),
+            'Lng': [113.9, 113.901, 113.902, 113.903, 113.903, 113.903],
+            'Lat': [22.5, 22.5, 22.50001, 22.5, 22.501, 22.502]})
+        #直线上的点被删除，只保留起终点与拐点
+        for method in ['douglas-peucker', 'sliding-window', 'heading']:
+            data1, stats = tbd.traj_sparsify(data, method=method,
+                                             tolerance=5, stats=True)
+            assert data1.index.tolist() == [0, 3, 5]
+            assert stats['count_new'].tolist() == [3]
+            assert stats['max_error'].iloc[0] < 5
+        data1 = tbd.traj_sparsify(data, method='douglas-peucker',
+                                  tolerance=1)
+        assert data1.index.tolist() == [0, 2, 3, 5]
+        #子采样的时间段从Unix时间戳0时起对齐，与车辆无关
+        times = pd.to_datetime('2022-01-01') + pd.to_timedelta(
+            [10, 14, 15, 29, 31], unit='s')
+        sample = pd.DataFrame({'Vehicleid': [1] * 5 + [2] * 5,
+                               'Time': list(times) * 2,
+                               'Lng': 113.9, 'Lat': 22.5})
+        data1 = tbd.traj_sparsify(sample, timegap=15)
+        assert data1.index.tolist() == [0, 2, 4, 5, 7, 9]
+        #插值的压缩比以同一秒内去重后的轨迹点数计算
+        sample = sample.iloc[:5].copy()
+        sample.loc[1, 'Time'] = times[0] + pd.Timedelta(0.5, unit='s')
+        data1, stats = tbd.traj_sparsify(sample, timegap=5,
+                                         method='interpolate', stats=True)
+        assert stats['count'].tolist() == [4]
+        assert stats['ratio'].tolist() == [len(data1) / 4]
+        #多进程与单进程的结果相同
+        long = pd.DataFrame({
+            'Vehicleid': 3,
+            'Time': pd.date_range('2022-01-01', periods=60, freq='10s'),
+            'Lng': 113.9 + np.arange(60) * 0.001,
+            'Lat': 22.5 + np.sin(np.arange(60)) * 0.0001})
+        data = pd.concat([data.assign(Vehicleid=i) for i in range(3)]
+                         + [long], ignore_index=True)
+        for method in ['douglas-peucker', 'sliding-window', 'heading']:
+            for n_jobs in [2, 3]:
+                data1 = tbd.traj_sparsify(data, method=method, tolerance=1,
+                                          n_jobs=n_jobs)
+                assert data1.index.tolist() == tbd.traj_sparsify(
+                    data, method=method, tolerance=1).index.tolist()
+
+    def test_points_to_traj(self, tmp_path):
+        data = pd.DataFrame({
+            'ID': [2, 1, 2, 1, 3],
+            'Time': pd.to_datetime(['2022-01-01 00:00:00',
+                                    '2022-01-01 00:00:00',
+                                    '2022-01-01 00:00:10',
+                                    '2022-01-01 00:00:10',
+                                    '2022-01-01 00:00:00']),
+            'Lng': [113.0, 114.0, 113.1, 114.1, 115.0],
+            'Lat': [22.0, 22.5, 22.1, 22.6, 23.0]})
+        traj = tbd.points_to_traj(data)
+        assert traj['ID'].tolist() == [2, 1, 3]
+        assert list(traj.geometry.iloc[0].coords) == [(113.0, 22.0),
+                                                      (113.1, 22.1)]
+        assert traj.geometry.iloc[2] is None
+        #geojson直接写入文件
+        traj = tbd.points_to_traj(data, timecol='Time')
+        path = str(tmp_path / 'traj.json')
+        assert tbd.points_to_traj(data, timecol='Time', path=path) is None
+        with open(path) as f:
+            assert json.load(f) == traj
+        assert len(traj['features']) == 2
+
+    def test_dumpjson(self, tmp_path):
+        features = [{'type': 'Feature', 'properties': {'ID': np.int64(i)},
+                     'geometry': {'type': 'LineString',
+                                  'coordinates': np.array([
+                                      [113.1234567, 22.1], [113.2, 22.2]])}}
+                     for i in range(3)]
+        path = str(tmp_path / 'traj.json.gz')
+        tbd.dumpjson(iter(features), path, precision=3)
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+        assert data['type'] == 'FeatureCollection'
+        assert len(data['features']) == 3
+        assert data['features'][0]['geometry']['coordinates'][0] == [
+            113.123, 22.1]
+        #单个Feature与几何对象的坐标同样保留小数位数
+        path = str(tmp_path / 'feature.json')
+        feature = dict(features[0], geometry={
+            'type': 'Point', 'coordinates': [1.123456, 2.0]})
+        for data in [feature, feature['geometry'], {
+                'type': 'GeometryCollection',
+                'geometries': [feature['geometry']]}]:
+            tbd.dumpjson(data, path, precision=2)
+            with open(path) as f:
+                assert '1.12,' in f.read()
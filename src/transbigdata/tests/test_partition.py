@@ -0,0 +1,87 @@
+import transbigdata as tbd
+import numpy as np
+import pandas as pd
+
+
+class TestPartition:
+    def setup_method(self):
+        rng = np.random.default_rng(0)
+        n = 3000
+        self.data = pd.DataFrame({
+            'VehicleNum': rng.integers(0, 50, n),
+            'Time': pd.to_datetime('2023-01-01') + pd.to_timedelta(
+                rng.integers(0, 86400, n), unit='s'),
+            'Lng': 114 + rng.normal(0, 0.01, n),
+            'Lat': 22.5 + rng.normal(0, 0.01, n)})
+
+    def test_partition_by_id(self, tmp_path):
+        self.data.to_csv(tmp_path / 'data.csv', index=False)
+        partitions = tbd.partition_by_id(
+            str(tmp_path / 'data.csv'), str(tmp_path / 'parts'),
+            'VehicleNum', npartitions=8, chunksize=500)
+        parts = [tbd.read_partition(i) for i in partitions]
+        #同一个体的数据只在一个分区中
+        assert sum(len(i) for i in parts) == len(self.data)
+        ids = pd.concat([i[['VehicleNum']].drop_duplicates() for i in parts])
+        assert ids['VehicleNum'].is_unique
+
+    def test_partition_by_id_blank(self, tmp_path):
+        rows = ['1', '2', '3', '4', '', '1', '2', '3', '4', '3']
+        (tmp_path / 'data.csv').write_text(
+            'VehicleNum,Lng\n' + ''.join(
+                f'{j},{i}\n' for i, j in enumerate(rows)))
+        partitions = tbd.partition_by_id(
+            str(tmp_path / 'data.csv'), str(tmp_path / 'parts'),
+            'VehicleNum', npartitions=8, chunksize=5)
+        parts = [tbd.read_partition(i) for i in partitions]
+        #有空ID的分块中ID被读为浮点数，同一个体仍只在一个分区中
+        ids = pd.concat([i[['VehicleNum']].dropna().drop_duplicates()
+                         for i in parts])
+        assert ids['VehicleNum'].is_unique
+        assert sum(len(i) for i in parts) == len(rows)
+
+    def test_chunked_apply(self, tmp_path):
+        self.data.to_csv(tmp_path / 'data.csv', index=False)
+        col = ['VehicleNum', 'Time', 'Lng', 'Lat']
+        outputs = tbd.chunked_apply(
+            str(tmp_path / 'data.csv'), tbd.clean_drift, 'VehicleNum',
+            str(tmp_path / 'out'), npartitions=4, chunksize=700,
+            tmpdir=str(tmp_path), col=col)
+        result = pd.concat([pd.read_csv(i) for i in outputs])
+        result['Time'] = pd.to_datetime(result['Time'])
+        truth = tbd.clean_drift(self.data, col=col)
+        pd.testing.assert_frame_equal(
+            result.sort_values(col).reset_index(drop=True),
+            truth.sort_values(col).reset_index(drop=True))
+
+    def test_chunked_apply_headerless(self, tmp_path):
+        col = ['VehicleNum', 'Time', 'Lng', 'Lat']
+        self.data.to_csv(tmp_path / 'data.csv', index=False, header=False)
+        outputs = tbd.chunked_apply(
+            str(tmp_path / 'data.csv'), tbd.clean_drift, 'VehicleNum',
+            str(tmp_path / 'out'), npartitions=4, chunksize=700,
+            read_kwargs={'header': None, 'names': col},
+            tmpdir=str(tmp_path), col=col)
+        result = pd.concat([pd.read_csv(i) for i in outputs])
+        #分区文件的表头不会被当作数据读入
+        assert len(result) == len(tbd.clean_drift(self.data, col=col))
+        assert result['Lng'].dtype == float
+
+    def test_parallel_apply(self):
+        col = ['VehicleNum', 'Time', 'Lng', 'Lat']
+        truth = tbd.clean_drift(self.data, col=col)
+        for n_jobs in [1, 2]:
+            result = tbd.parallel_apply(self.data, tbd.clean_drift,
+                                        'VehicleNum', n_jobs=n_jobs, col=col)
+            assert result.equals(truth)
+
+    def test_parallel_apply_tz(self):
+        col = ['VehicleNum', 'Time', 'Lng', 'Lat']
+        data = self.data.copy()
+        data['Time'] = data['Time'].dt.tz_localize('Asia/Shanghai')
+        #带时区的时间列在多进程时保留时区
+        for n_jobs in [1, 2]:
+            result = tbd.parallel_apply(data, tbd.clean_same, 'VehicleNum',
+                                        n_jobs=n_jobs, col=col)
+            assert str(result['Time'].dt.tz) == 'Asia/Shanghai'
+            assert result.equals(tbd.clean_same(data, col=col))
@@ -30,10 +30,15 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
+import os
+import json
+import math
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from .preprocess import id_reindex
+from concurrent.futures import ProcessPoolExecutor
+from .preprocess import to_datetime, is_epoch_seconds
+from .coordinates import coord_float, coord_scale
 
 
 def traj_densify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15):
@@ -42,6 +47,9 @@ def traj_densify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15):
     
     确保每隔timegap秒会有一个轨迹点
 
+    每辆车只在其自身的起止时间内按timegap生成时间点，插入点的经纬度由前后轨迹点按时间线性插值得到，
+    内存占用与输出的数据量成正比
+
     Parameters
     -------
     data : DataFrame
@@ -56,50 +64,19 @@ def traj_densify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15):
     data1 : DataFrame
         处理后的数据
     '''
-    Vehicleid, Time, Lng, Lat = col
-    data[Time] = pd.to_datetime(data[Time])
-    data1 = data.copy()
-    data1 = data1.drop_duplicates([Vehicleid, Time])
-    data1 = id_reindex(data1, Vehicleid)
-    data1 = data1.sort_values(by=[Vehicleid+'_new', Time])
-    data1['utctime'] = data1[Time].apply(lambda r: int(r.value/1000000000))
-    data1['utctime_new'] = data1[Vehicleid+'_new']*10000000000+data1['utctime']
-    a = data1.groupby([Vehicleid+'_new']
-                      )['utctime'].min().rename('mintime').reset_index()
-    b = data1.groupby([Vehicleid+'_new']
-                      )['utctime'].max().rename('maxtime').reset_index()
-    minmaxtime = pd.merge(a, b)
-    mintime = data1['utctime'].min()
-    maxtime = data1['utctime'].max()
-    timedata = pd.DataFrame(range(mintime, maxtime, timegap), columns=[Time])
-    timedata['tmp'] = 1
-    minmaxtime['tmp'] = 1
-    minmaxtime = pd.merge(minmaxtime, timedata)
-    minmaxtime = minmaxtime[(minmaxtime['mintime'] <= minmaxtime[Time]) & (
-        minmaxtime['maxtime'] >= minmaxtime[Time])]
-    minmaxtime['utctime_new'] = minmaxtime[Vehicleid+'_new'] * \
-        10000000000+minmaxtime[Time]
-    minmaxtime[Time] = pd.to_datetime(minmaxtime[Time], unit='s')
-    data1 = pd.concat([data1, minmaxtime[['utctime_new', Time]]]
-                      ).sort_values(by=['utctime_new'])
-    data1 = data1.drop_duplicates(['utctime_new'])
-    data1[Lng] = data1.set_index('utctime_new')[
-        Lng].interpolate(method='index').values
-    data1[Lat] = data1.set_index('utctime_new')[
-        Lat].interpolate(method='index').values
-    data1[Vehicleid] = data1[Vehicleid].ffill()
-    data1[Vehicleid] = data1[Vehicleid].bfill()
-    data1 = data1.drop([Vehicleid+'_new', 'utctime', 'utctime_new'], axis=1)
+    data1, timeline, record = traj_timeline(data, col, timegap)
     return data1
 
 
-
 def traj_sparsify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15,
-                  method='subsample'):
+                  method='subsample', tolerance=10, angle=30, n_jobs=1,
+                  stats=False):
     '''
     轨迹点稀疏化
     
-    轨迹数据采样间隔过高的时候，数据量太大，不便于分析。这个函数可以将采样间隔扩大，缩减数据量
+    轨迹数据采样间隔过高的时候，数据量太大，不便于分析。这个函数可以将采样间隔扩大，缩减数据量。
+    除按时间稀疏化外，还可以按轨迹形状压缩，保留轨迹的拐点，适用于地图匹配与数据存储。
+    各方法均在按车辆与时间排序后的数组上逐车计算
 
     Parameters
     -------
@@ -108,14 +85,33 @@ def traj_sparsify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15,
     col : List
         列名，按[车辆ID,时间,经度,纬度]的顺序
     timegap : number
-        单位为秒，每隔多长时间一个轨迹点
+        单位为秒，每隔多长时间一个轨迹点，`interpolate`与`subsample`方法使用
     method : str
-        可选`interpolate`插值或`subsample`子采样
+        稀疏化方法，可选：
+
+        - `interpolate` : 插值，每辆车在自身的起止时间内每隔timegap秒插值生成一个轨迹点
+        - `subsample` : 子采样，时间从Unix时间戳0时起每timegap秒为一段，每辆车在每段内保留第一个轨迹点。
+          各车辆的分段对齐，与车辆ID无关
+        - `douglas-peucker` : Douglas-Peucker算法，删除轨迹点后轨迹的偏差不超过tolerance
+        - `sliding-window` : 滑动窗口算法，从上一个保留的点开始向后延伸，偏差超过tolerance时保留前一个点
+        - `heading` : 行驶方向相对上一个保留点的方向变化超过angle时保留该点
+    tolerance : number
+        单位为米，`douglas-peucker`与`sliding-window`方法允许的最大偏差
+    angle : number
+        单位为度，`heading`方法的方向变化阈值
+    n_jobs : int
+        按车辆分组并行计算的进程数，-1为使用全部CPU核心
+    stats : bool
+        是否同时输出各车辆的压缩统计
 
     Returns
     -------
     data1 : DataFrame
         处理后的数据
+    stats : DataFrame
+        stats为True时输出，各车辆的原始轨迹点数count、稀疏化后的轨迹点数count_new、
+        压缩比ratio（count_new/count）与删除的轨迹点到稀疏化后轨迹的最大偏差max_error（米）。
+        `interpolate`方法生成的是新的轨迹点，max_error为空值
 
     Example
     -------
@@ -213,58 +209,81 @@ def traj_sparsify(data, col=['Vehicleid', 'Time', 'Lng', 'Lat'], timegap=15,
     .. image:: example-taxi/sparsify.png
     '''
     Vehicleid, Time, Lng, Lat = col
-    data[Time] = pd.to_datetime(data[Time], unit='s')
-    data1 = data.copy()
-    data1 = data1.drop_duplicates([Vehicleid, Time])
-    data1 = id_reindex(data1, Vehicleid)
-    data1 = data1.sort_values(by=[Vehicleid+'_new', Time])
-    data1['utctime'] = data1[Time].apply(lambda r: int(r.value/1000000000))
-    data1['utctime_new'] = data1[Vehicleid+'_new']*10000000000+data1['utctime']
+    if method not in ['interpolate', 'subsample', 'douglas-peucker',
+                      'sliding-window', 'heading']:
+        raise ValueError(
+            'method should be one of: interpolate, subsample, '
+            'douglas-peucker, sliding-window, heading')
     if method == 'interpolate':
-        a = data1.groupby([Vehicleid+'_new']
-                          )['utctime'].min().rename('mintime').reset_index()
-        b = data1.groupby([Vehicleid+'_new']
-                          )['utctime'].max().rename('maxtime').reset_index()
-        minmaxtime = pd.merge(a, b)
-        mintime = data1['utctime'].min()
-        maxtime = data1['utctime'].max()
-        timedata = pd.DataFrame(
-            range(mintime, maxtime, timegap), columns=[Time])
-        timedata['tmp'] = 1
-        minmaxtime['tmp'] = 1
-        minmaxtime = pd.merge(minmaxtime, timedata)
-        minmaxtime = minmaxtime[(minmaxtime['mintime'] <= minmaxtime[Time]) & (
-            minmaxtime['maxtime'] >= minmaxtime[Time])]
-        minmaxtime['utctime_new'] = minmaxtime[Vehicleid+'_new'] * \
-            10000000000+minmaxtime[Time]
-        minmaxtime[Time] = pd.to_datetime(minmaxtime[Time], unit='s')
-        data1 = pd.concat([
-            data1, minmaxtime[['utctime_new', Time]]
-        ]).sort_values(by=['utctime_new'])
-        data1 = data1.drop_duplicates(['utctime_new'])
-        data1[Lng] = data1.set_index('utctime_new')[
-            Lng].interpolate(method='index').values
-        data1[Lat] = data1.set_index('utctime_new')[
-            Lat].interpolate(method='index').values
-        data1[Vehicleid] = data1[Vehicleid].ffill()
-        data1[Vehicleid] = data1[Vehicleid].bfill()
-        data1 = pd.merge(minmaxtime['utctime_new'], data1)
-        data1 = data1.drop(
-            [Vehicleid+'_new', 'utctime', 'utctime_new'], axis=1)
+        data2, timeline, record = traj_timeline(data, col, timegap)
+        data1 = data2[timeline].reset_index(drop=True)
+        if not stats:
+            return data1
+        # The records the timeline is interpolated from
+        count = data2[record].groupby(
+            Vehicleid, sort=False, dropna=False).size()
+        stats = pd.DataFrame({
+            'count': count,
+            'count_new': data1.groupby(Vehicleid, sort=False, dropna=False
+                                       ).size().reindex(count.index,
+                                                        fill_value=0)})
+        stats['ratio'] = stats['count_new'] / stats['count']
+        stats['max_error'] = np.nan
+        return data1, stats.rename_axis(Vehicleid).reset_index()
+
+    times = to_datetime(data[Time])
+    index, ids = traj_records(data[Vehicleid], times.values)
+    x, y = traj_plane(ids, coord_float(data[Lng].values.take(index)),
+                      coord_float(data[Lat].values.take(index)))
     if method == 'subsample':
-        data1['utctime_new'] = (data1['utctime_new']/timegap).astype(int)
-        data1 = data1.drop_duplicates(subset=['utctime_new'])
-        data1 = data1.drop(
-            [Vehicleid+'_new', 'utctime', 'utctime_new'], axis=1)
-    return data1
-
-
-
-def points_to_traj(traj_points, col=['Lng', 'Lat', 'ID'], timecol=None):
+        # The first record in each timegap seconds, the buckets are aligned
+        # to the epoch for all the vehicles
+        bucket = time_seconds(times)[index] // timegap
+        keep = np.ones(len(index), dtype=bool)
+        keep[1:] = (ids[1:] != ids[:-1]) | (bucket[1:] != bucket[:-1])
+    elif len(ids) == 0:
+        keep = np.zeros(0, dtype=bool)
+    else:
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if n_jobs == 1:
+            keep = simplify_keep(method, ids, x, y, tolerance, angle)
+        else:
+            # Split the vehicles into chunks of similar number of records
+            first = np.append(np.flatnonzero(
+                np.append(True, ids[1:] != ids[:-1])), len(ids))
+            bounds = np.unique(first[np.searchsorted(
+                first, np.linspace(0, len(ids), n_jobs * 4 + 1)[1:-1])])
+            bounds = bounds[(bounds > 0) & (bounds < len(ids))]
+            chunks = [np.split(i, bounds) for i in [ids, x, y]]
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                keep = np.concatenate(list(executor.map(
+                    simplify_keep, [method] * len(chunks[0]), *chunks,
+                    [tolerance] * len(chunks[0]), [angle] * len(chunks[0]))))
+    data1 = data.take(index[keep])
+    if not is_epoch_seconds(data[Time]):
+        data1[Time] = times.values.take(index[keep])
+    if not stats:
+        return data1
+    error = simplify_error(ids, x, y, keep)
+    vehicle = np.flatnonzero(np.append(True, ids[1:] != ids[:-1])[:len(ids)])
+    stats = pd.DataFrame({
+        Vehicleid: data[Vehicleid].values.take(index[vehicle]),
+        'count': np.bincount(ids)[ids[vehicle]],
+        'count_new': np.bincount(ids[keep], minlength=len(ids)
+                                 )[ids[vehicle]]})
+    stats['ratio'] = stats['count_new'] / stats['count']
+    stats['max_error'] = np.maximum.reduceat(error, vehicle) \
+        if len(vehicle) else np.zeros(0)
+    return data1, stats
+
+
+def points_to_traj(traj_points, col=['Lng', 'Lat', 'ID'], timecol=None,
+                   path=None):
     '''
     轨迹线型生成
 
-    输入轨迹点，生成轨迹线型的GeoDataFrame
+    输入轨迹点，生成轨迹线型的GeoDataFrame。轨迹点按轨迹编号排序后分组，所有轨迹线型一次生成
 
     Parameters
     -------
@@ -274,74 +293,409 @@ def points_to_traj(traj_points, col=['Lng', 'Lat', 'ID'], timecol=None):
         列名，按[经度,纬度,轨迹编号]的顺序
     timecol : str
         可选，时间列的列名，如果给了则输出带有[经度,纬度,高度,时间]的geojson，可放入kepler中可视化轨迹
+    path : str
+        可选，给定timecol时有效，geojson逐条轨迹直接写入该文件，不在内存中生成完整的json
 
     Returns
     -------
     traj : GeoDataFrame或json
-        生成的轨迹数据，如果timecol没定义则为GeoDataFrame，否则为json
+        生成的轨迹数据，如果timecol没定义则为GeoDataFrame，否则为json；给定path时为None
     '''
     [Lng, Lat, ID] = col
+    # Group the points by id in the order of first appearance, the order of
+    # the points in each group is kept
+    ids, uniques = pd.factorize(traj_points[ID], use_na_sentinel=False)
+    order = np.argsort(ids, kind='stable')
+    count = np.bincount(ids, minlength=len(uniques))
+    offsets = np.append(0, np.cumsum(count))
     if timecol:
-        geometry = []
-        traj_id = []
-        for i in traj_points[ID].drop_duplicates():
-            coords = traj_points[traj_points[ID] == i][[Lng, Lat, timecol]]
-            coords[timecol] = coords[timecol].apply(
-                lambda r: int(r.value/1000000000))
-            coords['altitude'] = 0
-            coords = coords[[Lng, Lat, 'altitude', timecol]].values.tolist()
-            traj_id.append(i)
-            if len(coords) >= 2:
-                geometry.append({
-                    "type": "Feature",
-                    "properties": {"ID":  i},
-                    "geometry": {"type": "LineString",
-                                 "coordinates": coords}})
+        coords = np.empty((len(order), 4))
+        coords[:, 0] = coord_float(traj_points[Lng].values.take(order))
+        coords[:, 1] = coord_float(traj_points[Lat].values.take(order))
+        coords[:, 2] = 0
+        coords[:, 3] = time_seconds(to_datetime(traj_points[timecol]))[order]
+        features = ({
+            "type": "Feature",
+            "properties": {"ID": i},
+            "geometry": {"type": "LineString",
+                         "coordinates": coords[start:end]}}
+            for i, start, end in zip(uniques.tolist(), offsets[:-1].tolist(),
+                                     offsets[1:].tolist())
+            if end - start >= 2)
+        if path is not None:
+            dumpjson(features, path)
+            return None
         traj = {"type": "FeatureCollection",
-                "features": geometry}
+                "features": list(features)}
+        for feature in traj["features"]:
+            geometry = feature["geometry"]
+            geometry["coordinates"] = geometry["coordinates"].tolist()
     else:
+        coords = np.column_stack([
+            coord_float(traj_points[Lng].values.take(order)),
+            coord_float(traj_points[Lat].values.take(order))])
         traj = gpd.GeoDataFrame()
-        from shapely.geometry import LineString
-        geometry = []
-        traj_id = []
-        for i in traj_points[ID].drop_duplicates():
-            coords = traj_points[traj_points[ID] == i][[Lng, Lat]].values
-            traj_id.append(i)
-            if len(coords) >= 2:
-                geometry.append(LineString(coords))
-            else:
-                geometry.append(None)
-        traj[ID] = traj_id
-        traj['geometry'] = geometry
+        traj[ID] = uniques
+        traj['geometry'] = coords_to_linestrings(coords, ids[order], count)
         traj = gpd.GeoDataFrame(traj)
     return traj
 
 
-def dumpjson(data, path):
+def dumpjson(data, path, precision=None, compression='infer'):
     '''
     将json数据存储为文件
     
-    这个方法主要是解决numpy数值型无法兼容json包报错的问题
+    这个方法主要是解决numpy数值型无法兼容json包报错的问题。
+    GeoJSON的FeatureCollection会逐个Feature写入文件，Feature的坐标可以直接是numpy数组，
+    也可以传入逐个生成Feature的迭代器，此时无需在内存中生成完整的json
 
     Parameters
     -------
-    data : json
-        要储存的json数据
+    data : json或Feature的迭代器
+        要储存的json数据，传入Feature的迭代器时存储为FeatureCollection
     path : str
         保存的路径
+    precision : int
+        可选，GeoJSON坐标保留的小数位数，对FeatureCollection、单个Feature与几何对象生效，不传入则不做处理
+    compression : str
+        可选`gzip`压缩或None不压缩，默认`infer`由文件后缀名是否为.gz判断
+
+    Example
+    -------
+
+    ::
+
+        >>> traj = tbd.points_to_traj(data, timecol='Time')
+        >>> tbd.dumpjson(traj, 'traj.json.gz', precision=6)
     '''
-    import json
-
-    class NpEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, np.integer):
-                return int(obj)
-            elif isinstance(obj, np.floating):
-                return float(obj)
-            elif isinstance(obj, np.ndarray):
-                return obj.tolist()
+    if compression == 'infer':
+        compression = 'gzip' if str(path).endswith('.gz') else None
+    if compression == 'gzip':
+        import gzip
+        f = gzip.open(path, mode='wt', compresslevel=6)
+    elif compression is None:
+        f = open(path, mode='w')
+    else:
+        raise ValueError("compression should be 'gzip', 'infer' or None")
+    encoder = NpEncoder(precision)
+    with f:
+        if isinstance(data, dict) and isinstance(data.get('features'), list):
+            header = {key: value for key, value in data.items()
+                      if key != 'features'}
+            features = data['features']
+        elif isinstance(data, (dict, list)):
+            if precision is not None:
+                data = round_geojson(data, precision)
+            f.write(encoder.encode(data))
+            return
+        else:
+            header = {'type': 'FeatureCollection'}
+            features = data
+        # Everything but the features is written at once, then the features
+        # one by one
+        f.write(encoder.encode(header)[:-1])
+        f.write(', "features": [' if header else '"features": [')
+        chunk, sep = [], ''
+        for feature in features:
+            if precision is not None:
+                feature = round_feature(feature, precision)
+            chunk.append(encoder.encode(feature))
+            if len(chunk) == 1000:
+                f.write(sep + ', '.join(chunk))
+                chunk, sep = [], ', '
+        if chunk:
+            f.write(sep + ', '.join(chunk))
+        f.write(']}')
+
+
+def time_seconds(times):
+    # Epoch seconds of the datetime Series, rounded down
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_convert(None)
+    return times.values.astype('datetime64[ns]').view(np.int64) // 1000000000
+
+
+def traj_records(ids, times):
+    # Positions of the records sorted by id in the order of first appearance
+    # and time with the duplicated (id, time) records dropped, and the
+    # factorized ids in this order
+    ids = pd.factorize(ids, use_na_sentinel=False)[0]
+    index = np.lexsort((times, ids))
+    ids, times = ids[index], times[index]
+    keep = np.ones(len(index), dtype=bool)
+    keep[1:] = (ids[1:] != ids[:-1]) | (times[1:] != times[:-1])
+    return index[keep], ids[keep]
+
+
+def traj_timeline(data, col, timegap):
+    # Records merged with the timeline of each vehicle, whether each row is on
+    # the timeline and whether each row is a record
+    Vehicleid, Time, Lng, Lat = col
+    times = to_datetime(data[Time])
+    index, ids = traj_records(data[Vehicleid], times.values)
+    seconds = time_seconds(times)[index]
+    # The records in the same second are dropped
+    keep = np.ones(len(index), dtype=bool)
+    keep[1:] = (ids[1:] != ids[:-1]) | (seconds[1:] != seconds[:-1])
+    index, ids, seconds = index[keep], ids[keep], seconds[keep]
+    if len(index) == 0:
+        return data.iloc[:0].reset_index(drop=True), \
+            np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+
+    # Timeline of each vehicle within its own time range, aligned to the
+    # first time of all the data
+    first = np.flatnonzero(np.append(True, ids[1:] != ids[:-1]))
+    last = np.append(first[1:], len(ids)) - 1
+    mintime, maxtime = seconds.min(), seconds.max()
+    start = seconds[first] + (mintime - seconds[first]) % timegap
+    end = np.minimum(seconds[last], maxtime - 1)
+    count = np.maximum((end - start) // timegap + 1, 0)
+    vehicle = np.repeat(np.arange(len(first)), count)
+    offset = np.arange(len(vehicle)) - np.repeat(np.cumsum(count) - count,
+                                                 count)
+    gridtime = start[vehicle] + offset * timegap
+    gridid = ids[first][vehicle]
+
+    # Merge the timeline with the records, the records are kept when at the
+    # same time
+    allids = np.concatenate([ids, gridid])
+    alltime = np.concatenate([seconds, gridtime])
+    order = np.lexsort((np.arange(len(allids)), alltime, allids))
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (allids[order][1:] != allids[order][:-1]) | (
+        alltime[order][1:] != alltime[order][:-1])
+    order = order[keep]
+    timeline = ((alltime[order] - mintime) % timegap == 0) & (
+        alltime[order] < maxtime)
+    isgrid = order >= len(ids)
+    grid = order[isgrid] - len(ids)
+    order[isgrid] = len(ids) + np.arange(len(grid))
+    gridtime, gridid, vehicle = gridtime[grid], gridid[grid], vehicle[grid]
+
+    # Interpolate on the time of the records, offset by vehicle so that the
+    # whole data is one increasing sequence
+    span = maxtime - mintime + 1
+    x = (ids * span + seconds - mintime).astype(float)
+    gridx = (gridid * span + gridtime - mintime).astype(float)
+    gridpoints = pd.DataFrame({
+        Vehicleid: data[Vehicleid].take(index[first][vehicle]).values,
+        Time: gridtime})
+    for i in [Lng, Lat]:
+        values = data[i].values.take(index)
+        valid = ~pd.isnull(values)
+        interp = np.interp(gridx, x[valid], coord_float(values[valid]))
+        # The interpolated points are in the dtype of the column
+        if values.dtype == np.int32:
+            interp = np.round(interp * coord_scale)
+        elif values.dtype.kind in 'iu':
+            interp = np.round(interp)
+        gridpoints[i] = interp.astype(values.dtype)
+    data1 = data.take(index).reset_index(drop=True)
+    if not is_epoch_seconds(data[Time]):
+        data1[Time] = times.take(index).reset_index(drop=True)
+        gridpoints[Time] = pd.to_datetime(gridtime, unit='s')
+        if times.dt.tz is not None:
+            gridpoints[Time] = gridpoints[Time].dt.tz_localize(
+                'UTC').dt.tz_convert(times.dt.tz)
+    data1 = pd.concat([data1, gridpoints], ignore_index=True)
+    return data1.take(order).reset_index(drop=True), timeline, ~isgrid
+
+
+def traj_plane(ids, lons, lats):
+    # Plane coordinates in metres, projected at the first latitude of each
+    # vehicle
+    first = np.flatnonzero(np.append(True, ids[1:] != ids[:-1])[:len(ids)])
+    lat0 = np.repeat(lats[first], np.diff(np.append(first, len(ids))))
+    r = 6371000 * np.pi / 180
+    return lons * r * np.cos(np.radians(lat0)), lats * r
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    # Distance from the points to the segments
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    t = ((px - ax) * dx + (py - ay) * dy) / np.where(length > 0, length, 1)
+    t = np.clip(np.where(length > 0, t, 0), 0, 1)
+    return np.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def simplify_keep(method, ids, x, y, tolerance, angle):
+    # Whether to keep each record of the sorted trajectories
+    if method == 'douglas-peucker':
+        return douglas_peucker_keep(ids, x, y, tolerance)
+    if method == 'sliding-window':
+        return sliding_window_keep(ids, x, y, tolerance)
+    return heading_keep(ids, x, y, angle)
+
+
+def douglas_peucker_keep(ids, x, y, tolerance):
+    # Split all the segments at their farthest record in each round
+    n = len(ids)
+    new = np.append(True, ids[1:] != ids[:-1])
+    keep = new | np.append(new[1:], True)
+    position = np.arange(n)
+    rows = np.flatnonzero(~keep)
+    while len(rows):
+        prev = np.maximum.accumulate(np.where(keep, position, 0))[rows]
+        after = np.minimum.accumulate(
+            np.where(keep, position, n)[::-1])[::-1][rows]
+        dis = segment_distance(x[rows], y[rows], x[prev], y[prev],
+                               x[after], y[after])
+        start = np.append(True, prev[1:] != prev[:-1])
+        segment = np.cumsum(start) - 1
+        farthest = np.maximum.reduceat(dis, np.flatnonzero(start))
+        far = np.flatnonzero((dis == farthest[segment]) & (dis > tolerance))
+        far = far[np.append(True, segment[far][1:] != segment[far][:-1])
+                  [:len(far)]]
+        keep[rows[far]] = True
+        # Only the split segments are checked again
+        split = np.zeros(segment[-1] + 1, dtype=bool)
+        split[segment[far]] = True
+        rows = rows[split[segment] & ~keep[rows]]
+    return keep
+
+
+def sliding_window_keep(ids, x, y, tolerance):
+    # Extend the window from the last kept record until a record in it
+    # deviates more than the tolerance
+    n = len(ids)
+    new = np.append(True, ids[1:] != ids[:-1])
+    keep = new | np.append(new[1:], True)
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], n) - 1
+    xs, ys = x.tolist(), y.tolist()
+    for start, end in zip(first.tolist(), last.tolist()):
+        anchor = start
+        for i in range(start + 2, end + 1):
+            if i - anchor > 64:
+                far = (segment_distance(x[anchor + 1:i], y[anchor + 1:i],
+                                        x[anchor], y[anchor], x[i], y[i])
+                       > tolerance).any()
             else:
-                return super(NpEncoder, self).default(obj)
-    f = open(path, mode='w')
-    json.dump(data, f, cls=NpEncoder)
-    f.close()
\ No newline at end of file
+                far = window_far(xs, ys, anchor, i, tolerance)
+            if far:
+                anchor = i - 1
+                keep[anchor] = True
+    return keep
+
+
+def window_far(xs, ys, anchor, end, tolerance):
+    # Whether a record in the short window deviates more than the tolerance
+    # from the segment, in plain Python
+    ax, ay = xs[anchor], ys[anchor]
+    dx, dy = xs[end] - ax, ys[end] - ay
+    length = dx * dx + dy * dy
+    for j in range(anchor + 1, end):
+        px, py = xs[j] - ax, ys[j] - ay
+        t = (px * dx + py * dy) / length if length > 0 else 0
+        t = min(max(t, 0), 1)
+        if math.hypot(px - t * dx, py - t * dy) > tolerance:
+            return True
+    return False
+
+
+def heading_keep(ids, x, y, angle):
+    # Keep the records where the heading turns more than the angle from the
+    # heading at the last kept record, stops are skipped
+    n = len(ids)
+    new = np.append(True, ids[1:] != ids[:-1])
+    keep = new | np.append(new[1:], True)
+    heading = np.degrees(np.arctan2(np.diff(y), np.diff(x))).tolist()
+    moving = ((np.diff(x) != 0) | (np.diff(y) != 0)).tolist()
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], n) - 1
+    for start, end in zip(first.tolist(), last.tolist()):
+        ref = None
+        for i in range(start, end):
+            if not moving[i]:
+                continue
+            if ref is None:
+                ref = heading[i]
+            elif abs((heading[i] - ref + 180) % 360 - 180) > angle:
+                keep[i] = True
+                ref = heading[i]
+    return keep
+
+
+def simplify_error(ids, x, y, keep):
+    # Distance from each record to the simplified trajectory, between the
+    # kept records before and after it
+    n = len(ids)
+    position = np.arange(n)
+    prev = np.maximum.accumulate(np.where(keep, position, 0))
+    after = np.minimum.accumulate(np.where(keep, position, n)[::-1])[::-1]
+    after = np.where((after < n) & (ids[np.minimum(after, n - 1)] == ids),
+                     after, prev)
+    return segment_distance(x, y, x[prev], y[prev], x[after], y[after])
+
+
+def coords_to_linestrings(coords, indices, count):
+    # Linestrings of the grouped coordinates in one call with shapely 2,
+    # None for the groups with less than two points
+    coords = np.asarray(coords, dtype=float)
+    line = count[indices] >= 2
+    geometry = np.full(len(count), None, dtype=object)
+    try:
+        from shapely import linestrings
+    except ImportError:
+        from shapely.geometry import LineString
+        for i in np.flatnonzero(count >= 2):
+            geometry[i] = LineString(coords[indices == i])
+        return geometry
+    if line.any():
+        linestrings(coords[line], indices=indices[line], out=geometry)
+    return geometry
+
+
+class NpEncoder(json.JSONEncoder):
+    # Encode the numpy values, the arrays are rounded to the precision
+    def __init__(self, precision=None, **kwargs):
+        super(NpEncoder, self).__init__(**kwargs)
+        self.precision = precision
+
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.ndarray):
+            if self.precision is not None and obj.dtype.kind == 'f':
+                obj = np.round(obj.astype(float), self.precision)
+            return obj.tolist()
+        else:
+            return super(NpEncoder, self).default(obj)
+
+
+def round_feature(feature, precision):
+    # The feature with its coordinates rounded, nested lists of coordinates
+    # are rounded as an array when rectangular
+    geometry = feature.get('geometry')
+    if not isinstance(geometry, dict):
+        return feature
+    return dict(feature, geometry=round_geojson(geometry, precision))
+
+
+def round_geojson(data, precision):
+    # A Feature, geometry or list of them with the coordinates rounded, other
+    # json is returned as it is
+    if isinstance(data, list):
+        return [round_geojson(i, precision) for i in data]
+    if not isinstance(data, dict):
+        return data
+    if 'coordinates' in data:
+        return dict(data, coordinates=round_coords(data['coordinates'],
+                                                   precision))
+    if isinstance(data.get('geometries'), list):
+        return dict(data, geometries=round_geojson(data['geometries'],
+                                                   precision))
+    return round_feature(data, precision)
+
+
+def round_coords(coords, precision):
+    if isinstance(coords, np.ndarray):
+        return np.round(coords.astype(float), precision) \
+            if coords.dtype.kind == 'f' else coords
+    try:
+        return np.round(np.asarray(coords, dtype=float), precision).tolist()
+    except (ValueError, TypeError):
+        return [round_coords(i, precision) for i in coords]
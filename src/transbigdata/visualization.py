@@ -34,6 +34,7 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 from .traj import points_to_traj
+from .preprocess import to_datetime
 from .grids import (
     area_to_params,
     GPS_to_grid,
@@ -93,7 +94,7 @@ def visualization_trip(trajdata, col=['Lng', 'Lat', 'ID', 'Time'],
     trajdata = trajdata[-((trajdata[Lng].isnull())|(trajdata[Lat].isnull()))]
     trajdata = trajdata[(trajdata[Lng]>=-180)&(trajdata[Lng]<=180)&(trajdata[Lat]>=-90)&(trajdata[Lat]<=90)]
     
-    trajdata[timecol] = pd.to_datetime(trajdata[timecol])
+    trajdata[timecol] = to_datetime(trajdata[timecol])
 
     trajdata = trajdata.sort_values(by=[ID, timecol])
     traj = points_to_traj(trajdata, col=[Lng, Lat, ID], timecol=timecol)